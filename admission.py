@@ -0,0 +1,192 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing a request that can't be served in time."""
+
+    def __init__(self, message, status=503, retry_after=1.0):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Reservation-based token bucket.
+
+    The level may go negative: a reservation that overdraws the bucket is
+    told how long to wait for the refill, which keeps waiters in FIFO order
+    without a separate queue.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        deficit = amount - self.level
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def reserve(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def refund(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Ticket:
+    __slots__ = ("prompt_tokens", "tokens", "used", "waited", "released")
+
+    def __init__(self, prompt_tokens, tokens, waited):
+        self.prompt_tokens = prompt_tokens
+        self.tokens = tokens
+        self.waited = waited
+        self.used = None
+        self.released = False
+
+    def settle(self, used_tokens):
+        self.used = used_tokens
+
+
+class AdmissionController:
+    """Admits upstream LLM calls against requests/minute and tokens/minute budgets.
+
+    Each call reserves one request plus its estimated prompt + completion
+    tokens, waits in a bounded queue until the budget has refilled, and gets
+    the unused part refunded once it settles its actual usage. Calls whose
+    expected queue wait passes ``max_wait`` (or their own deadline) are
+    rejected immediately with a Retry-After hint rather than queued.
+    """
+
+    def __init__(self, rpm=30, tpm=6000, max_queue=64, max_wait=5.0):
+        self.requests = TokenBucket(rpm / 60.0, rpm)
+        self.tokens = TokenBucket(tpm / 60.0, tpm)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _reserve(self, prompt_tokens, completion_tokens, deadline):
+        now = time.monotonic()
+        limit = self.max_wait if deadline is None else min(self.max_wait, max(0.0, deadline - now))
+        with self._lock:
+            tokens = min(prompt_tokens + completion_tokens, self.tokens.capacity)
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > limit:
+                self.rejected += 1
+                raise Overloaded("Upstream rate limit reached, please retry shortly", status=429, retry_after=wait)
+            if wait > 0 and self.queue_depth >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("Too many requests waiting for the model", status=503, retry_after=wait)
+            self.requests.reserve(1, now)
+            self.tokens.reserve(tokens, now)
+            self.admitted += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if wait > 0:
+                self.queue_depth += 1
+                self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return Ticket(prompt_tokens, tokens, wait)
+
+    def _dequeue(self, ticket):
+        with self._lock:
+            self.queue_depth -= 1
+
+    def acquire(self, prompt_tokens, completion_tokens, deadline=None):
+        ticket = self._reserve(prompt_tokens, completion_tokens, deadline)
+        if ticket.waited > 0:
+            try:
+                time.sleep(ticket.waited)
+            except BaseException:
+                self.release(ticket)
+                raise
+            finally:
+                self._dequeue(ticket)
+        return ticket
+
+    async def aacquire(self, prompt_tokens, completion_tokens, deadline=None):
+        ticket = self._reserve(prompt_tokens, completion_tokens, deadline)
+        if ticket.waited > 0:
+            try:
+                await asyncio.sleep(ticket.waited)
+            except BaseException:
+                self.release(ticket)
+                raise
+            finally:
+                self._dequeue(ticket)
+        return ticket
+
+    def release(self, ticket):
+        with self._lock:
+            # A cancelled call is released early, then again as its request unwinds
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.used is None:
+                # Never reached (or was never charged by) the upstream API
+                self.requests.refund(1)
+                self.tokens.refund(ticket.tokens)
+            elif ticket.used < ticket.tokens:
+                self.tokens.refund(ticket.tokens - ticket.used)
+
+    def cancel(self, ticket, produced_tokens):
+        """Releases a cancelled call: the request, its prompt and the tokens produced so far stay charged."""
+        if ticket.used is None:
+            ticket.settle(ticket.prompt_tokens + produced_tokens)
+        self.release(ticket)
+
+    @contextmanager
+    def admit(self, prompt_tokens, completion_tokens, deadline=None):
+        ticket = self.acquire(prompt_tokens, completion_tokens, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aadmit(self, prompt_tokens, completion_tokens, deadline=None):
+        ticket = await self.aacquire(prompt_tokens, completion_tokens, deadline)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_total": round(self.wait_total, 3),
+            "wait_seconds_max": round(self.wait_max, 3),
+        }
+
+
+def create_admission_controller():
+    return AdmissionController(
+        rpm=int(os.getenv("GROQ_RPM", 30)),
+        tpm=int(os.getenv("GROQ_TPM", 6000)),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 64)),
+        max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 5.0)),
+    )
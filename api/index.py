@@ -1 +1,12 @@
-from app import app
\ No newline at end of file
+"""Serverless entry point; vercel.json routes every path here.
+
+Importing it loads Flask and the page assets only. The langchain/Groq
+clients are built by the first chat request, so a cold start that serves
+the landing page doesn't pay for them.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import app
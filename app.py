@@ -1,19 +1,124 @@
-from flask import Flask, render_template_string, request, session, jsonify
+from flask import Flask, Response, abort, make_response, render_template, request, session, jsonify
+from flask.sessions import SecureCookieSessionInterface
 from markupsafe import Markup
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage
-import markdown
+import hmac
+import json
 import os
+import threading
+import time
+import uuid
+
+from admission import Overloaded, create_admission_controller
+from assets import Assets, compress_response
+from batch import fan_out
+from cache import create_response_cache
+from context import count_tokens, create_context_window
+from conversation import Conversation, Message
+from generations import Cancelled, GenerationRegistry
+from metrics import create_metrics, current_timer, phase
+from rendering import render_markdown
+from resilient import create_resilient_llm
+from router import LARGE, SMALL, create_router
+from search import create_search_index
+from singleflight import SingleFlight
+from store import create_store
+from summarizer import create_summarizer
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "your-secret-key")  # Secure key from env
 
-# Groq LLM
-llm = ChatGroq(
-    temperature=0.5,
-    groq_api_key=os.getenv("GROQ_API_KEY", ""),
-    model_name="llama3-70b-8192"
-)
+# Fingerprinted CSS/JS, compressed once at startup and cached by browsers for a year
+assets = Assets(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+app.jinja_env.globals["asset_url"] = assets.url
+
+# Groq LLM. langchain and the clients are built on the first chat request, so a
+# cold start that only serves the page never imports them.
+def make_chat_model(model_name):
+    # CHAT_FAKE_LLM=1 swaps in the local stand-in (fakellm.py), so no key is needed
+    if os.getenv("CHAT_FAKE_LLM", "0") == "1":
+        from fakellm import create_fake_chat_model
+        return create_fake_chat_model(model_name)
+
+    from langchain_groq import ChatGroq
+    model = ChatGroq(
+        temperature=0.5,
+        groq_api_key=os.getenv("GROQ_API_KEY", ""),
+        model_name=model_name
+    )
+    # Real replies appended here can be replayed with FAKE_LLM_REPLAY
+    if os.getenv("CHAT_RECORD_PATH"):
+        from fakellm import RecordingChatModel
+        model = RecordingChatModel(model, os.getenv("CHAT_RECORD_PATH"))
+    return model
+
+LARGE_MODEL = "llama3-70b-8192"
+SMALL_MODEL = os.getenv("GROQ_SMALL_MODEL", "llama3-8b-8192")
+
+llm = None
+small_llm = None
+models_lock = threading.Lock()
+
+def get_model(name):
+    global llm, small_llm
+    if llm is None or (SMALL_MODEL and small_llm is None):
+        with models_lock:
+            # Retries, optional hedging and a circuit breaker that fails over to GROQ_FALLBACK_MODEL;
+            # each retry or hedge takes its own admission ticket
+            if llm is None:
+                llm = create_resilient_llm(make_chat_model(LARGE_MODEL), make_chat_model, None,
+                                           admission, context_window.reply_tokens)
+            if SMALL_MODEL and small_llm is None:
+                small_llm = create_resilient_llm(make_chat_model(SMALL_MODEL), make_chat_model, LARGE_MODEL,
+                                                 admission, context_window.reply_tokens)
+    return small_llm if name == SMALL else llm
+
+# Short, shallow, code-free chats go to the small model (GROQ_SMALL_MODEL="" to disable)
+router = create_router(get_model, small_available=bool(SMALL_MODEL))
+
+# Conversation store: the session cookie only carries the conversation id
+store = create_store()
+
+# Prompt budget: newest messages that fit the model context, minus room for the reply
+context_window = create_context_window()
+
+# Optional full-text index of past messages for /search (CHAT_SEARCH=1), written off the request path
+search_index = create_search_index()
+# Holders of this token search every conversation; everyone else only their own
+SEARCH_ADMIN_TOKEN = os.getenv("CHAT_SEARCH_ADMIN_TOKEN", "")
+SEARCH_PAGE_SIZE = int(os.getenv("CHAT_SEARCH_PAGE_SIZE", 20))
+SEARCH_MAX_PAGE = int(os.getenv("CHAT_SEARCH_MAX_PAGE", 100))
+
+# Exact-match reply cache, opt-in per request ("cache": true) since replies aren't deterministic
+response_cache = create_response_cache()
+
+# Near-duplicate cache for first-turn prompts (CHAT_SEMANTIC_CACHE=1); numpy is only imported when it's on
+semantic_cache = None
+if os.getenv("CHAT_SEMANTIC_CACHE", "0") == "1":
+    from semantic_cache import create_semantic_cache
+    semantic_cache = create_semantic_cache()
+
+# Identical in-flight prompts share one upstream call (CHAT_SINGLEFLIGHT=0 to disable)
+singleflight = SingleFlight() if os.getenv("CHAT_SINGLEFLIGHT", "1") == "1" else None
+
+# Requests/tokens-per-minute budget and bounded wait queue in front of the upstream API
+admission = create_admission_controller()
+
+# Optional rolling summary of the turns that fell out of the window (CHAT_SUMMARIZE=1), within the same budget
+summarizer = create_summarizer(store, admission)
+
+# Server-Timing headers per request and Prometheus histograms on /metrics (CHAT_METRICS=1)
+metrics = create_metrics()
+# Replies in flight, so /cancel, /clear and client disconnects can stop them
+generations = GenerationRegistry()
+
+# /chat_batch fan-out: default and maximum conversations in flight per batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 32))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 10000))
+
+# The page renders only the latest messages; older ones come from /history on scroll
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", 50))
+HISTORY_MAX_PAGE = int(os.getenv("CHAT_HISTORY_MAX_PAGE", 200))
 
 # ----------------------
 # Your HTML_TEMPLATE here
@@ -44,232 +149,9 @@ HTML_TEMPLATE = '''
     <meta name="twitter:image" content="https://via.placeholder.com/1200x630.png?text=Smart Chat AI">
     <meta name="twitter:url" content="https://www.onspace.ai">
     
-    <style>
-        * {
-            font-family: 'Inter', sans-serif;
-        }
-        
-        :root {
-            --bg-primary: linear-gradient(135deg, #0f1419 0%, #1a1f2e 100%);
-            --bg-glass: rgba(255, 255, 255, 0.05);
-            --border-glass: rgba(255, 255, 255, 0.1);
-            --text-primary: #ffffff;
-            --text-secondary: #9ca3af;
-            --text-muted: #6b7280;
-            --chat-user: linear-gradient(135deg, #3b82f6 0%, #1d4ed8 100%);
-            --chat-ai: rgba(75, 85, 99, 0.3);
-            --input-bg: rgba(31, 41, 55, 0.8);
-            --chip-bg: rgba(75, 85, 99, 0.4);
-            --chip-hover: rgba(75, 85, 99, 0.6);
-            --scrollbar-track: rgba(75, 85, 99, 0.2);
-            --scrollbar-thumb: rgba(156, 163, 175, 0.3);
-            --scrollbar-hover: rgba(156, 163, 175, 0.5);
-        }
-        
-        [data-theme="light"] {
-            --bg-primary: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%);
-            --bg-glass: rgba(255, 255, 255, 0.8);
-            --border-glass: rgba(0, 0, 0, 0.1);
-            --text-primary: #1f2937;
-            --text-secondary: #4b5563;
-            --text-muted: #9ca3af;
-            --chat-user: linear-gradient(135deg, #3b82f6 0%, #1d4ed8 100%);
-            --chat-ai: rgba(255, 255, 255, 0.9);
-            --input-bg: rgba(255, 255, 255, 0.9);
-            --chip-bg: rgba(255, 255, 255, 0.7);
-            --chip-hover: rgba(255, 255, 255, 0.9);
-            --scrollbar-track: rgba(0, 0, 0, 0.05);
-            --scrollbar-thumb: rgba(0, 0, 0, 0.2);
-            --scrollbar-hover: rgba(0, 0, 0, 0.3);
-        }
-        
-        body {
-            background: var(--bg-primary);
-            color: var(--text-primary);
-            min-height: 100vh;
-            transition: all 0.3s ease;
-        }
-        
-        .glass-effect {
-            background: var(--bg-glass);
-            backdrop-filter: blur(20px);
-            border: 1px solid var(--border-glass);
-        }
-        
-        .chat-bubble-user {
-            background: var(--chat-user);
-            color: white;
-        }
-        
-        .chat-bubble-ai {
-            background: var(--chat-ai);
-            border: 1px solid var(--border-glass);
-        }
-        
-        .floating-input {
-            background: var(--input-bg);
-            backdrop-filter: blur(20px);
-            border: 1px solid var(--border-glass);
-        }
-        
-        .suggestion-chip {
-            background: var(--chip-bg);
-            border: 1px solid var(--border-glass);
-            transition: all 0.3s ease;
-        }
-        
-        .suggestion-chip:hover {
-            background: var(--chip-hover);
-            transform: translateY(-1px);
-        }
-        
-        .typing-indicator {
-            display: inline-flex;
-            align-items: center;
-            gap: 4px;
-        }
-        
-        .typing-dot {
-            width: 6px;
-            height: 6px;
-            background: var(--text-secondary);
-            border-radius: 50%;
-            animation: typing 1.4s infinite;
-        }
-        
-        .typing-dot:nth-child(2) { animation-delay: 0.2s; }
-        .typing-dot:nth-child(3) { animation-delay: 0.4s; }
-        
-        @keyframes typing {
-            0%, 60%, 100% { transform: translateY(0); opacity: 0.4; }
-            30% { transform: translateY(-10px); opacity: 1; }
-        }
-        
-        .fade-in {
-            animation: fadeIn 0.5s ease-in;
-        }
-        
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        
-        .scroll-smooth {
-            scroll-behavior: smooth;
-        }
-        
-        /* Custom scrollbar */
-        .chat-container::-webkit-scrollbar {
-            width: 6px;
-        }
-        
-        .chat-container::-webkit-scrollbar-track {
-            background: var(--scrollbar-track);
-            border-radius: 3px;
-        }
-        
-        .chat-container::-webkit-scrollbar-thumb {
-            background: var(--scrollbar-thumb);
-            border-radius: 3px;
-        }
-        
-        .chat-container::-webkit-scrollbar-thumb:hover {
-            background: var(--scrollbar-hover);
-        }
-        
-        /* Theme Toggle */
-        .theme-toggle {
-            width: 60px;
-            height: 32px;
-            background: var(--chip-bg);
-            border-radius: 16px;
-            position: relative;
-            cursor: pointer;
-            border: 1px solid var(--border-glass);
-            transition: all 0.3s ease;
-        }
-        
-        .theme-toggle-slider {
-            width: 26px;
-            height: 26px;
-            background: linear-gradient(135deg, #3b82f6, #1d4ed8);
-            border-radius: 50%;
-            position: absolute;
-            top: 2px;
-            left: 2px;
-            transition: transform 0.3s ease;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: white;
-            font-size: 12px;
-        }
-        
-        [data-theme="light"] .theme-toggle-slider {
-            transform: translateX(28px);
-        }
-        
-        /* Markdown styling */
-        .ai-message pre {
-            background: var(--scrollbar-track);
-            border: 1px solid var(--border-glass);
-            border-radius: 8px;
-            padding: 12px;
-            margin: 8px 0;
-            overflow-x: auto;
-        }
-        
-        .ai-message code {
-            background: var(--scrollbar-track);
-            padding: 2px 6px;
-            border-radius: 4px;
-            font-family: 'Courier New', monospace;
-        }
-        
-        .ai-message pre code {
-            background: transparent;
-            padding: 0;
-        }
-        
-        .ai-message h1, .ai-message h2, .ai-message h3 {
-            color: var(--text-primary);
-            margin: 16px 0 8px 0;
-        }
-        
-        .ai-message ul, .ai-message ol {
-            margin: 8px 0;
-            padding-left: 20px;
-        }
-        
-        .ai-message li {
-            margin: 4px 0;
-        }
-        
-        .ai-message blockquote {
-            border-left: 4px solid #3b82f6;
-            padding-left: 16px;
-            margin: 16px 0;
-            font-style: italic;
-            opacity: 0.9;
-        }
-
-        /* Light mode text colors */
-        [data-theme="light"] .text-white { color: var(--text-primary) !important; }
-        [data-theme="light"] .text-gray-300 { color: var(--text-secondary) !important; }
-        [data-theme="light"] .text-gray-400 { color: var(--text-muted) !important; }
-        [data-theme="light"] .text-gray-500 { color: var(--text-muted) !important; }
-        
-        /* Light mode shadows */
-        [data-theme="light"] .glass-effect {
-            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1), 0 2px 4px -1px rgba(0, 0, 0, 0.06);
-        }
-        
-        [data-theme="light"] .chat-bubble-ai {
-            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/app.css') }}">
 </head>
-<body class="text-white">
+<body class="text-white" data-chat-started="{{ 'true' if chat_history else 'false' }}">
     <!-- Header -->
     <header class="fixed top-0 left-0 right-0 z-50 glass-effect">
         <div class="max-w-4xl mx-auto px-6 py-4 flex items-center justify-between">
@@ -348,7 +230,7 @@ HTML_TEMPLATE = '''
         <!-- Chat Container -->
         <div id="chatContainer" class="flex-1 {% if not chat_history %}hidden{% endif %}">
             <div class="max-w-4xl mx-auto px-6 h-full flex flex-col">
-                <div class="chat-container flex-1 overflow-y-auto space-y-6 py-6 scroll-smooth max-h-[calc(100vh-200px)]" id="chatHistory">
+                <div class="chat-container flex-1 overflow-y-auto space-y-6 py-6 scroll-smooth max-h-[calc(100vh-200px)]" id="chatHistory"{% if history_cursor is not none %} data-before="{{ history_cursor }}"{% endif %}>
                     <!-- Load existing chat history -->
                     {% for message in chat_history %}
                     <div class="fade-in {% if message.role == 'user' %}ml-12{% else %}mr-12{% endif %}">
@@ -361,7 +243,9 @@ HTML_TEMPLATE = '''
                                 {% endif %}
                                 <div class="flex-1">
                                     <div class="text-white text-base leading-relaxed {% if message.role == 'ai' %}ai-message{% endif %}">
-                                        {% if message.role == 'ai' %}
+                                        {% if message.role == 'ai' and message.html %}
+                                            {{ message.html | safe }}
+                                        {% elif message.role == 'ai' %}
                                             {{ message.content | markdown | safe }}
                                         {% else %}
                                             {{ message.content }}
@@ -407,266 +291,7 @@ HTML_TEMPLATE = '''
         </div>
     </div>
 
-    <!-- Loading Overlay -->
-    <div id="loadingOverlay" class="fixed inset-0 bg-black bg-opacity-50 backdrop-blur-sm flex items-center justify-center z-50 hidden">
-        <div class="glass-effect rounded-2xl p-8 text-center">
-            <div class="typing-indicator mb-4">
-                <div class="typing-dot"></div>
-                <div class="typing-dot"></div>
-                <div class="typing-dot"></div>
-            </div>
-            <p class="text-gray-300">AI is thinking...</p>
-        </div>
-    </div>
-
-    <script>
-        // Theme Management
-        const themeToggle = document.getElementById('themeToggle');
-        const themeIcon = document.getElementById('themeIcon');
-        
-        // Initialize theme from localStorage or default to dark
-        const savedTheme = localStorage.getItem('theme') || 'dark';
-        document.documentElement.setAttribute('data-theme', savedTheme);
-        updateThemeIcon(savedTheme);
-        
-        themeToggle.addEventListener('click', () => {
-            const currentTheme = document.documentElement.getAttribute('data-theme');
-            const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
-            
-            document.documentElement.setAttribute('data-theme', newTheme);
-            localStorage.setItem('theme', newTheme);
-            updateThemeIcon(newTheme);
-        });
-        
-        function updateThemeIcon(theme) {
-            themeIcon.className = theme === 'dark' ? 'fas fa-moon' : 'fas fa-sun';
-        }
-
-        // DOM Elements
-        const messageInput = document.getElementById('messageInput');
-        const sendBtn = document.getElementById('sendBtn');
-        const chatHistory = document.getElementById('chatHistory');
-        const welcomeSection = document.getElementById('welcomeSection');
-        const chatContainer = document.getElementById('chatContainer');
-        const suggestionChips = document.querySelectorAll('.suggestion-chip');
-        const loadingOverlay = document.getElementById('loadingOverlay');
-        const attachBtn = document.getElementById('attachBtn');
-        const upgradeBtn = document.getElementById('upgradeBtn');
-        const clearBtn = document.getElementById('clearBtn');
-
-        // Chat state
-        let isLoading = false;
-        let chatStarted = {{ 'true' if chat_history else 'false' }};
-
-        // Initialize
-        document.addEventListener('DOMContentLoaded', function() {
-            messageInput.focus();
-            if (chatStarted) {
-                scrollToBottom();
-            }
-        });
-
-        // Event Listeners
-        messageInput.addEventListener('keypress', function(e) {
-            if (e.key === 'Enter' && !e.shiftKey) {
-                e.preventDefault();
-                sendMessage();
-            }
-        });
-
-        messageInput.addEventListener('input', function() {
-            const hasContent = this.value.trim().length > 0;
-            sendBtn.classList.toggle('text-blue-400', hasContent);
-            sendBtn.classList.toggle('text-gray-500', !hasContent);
-        });
-
-        sendBtn.addEventListener('click', sendMessage);
-
-        suggestionChips.forEach(chip => {
-            chip.addEventListener('click', function() {
-                const suggestion = this.dataset.suggestion;
-                messageInput.value = suggestion;
-                sendMessage();
-            });
-        });
-
-        clearBtn.addEventListener('click', clearChat);
-
-        attachBtn.addEventListener('click', function() {
-            showToast('File attachment feature coming soon!', 'info');
-        });
-
-        upgradeBtn.addEventListener('click', function() {
-            showToast('Upgrade feature coming soon!', 'info');
-        });
-
-        // Functions
-        async function sendMessage() {
-            const message = messageInput.value.trim();
-            if (!message || isLoading) return;
-
-            if (!chatStarted) {
-                startChat();
-            }
-
-            // Add user message
-            addMessage(message, 'user');
-            messageInput.value = '';
-            
-            // Show loading
-            showLoading();
-
-            try {
-                const response = await fetch('/chat_api', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ message: message })
-                });
-
-                if (!response.ok) {
-                    throw new Error(`HTTP error! status: ${response.status}`);
-                }
-
-                const data = await response.json();
-                
-                if (data.error) {
-                    throw new Error(data.error);
-                }
-
-                // Add AI response with markdown support
-                addMessage(data.ai_response, 'ai');
-                
-            } catch (error) {
-                console.error('Error:', error);
-                addMessage('Sorry, I encountered an error. Please try again.', 'ai', true);
-                showToast('Failed to send message. Please try again.', 'error');
-            } finally {
-                hideLoading();
-            }
-        }
-
-        function startChat() {
-            chatStarted = true;
-            welcomeSection.classList.add('hidden');
-            chatContainer.classList.remove('hidden');
-        }
-
-        function addMessage(content, role, isError = false) {
-            const messageDiv = document.createElement('div');
-            messageDiv.className = `fade-in ${role === 'user' ? 'ml-12' : 'mr-12'}`;
-            
-            const bubbleClass = role === 'user' ? 'chat-bubble-user ml-auto' : 'chat-bubble-ai';
-            const textColor = isError ? 'text-red-300' : 'text-white';
-            
-            let messageContent = content;
-            if (role === 'ai' && !isError) {
-                // For AI messages, we'll handle markdown on the server side
-                messageContent = escapeHtml(content);
-            } else {
-                messageContent = escapeHtml(content);
-            }
-            
-            messageDiv.innerHTML = `
-                <div class="${bubbleClass} max-w-2xl rounded-2xl p-4">
-                    <div class="flex items-start space-x-3">
-                        ${role === 'ai' ? `
-                                <div class="w-8 h-8 rounded-lg bg-white bg-opacity-10 flex items-center justify-center flex-shrink-0 mt-1">
-                                    <img src="https://cdn-ai.onspace.ai/onspace/project/image/dJhJe8NZY5jRCbtAbBVTbf/bot.png" alt="Smart Chat AI" class="w-5 h-5 object-contain">
-                                </div>
-                        ` : ''}
-                        <div class="flex-1">
-                            <div class="${textColor} text-base leading-relaxed" style="white-space: pre-wrap;">${messageContent}</div>
-                        </div>
-                    </div>
-                </div>
-            `;
-            
-            chatHistory.appendChild(messageDiv);
-            scrollToBottom();
-        }
-
-        function showLoading() {
-            isLoading = true;
-            loadingOverlay.classList.remove('hidden');
-            sendBtn.disabled = true;
-        }
-
-        function hideLoading() {
-            isLoading = false;
-            loadingOverlay.classList.add('hidden');
-            sendBtn.disabled = false;
-            messageInput.focus();
-        }
-
-        function scrollToBottom() {
-            setTimeout(() => {
-                chatHistory.scrollTop = chatHistory.scrollHeight;
-            }, 100);
-        }
-
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
-        }
-
-        function showToast(message, type = 'info') {
-            const toast = document.createElement('div');
-            const bgColor = type === 'error' ? 'bg-red-500' : type === 'success' ? 'bg-green-500' : 'bg-blue-500';
-            
-            toast.className = `fixed top-24 right-6 ${bgColor} text-white px-6 py-3 rounded-lg shadow-lg z-50 transform translate-x-full transition-transform duration-300`;
-            toast.textContent = message;
-            
-            document.body.appendChild(toast);
-            
-            setTimeout(() => {
-                toast.classList.remove('translate-x-full');
-            }, 100);
-            
-            setTimeout(() => {
-                toast.classList.add('translate-x-full');
-                setTimeout(() => {
-                    if (document.body.contains(toast)) {
-                        document.body.removeChild(toast);
-                    }
-                }, 300);
-            }, 3000);
-        }
-
-        async function clearChat() {
-            if (!confirm('Are you sure you want to clear the chat history?')) {
-                return;
-            }
-            
-            try {
-                const response = await fetch('/clear');
-                if (response.ok) {
-                    // Reload the page to show welcome section
-                    window.location.reload();
-                } else {
-                    throw new Error('Failed to clear chat');
-                }
-            } catch (error) {
-                console.error('Error clearing chat:', error);
-                showToast('Failed to clear chat history', 'error');
-            }
-        }
-
-        // Keyboard shortcuts
-        document.addEventListener('keydown', function(e) {
-            if ((e.ctrlKey || e.metaKey) && e.key === 'k') {
-                e.preventDefault();
-                messageInput.focus();
-            }
-            
-            if (e.key === 'Escape') {
-                messageInput.value = '';
-                messageInput.focus();
-            }
-        });
-    </script>
+    <script src="{{ asset_url('js/app.js') }}"></script>
 </body>
 </html>
 '''
@@ -674,57 +299,503 @@ HTML_TEMPLATE = '''
 
 @app.template_filter("markdown")
 def markdown_filter(text):
-    return Markup(markdown.markdown(text, extensions=["fenced_code", "codehilite"]))
+    with phase("markdown"):
+        return Markup(render_markdown(text))
+
+# Compiled once at startup instead of on every request
+page_template = app.jinja_env.from_string(HTML_TEMPLATE)
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    # Opening the session is the first per-request step, so the request timer starts here
+    def open_session(self, app, request):
+        timer = metrics.start_request()
+        with timer.phase("session"):
+            return super().open_session(app, request)
+
+if metrics is not None:
+    app.session_interface = TimedSessionInterface()
+
+# Registered before compress() so it runs after it and the header includes compression
+@app.after_request
+def server_timing(response):
+    timer = current_timer.get()
+    if timer is not None:
+        response.headers["Server-Timing"] = timer.server_timing()
+        if not response.is_streamed:
+            metrics.finish_request(timer, request.endpoint)
+        if response.status_code >= 500 or response.status_code == 429:
+            metrics.errors.inc(str(response.status_code))
+    return response
+
+@app.after_request
+def compress(response):
+    with phase("compress"):
+        return compress_response(response, request.accept_encodings)
+
+@app.route("/assets/<path:path>")
+def asset(path):
+    response = assets.response(path, request)
+    if response is None:
+        abort(404)
+    return response
+
+def conversation_id():
+    cid = session.get("cid")
+    if cid is None:
+        cid = session["cid"] = uuid.uuid4().hex
+    return cid
 
 @app.route("/")
 def index():
-    if "chat_history" not in session:
-        session["chat_history"] = []
-    return render_template_string(HTML_TEMPLATE, chat_history=session["chat_history"])
+    with phase("store"):
+        chat_history, more = store.page(conversation_id(), limit=HISTORY_PAGE_SIZE)
+    with phase("template"):
+        response = make_response(render_template(page_template, chat_history=chat_history,
+                                                 history_cursor=chat_history[0].id if more else None))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    # Compress before tagging so each encoding gets its own ETag
+    response = compress_response(response, request.accept_encodings)
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route("/history")
+def history():
+    before = request.args.get("before", type=int)
+    limit = max(1, min(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), HISTORY_MAX_PAGE))
+    with phase("store"):
+        messages, more = store.page(conversation_id(), before, limit)
+    with phase("markdown"):
+        page = [m.to_dict() for m in messages]
+        for message in page:
+            if message["role"] == "ai" and "html" not in message:
+                message["html"] = render_markdown(message["content"])
+    return jsonify({"messages": page, "before": messages[0].id if more else None})
+
+def begin_turn(cid, user_input, is_edit):
+    message = Message("user", user_input)
+    with phase("store"):
+        edited = store.load(cid).last("user") if is_edit else None
+        if edited is not None:
+            # The edit becomes a sibling of the edited message; the old branch stays in the tree
+            parent = edited.parent
+            conversation = store.fork(cid, None if parent is None else parent.id, message)
+        else:
+            conversation = store.append(cid, message)
+    if search_index is not None:
+        search_index.add(cid, conversation.head)
+
+    if metrics is not None:
+        metrics.history.observe(len(conversation))
+    with phase("prompt"):
+        return build_prompt(conversation, cid)
+
+def build_prompt(chat_history, cid=None):
+    # Without a stored conversation (batch items) there is nothing to summarize into
+    messages = []
+    if summarizer is None or cid is None:
+        window = context_window.select(chat_history)
+    else:
+        summary = summarizer.current(cid, chat_history)
+        window = context_window.select(chat_history, summarizer.budget(context_window.budget, summary))
+        if summary is not None:
+            messages.append(summarizer.message(summary))
+            window.prompt_tokens += summary["tokens"]
+        if window.dropped_messages > (summary["upto"] if summary else 0):
+            summarizer.refresh(cid, window.dropped_messages, get_model(LARGE))
+
+    # Each record builds its langchain message once and reuses it on later turns
+    messages.extend(m.to_langchain() for m in window.messages)
+    return messages, window
+
+def finish_turn(cid, content):
+    # Rendered once here, then served from the store on every page load
+    with phase("markdown"):
+        html = render_markdown(content)
+    with phase("store"):
+        conversation = store.append(cid, Message("ai", content, html=html))
+    if search_index is not None:
+        search_index.add(cid, conversation.head)
+    return html
+
+def cache_namespace(model):
+    return f"{getattr(model, 'model_name', '')}:{getattr(model, 'temperature', None)}"
+
+def prompt_key(messages, route):
+    return response_cache.key(messages, route.model)
+
+def cached_reply(key, messages, route):
+    with phase("cache"):
+        content = response_cache.get(key)
+        if content is None and semantic_cache is not None and len(messages) == 1:
+            content = semantic_cache.get(cache_namespace(route.model), messages[0].content)
+    if metrics is not None:
+        metrics.cache.inc("miss" if content is None else "hit")
+    return content
+
+def remember_reply(key, messages, route, content):
+    response_cache.set(key, content)
+    if semantic_cache is not None and len(messages) == 1:
+        semantic_cache.set(cache_namespace(route.model), messages[0].content, content)
+
+def token_usage(response, ticket):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage["input_tokens"], usage["output_tokens"]
+    return ticket.prompt_tokens, count_tokens(response.content)
+
+def record_call(route, ticket, seconds, prompt_tokens, completion_tokens, ttft=None):
+    router.record(route.name, seconds)
+    ticket.settle(prompt_tokens + completion_tokens)
+    if metrics is not None:
+        metrics.observe_llm(route.name, seconds, prompt_tokens, completion_tokens, ttft)
+
+def record_cancel(generation, route, produced_tokens=None):
+    # produced_tokens is None when the upstream call ran to completion anyway
+    if metrics is None:
+        return
+    saved = 0 if produced_tokens is None else max(0, context_window.reply_tokens - produced_tokens)
+    metrics.observe_cancel(route.name, generation.reason, saved)
+
+def generate_reply(key, messages, route, prompt_tokens):
+    # Only the call that actually reaches the API takes an admission ticket;
+    # coalesced followers wait for its result without one
+    def call():
+        with phase("queue"):
+            ticket = admission.acquire(prompt_tokens, context_window.reply_tokens)
+        try:
+            with phase("llm"):
+                start = time.monotonic()
+                response = route.model.invoke(messages)
+            record_call(route, ticket, time.monotonic() - start, *token_usage(response, ticket))
+            return response.content
+        finally:
+            admission.release(ticket)
+    return call() if singleflight is None else singleflight.do(key, call)
+
+def stream_reply(key, messages, route, prompt_tokens):
+    # The upstream stream owns the admission ticket. Its first piece is empty
+    # and tells every subscriber the call was admitted.
+    def pieces():
+        ticket = admission.acquire(prompt_tokens, context_window.reply_tokens)
+        parts = None
+        try:
+            yield ""
+            start = time.monotonic()
+            ttft = None
+            parts = []
+            for chunk in route.model.stream(messages):
+                if chunk.content:
+                    ttft = ttft if ttft is not None else time.monotonic() - start
+                    parts.append(chunk.content)
+                    yield chunk.content
+            record_call(route, ticket, time.monotonic() - start, ticket.prompt_tokens,
+                        count_tokens("".join(parts)), ttft)
+        except GeneratorExit:
+            # Every subscriber went away; a started call keeps its prompt and output so far charged
+            if parts is not None:
+                admission.cancel(ticket, count_tokens("".join(parts)))
+            raise
+        finally:
+            admission.release(ticket)
+    return pieces() if singleflight is None else singleflight.stream(key, pieces)
+
+def reply_to(messages, window, model=None, use_cache=False, generation=None):
+    route = router.route(messages, window, model)
+    key = prompt_key(messages, route)
+    content = cached_reply(key, messages, route) if use_cache else None
+    cached = content is not None
+    if not cached:
+        # A blocking invoke can't be interrupted, so a cancel doesn't free its budget early
+        content = generate_reply(key, messages, route, window.prompt_tokens)
+        if generation is not None and generation.cancelled:
+            record_cancel(generation, route)
+            raise Cancelled(generation.reason)
+        if use_cache:
+            remember_reply(key, messages, route, content)
+    return content, cached, route
+
+def error_status(e):
+    if isinstance(e, Cancelled):
+        return e.status, {}
+    if isinstance(e, Overloaded):
+        return e.status, {"Retry-After": e.retry_after_header}
+    if getattr(e, "status_code", None) == 429:
+        # Upstream rate limit: pass it on instead of turning it into a 500
+        retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+        return 429, {"Retry-After": retry_after} if retry_after else {}
+    return 500, {}
+
+def error_response(e):
+    status, headers = error_status(e)
+    return jsonify({"error": str(e)}), status, headers
 
 @app.route("/chat_api", methods=["POST"])
 def chat_api():
-    if "chat_history" not in session:
-        session["chat_history"] = []
+    cid = conversation_id()
 
     data = request.get_json()
     user_input = data.get("message", "").strip()
     is_edit = data.get("is_edit", False)
+    use_cache = data.get("cache", False)
 
     if user_input:
-        chat_history = session["chat_history"]
-
-        if is_edit:
-            for i in range(len(chat_history) - 1, -1, -1):
-                if chat_history[i]["role"] == "user":
-                    chat_history[i]["content"] = user_input
-                    chat_history = chat_history[:i+1]
-                    break
-        else:
-            chat_history.append({"role": "user", "content": user_input})
-
-        session["chat_history"] = chat_history
-
-        messages = []
-        for msg in chat_history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
+        messages, window = begin_turn(cid, user_input, is_edit)
+        generation = generations.start(cid, data.get("generation_id"))
 
         try:
-            response = llm.invoke(messages)
-            chat_history.append({"role": "ai", "content": response.content})
-            session["chat_history"] = chat_history
+            content, cached, route = reply_to(messages, window, data.get("model"), use_cache, generation)
+            html = finish_turn(cid, content)
 
-            return jsonify({"ai_response": response.content})
+            return jsonify({"ai_response": content, "ai_html": html, "cached": cached,
+                            "context": window.stats(), "route": route.stats(),
+                            "generation_id": generation.id})
 
         except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            return error_response(e)
+        finally:
+            generations.finish(generation)
 
     return jsonify({"error": "Empty message"}), 400
 
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/chat_stream", methods=["POST"])
+def chat_stream():
+    cid = conversation_id()
+
+    data = request.get_json()
+    user_input = data.get("message", "").strip()
+    is_edit = data.get("is_edit", False)
+    use_cache = data.get("cache", False)
+
+    if not user_input:
+        return jsonify({"error": "Empty message"}), 400
+
+    messages, window = begin_turn(cid, user_input, is_edit)
+    route = router.route(messages, window, data.get("model"))
+
+    key = prompt_key(messages, route)
+    content = cached_reply(key, messages, route) if use_cache else None
+    cached = content is not None
+    pieces = None if cached else stream_reply(key, messages, route, window.prompt_tokens)
+    try:
+        # Waits for this call (or the identical one it joined) to be admitted,
+        # so rejections still get a real 429/503 before the stream starts
+        with phase("queue"):
+            if pieces is not None:
+                next(pieces)
+    except Overloaded as e:
+        return error_response(e)
+    timer = current_timer.get()
+    generation = generations.start(cid, data.get("generation_id"))
+
+    def generate():
+        try:
+            yield sse("start", {"generation_id": generation.id})
+            yield from reply_events()
+        finally:
+            generations.finish(generation)
+
+    def reply_events():
+        nonlocal content
+        if cached:
+            yield sse("token", {"content": content})
+        else:
+            parts = []
+            start = time.perf_counter()
+            # Wakes a coalesced subscriber still waiting for its first chunk;
+            # a direct upstream stream only notices the cancel at its next chunk
+            cancel = getattr(pieces, "cancel", None)
+            if cancel is not None:
+                generation.on_cancel(cancel)
+            try:
+                for piece in pieces:
+                    if not parts and timer is not None:
+                        timer.add("ttft", time.perf_counter() - start)
+                    parts.append(piece)
+                    yield sse("token", {"content": piece})
+                    if generation.cancelled:
+                        break
+            except GeneratorExit:
+                # The client went away; the WSGI server closes the response mid-stream
+                generation.cancel("disconnect")
+                raise
+            except Exception as e:
+                if timer is not None:
+                    metrics.errors.inc("stream")
+                    metrics.finish_request(timer, "chat_stream")
+                yield sse("error", {"error": str(e)})
+                return
+            finally:
+                # Closing the stream stops the upstream call (once no coalesced caller still wants it)
+                pieces.close()
+                if generation.cancelled:
+                    record_cancel(generation, route, count_tokens("".join(parts)))
+            if generation.cancelled:
+                # Nothing is written to a history the user abandoned (or cleared)
+                if timer is not None:
+                    metrics.finish_request(timer, "chat_stream")
+                yield sse("cancelled", {"ai_response": "".join(parts)})
+                return
+            if timer is not None and parts:
+                timer.add("generation", time.perf_counter() - start - timer.phases["ttft"])
+            content = "".join(parts)
+            if use_cache:
+                remember_reply(key, messages, route, content)
+
+        # The finished reply is written to the history once, at the end
+        html = finish_turn(cid, content)
+        done = {"ai_response": content, "ai_html": html, "cached": cached,
+                "context": window.stats(), "route": route.stats(), "generation_id": generation.id}
+        if timer is not None:
+            # Headers are long gone by now; the full breakdown rides on the final event
+            done["timing"] = timer.server_timing()
+            metrics.finish_request(timer, "chat_stream")
+        yield sse("done", done)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def batch_history(conversation):
+    if isinstance(conversation, str):
+        conversation = {"message": conversation}
+    if "messages" in conversation:
+        turns = conversation["messages"]
+    else:
+        turns = [{"role": "user", "content": conversation.get("message", "")}]
+    history = Conversation()
+    for turn in turns:
+        role = "ai" if turn.get("role") in ("ai", "assistant") else "user"
+        history.append(Message(role, str(turn.get("content", "")).strip()))
+    if not history or history[-1].role != "user" or not history[-1].content:
+        raise ValueError("Conversation must end with a non-empty user message")
+    return history
+
+def batch_reply(conversation, model=None, use_cache=False):
+    messages, window = build_prompt(batch_history(conversation))
+    if isinstance(conversation, dict):
+        model = conversation.get("model", model)
+    while True:
+        try:
+            content, cached, route = reply_to(messages, window, model, use_cache)
+            break
+        except Overloaded as e:
+            # Offline work waits for the rate limit instead of failing the item
+            time.sleep(e.retry_after)
+    return {"ai_response": content, "cached": cached, "context": window.stats(), "route": route.stats()}
+
+def run_batch(conversations, concurrency=None, model=None, use_cache=False):
+    """Answers independent conversations concurrently, yielding results as they complete.
+
+    Each conversation is a prompt string, {"message": ...} or {"messages": [...]}
+    ending in a user turn, with optional "id" and "model". Results carry the
+    item's "index" and "id"; a failed item yields "error" and "status"
+    instead of aborting the batch.
+    """
+    concurrency = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    for index, conversation, result, error in fan_out(
+            lambda conversation: batch_reply(conversation, model, use_cache), conversations, concurrency):
+        item = {"index": index, "id": conversation.get("id") if isinstance(conversation, dict) else None}
+        if error is None:
+            item.update(result)
+        else:
+            item.update({"error": str(error), "status": 400 if isinstance(error, ValueError) else error_status(error)[0]})
+        yield item
+
+@app.route("/chat_batch", methods=["POST"])
+def chat_batch():
+    data = request.get_json(silent=True) or {}
+    conversations = data.get("conversations")
+    if not isinstance(conversations, list) or not conversations:
+        return jsonify({"error": "Expected a non-empty \"conversations\" list"}), 400
+    if len(conversations) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} conversations per batch"}), 413
+    if not isinstance(data.get("concurrency", 0), int):
+        return jsonify({"error": "\"concurrency\" must be an integer"}), 400
+
+    results = run_batch(conversations, data.get("concurrency"), data.get("model"), data.get("cache", False))
+    return Response((json.dumps(item) + "\n" for item in results), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no"})
+
+@app.route("/branches")
+def branches():
+    conversation = store.load(conversation_id())
+    head = conversation.head
+    return jsonify({"head": None if head is None else head.id, "forks": conversation.forks()})
+
+@app.route("/branch", methods=["POST"])
+def branch():
+    cid = conversation_id()
+    data = request.get_json(silent=True) or {}
+    conversation = store.load(cid)
+    node_id = data.get("message_id")
+    if not isinstance(node_id, int) or not 0 <= node_id < len(conversation.nodes):
+        return jsonify({"error": "Unknown message"}), 404
+
+    # Switching to a message resumes the newest branch below it
+    head = conversation.leaf(node_id).id
+    conversation = store.switch(cid, head)
+    return jsonify({"head": head, "messages": len(conversation), "forks": conversation.forks()})
+
+def search_admin():
+    auth = request.headers.get("Authorization", "")
+    return bool(SEARCH_ADMIN_TOKEN) and hmac.compare_digest(auth.encode(), f"Bearer {SEARCH_ADMIN_TOKEN}".encode())
+
+@app.route("/search")
+def search():
+    if search_index is None:
+        abort(404)
+    text = request.args.get("q", "").strip()
+    limit = max(1, min(request.args.get("limit", SEARCH_PAGE_SIZE, type=int), SEARCH_MAX_PAGE))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    admin = search_admin()
+    cid = (request.args.get("cid") or None) if admin else conversation_id()
+    with phase("search"):
+        results, more = search_index.search(text, cid, limit, offset)
+    if not admin:
+        for result in results:
+            del result["cid"]
+    # message_id works with /branch to jump to the matching turn
+    return jsonify({"results": results, "next": offset + limit if more else None})
+
+@app.route("/stats")
+def stats():
+    stats = {"cache": response_cache.stats()}
+    if semantic_cache is not None:
+        stats["semantic_cache"] = semantic_cache.stats()
+    if singleflight is not None:
+        stats["singleflight"] = {"shared": singleflight.shared}
+    stats["admission"] = admission.stats()
+    if hasattr(llm, "stats"):
+        stats["llm"] = llm.stats()
+    if hasattr(small_llm, "stats"):
+        stats["small_llm"] = small_llm.stats()
+    stats["router"] = router.stats()
+    stats["generations"] = generations.stats()
+    if search_index is not None:
+        stats["search"] = search_index.stats()
+    return jsonify(stats)
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if metrics is None:
+        abort(404)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cancel", methods=["POST"])
+def cancel():
+    data = request.get_json(silent=True) or {}
+    cancelled = generations.cancel(conversation_id(), data.get("generation_id"))
+    return jsonify({"cancelled": cancelled})
+
 @app.route("/clear")
 def clear():
-    session.pop("chat_history", None)
+    cid = session.pop("cid", None)
+    if cid is not None:
+        generations.cancel(cid, reason="clear")
+        store.delete(cid)
+        if search_index is not None:
+            search_index.delete(cid)
     return jsonify({"status": "cleared"})
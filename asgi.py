@@ -0,0 +1,520 @@
+"""Async serving mode.
+
+The chat endpoints run on the event loop and await ``llm.ainvoke`` /
+``llm.astream``, so one process can hold hundreds of in-flight chats while
+upstream I/O is pending. Store, cache and rendering calls go through
+``asyncio.to_thread`` to keep the loop unblocked. Every other route is
+served by the Flask app through asgiref's WSGI adapter. ``/ws`` is a
+WebSocket alternative to the chat endpoints for clients that send many
+messages over one connection (the server needs WebSocket support, e.g.
+``uvicorn[standard]``).
+
+    uvicorn asgi:application
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from http.cookies import CookieError, SimpleCookie
+
+from asgiref.wsgi import WsgiToAsgi
+from flask.sessions import SecureCookieSession
+from itsdangerous import BadSignature
+from werkzeug.http import dump_cookie
+
+import app as chat_app
+from admission import Overloaded
+from generations import Cancelled
+from app import sse
+from metrics import current_timer, phase
+from router import LARGE
+
+logger = logging.getLogger(__name__)
+
+wsgi = WsgiToAsgi(chat_app.app)
+
+WS_MAX_CONNECTIONS = int(os.getenv("CHAT_WS_MAX_CONNECTIONS", 1000))
+# Clients ping every 25s; silence for this long means the peer is gone
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("CHAT_WS_HEARTBEAT_TIMEOUT", 60))
+WS_IDLE_TIMEOUT = float(os.getenv("CHAT_WS_IDLE_TIMEOUT", 600))
+ws_connections = 0
+
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+class Session:
+    """Reads and writes the same signed cookie as Flask's default session."""
+
+    def __init__(self, scope):
+        flask_app = chat_app.app
+        self._interface = flask_app.session_interface
+        self.cookie_name = self._interface.get_cookie_name(flask_app)
+        self.max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        self._serializer = self._interface.get_signing_serializer(flask_app)
+        self.data = {}
+        self.modified = False
+        try:
+            morsel = SimpleCookie(header(scope, b"cookie")).get(self.cookie_name)
+        except CookieError:
+            morsel = None
+        if morsel is not None:
+            try:
+                self.data = dict(self._serializer.loads(morsel.value, max_age=self.max_age))
+            except BadSignature:
+                pass
+
+    def conversation_id(self):
+        cid = self.data.get("cid")
+        if cid is None:
+            cid = self.data["cid"] = uuid.uuid4().hex
+            self.modified = True
+        return cid
+
+    def headers(self):
+        if not self.modified:
+            return []
+        # Same attributes as Flask's save_session, so SESSION_COOKIE_* settings apply to both paths
+        flask_app = chat_app.app
+        interface = self._interface
+        cookie = dump_cookie(
+            self.cookie_name,
+            self._serializer.dumps(self.data),
+            expires=interface.get_expiration_time(flask_app, SecureCookieSession(self.data)),
+            path=interface.get_cookie_path(flask_app),
+            domain=interface.get_cookie_domain(flask_app),
+            secure=interface.get_cookie_secure(flask_app),
+            httponly=interface.get_cookie_httponly(flask_app),
+            samesite=interface.get_cookie_samesite(flask_app),
+            partitioned=interface.get_cookie_partitioned(flask_app),
+        )
+        return [(b"set-cookie", cookie.encode("latin-1"))]
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return {}
+
+
+def timing_headers():
+    timer = current_timer.get()
+    return [] if timer is None else [(b"server-timing", timer.server_timing().encode())]
+
+
+async def send_json(send, status, payload, session, headers=None):
+    body = json.dumps(payload).encode()
+    extra = [(k.lower().encode(), str(v).encode()) for k, v in (headers or {}).items()] + timing_headers()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + extra + session.headers(),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_error(send, e, session):
+    status, headers = chat_app.error_status(e)
+    if chat_app.metrics is not None:
+        chat_app.metrics.errors.inc(str(status))
+    await send_json(send, status, {"error": str(e)}, session, headers)
+
+
+async def generate_reply(key, messages, route, prompt_tokens):
+    # Only the call that reaches the API takes an admission ticket, as in app.generate_reply
+    async def call():
+        with phase("queue"):
+            ticket = await chat_app.admission.aacquire(prompt_tokens, chat_app.context_window.reply_tokens)
+        try:
+            with phase("llm"):
+                start = time.monotonic()
+                response = await route.model.ainvoke(messages)
+            chat_app.record_call(route, ticket, time.monotonic() - start, *chat_app.token_usage(response, ticket))
+            return response.content
+        except asyncio.CancelledError:
+            # Cancelling the await dropped the upstream request; its prompt stays charged
+            chat_app.admission.cancel(ticket, 0)
+            raise
+        finally:
+            chat_app.admission.release(ticket)
+    if chat_app.singleflight is None:
+        return await call()
+    return await chat_app.singleflight.ado(key, call)
+
+
+def stream_reply(key, messages, route, prompt_tokens):
+    # Like app.stream_reply: the first piece is empty and arrives once the call is admitted
+    async def pieces():
+        ticket = await chat_app.admission.aacquire(prompt_tokens, chat_app.context_window.reply_tokens)
+        parts = None
+        try:
+            yield ""
+            start = time.monotonic()
+            ttft = None
+            parts = []
+            async for chunk in route.model.astream(messages):
+                if chunk.content:
+                    ttft = ttft if ttft is not None else time.monotonic() - start
+                    parts.append(chunk.content)
+                    yield chunk.content
+            chat_app.record_call(route, ticket, time.monotonic() - start, ticket.prompt_tokens,
+                                 chat_app.count_tokens("".join(parts)), ttft)
+        except (asyncio.CancelledError, GeneratorExit):
+            if parts is not None:
+                chat_app.admission.cancel(ticket, chat_app.count_tokens("".join(parts)))
+            raise
+        finally:
+            chat_app.admission.release(ticket)
+    return pieces() if chat_app.singleflight is None else chat_app.singleflight.astream(key, pieces)
+
+
+async def until_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def cancellable(generation, coro, receive):
+    """Awaits coro, cancelling it if the generation is cancelled or the client disconnects.
+
+    Raises Cancelled when that happens.
+    """
+    loop = asyncio.get_running_loop()
+    work = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(until_disconnect(receive))
+    watcher.add_done_callback(lambda w: w.cancelled() or generation.cancel("disconnect"))
+    generation.on_cancel(lambda: loop.call_soon_threadsafe(work.cancel))
+    try:
+        return await work
+    except asyncio.CancelledError:
+        if not generation.cancelled:
+            raise
+        raise Cancelled(generation.reason) from None
+    finally:
+        watcher.cancel()
+
+
+async def chat_api(scope, receive, send, session):
+    cid = session.conversation_id()
+
+    data = await read_json(receive)
+    user_input = data.get("message", "").strip()
+    is_edit = data.get("is_edit", False)
+    use_cache = data.get("cache", False)
+
+    if not user_input:
+        return await send_json(send, 400, {"error": "Empty message"}, session)
+
+    messages, window = await asyncio.to_thread(chat_app.begin_turn, cid, user_input, is_edit)
+    route = chat_app.router.route(messages, window, data.get("model"))
+    generation = chat_app.generations.start(cid, data.get("generation_id"))
+
+    async def reply():
+        key = chat_app.prompt_key(messages, route)
+        content = await asyncio.to_thread(chat_app.cached_reply, key, messages, route) if use_cache else None
+        cached = content is not None
+        if not cached:
+            try:
+                content = await generate_reply(key, messages, route, window.prompt_tokens)
+            except asyncio.CancelledError:
+                chat_app.record_cancel(generation, route, 0)
+                raise
+            if use_cache:
+                await asyncio.to_thread(chat_app.remember_reply, key, messages, route, content)
+        html = await asyncio.to_thread(chat_app.finish_turn, cid, content)
+        return {"ai_response": content, "ai_html": html, "cached": cached,
+                "context": window.stats(), "route": route.stats(), "generation_id": generation.id}
+
+    try:
+        payload = await cancellable(generation, reply(), receive)
+        return await send_json(send, 200, payload, session)
+
+    except Exception as e:
+        if generation.reason == "disconnect":
+            return
+        return await send_error(send, e, session)
+    finally:
+        chat_app.generations.finish(generation)
+
+
+class Turn:
+    """A chat turn that has been admitted and is ready to stream its reply."""
+
+    __slots__ = ("cid", "messages", "window", "route", "key", "content", "stream", "use_cache", "generation")
+
+    def __init__(self, cid, messages, window, route, key, content, stream, use_cache, generation):
+        self.cid = cid
+        self.messages = messages
+        self.window = window
+        self.route = route
+        self.key = key
+        self.content = content
+        self.stream = stream
+        self.use_cache = use_cache
+        self.generation = generation
+
+
+async def open_turn(generation, data):
+    """Stores the user's message and admits the reply; raises Overloaded before anything is sent."""
+    use_cache = data.get("cache", False)
+    messages, window = await asyncio.to_thread(chat_app.begin_turn, generation.cid, data["message"].strip(),
+                                               data.get("is_edit", False))
+    route = chat_app.router.route(messages, window, data.get("model"))
+
+    key = chat_app.prompt_key(messages, route)
+    content = await asyncio.to_thread(chat_app.cached_reply, key, messages, route) if use_cache else None
+    stream = None if content is not None else stream_reply(key, messages, route, window.prompt_tokens)
+    if stream is not None:
+        # Waits for this call (or the identical one it joined) to be admitted
+        with phase("queue"):
+            await anext(stream)
+    return Turn(generation.cid, messages, window, route, key, content, stream, use_cache, generation)
+
+
+async def close_turn(turn):
+    # Leaving the stream gives up the upstream call once no coalesced caller still wants it
+    if turn.stream is not None:
+        await turn.stream.aclose()
+
+
+async def turn_events(turn):
+    """Streams a turn as (event, payload) pairs: tokens, then done, error or cancelled."""
+    timer = current_timer.get()
+    cached = turn.content is not None
+    if cached:
+        yield "token", {"content": turn.content}
+        content = turn.content
+    else:
+        parts = []
+        start = time.perf_counter()
+        try:
+            async for piece in turn.stream:
+                if not parts and timer is not None:
+                    timer.add("ttft", time.perf_counter() - start)
+                parts.append(piece)
+                yield "token", {"content": piece}
+        except asyncio.CancelledError:
+            if not turn.generation.cancelled:
+                raise
+            # Unwinding the stream dropped the upstream request; the history is left as it was
+            chat_app.record_cancel(turn.generation, turn.route, chat_app.count_tokens("".join(parts)))
+            yield "cancelled", {"ai_response": "".join(parts)}
+            return
+        except Exception as e:
+            if chat_app.metrics is not None:
+                chat_app.metrics.errors.inc("stream")
+            yield "error", {"error": str(e)}
+            return
+        if timer is not None and parts:
+            timer.add("generation", time.perf_counter() - start - timer.phases["ttft"])
+        content = "".join(parts)
+        if turn.use_cache:
+            await asyncio.to_thread(chat_app.remember_reply, turn.key, turn.messages, turn.route, content)
+
+    html = await asyncio.to_thread(chat_app.finish_turn, turn.cid, content)
+    done = {"ai_response": content, "ai_html": html, "cached": cached,
+            "context": turn.window.stats(), "route": turn.route.stats(), "generation_id": turn.generation.id}
+    if timer is not None:
+        done["timing"] = timer.server_timing()
+    yield "done", done
+
+
+async def chat_stream(scope, receive, send, session):
+    cid = session.conversation_id()
+
+    data = await read_json(receive)
+    if not data.get("message", "").strip():
+        return await send_json(send, 400, {"error": "Empty message"}, session)
+
+    generation = chat_app.generations.start(cid, data.get("generation_id"))
+    started = False
+
+    async def stream():
+        nonlocal started
+        turn = await open_turn(generation, data)
+        started = True
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                            (b"cache-control", b"no-cache"),
+                            (b"x-accel-buffering", b"no")] + timing_headers() + session.headers(),
+            })
+            await send({"type": "http.response.body", "body": sse("start", {"generation_id": generation.id}).encode(),
+                        "more_body": True})
+            async for event, payload in turn_events(turn):
+                if generation.reason == "disconnect":
+                    return
+                await send({"type": "http.response.body", "body": sse(event, payload).encode(),
+                            "more_body": event == "token"})
+        finally:
+            # Also covers a cancel that lands before turn_events has taken over the stream
+            await close_turn(turn)
+
+    try:
+        await cancellable(generation, stream(), receive)
+    except (Overloaded, Cancelled) as e:
+        # Rejected or cancelled while still queued: no stream was started yet
+        if not started and generation.reason != "disconnect":
+            await send_error(send, e, session)
+    finally:
+        chat_app.generations.finish(generation)
+
+
+async def socket_turn(send_frame, generation, data):
+    metrics = chat_app.metrics
+    timer = metrics.start_request() if metrics is not None else None
+    try:
+        try:
+            turn = await open_turn(generation, data)
+        except Overloaded as e:
+            status, headers = chat_app.error_status(e)
+            return await send_frame("error", {"error": str(e), "status": status,
+                                              "retry_after": headers.get("Retry-After")})
+        try:
+            await send_frame("start", {"generation_id": generation.id})
+            async for event, payload in turn_events(turn):
+                await send_frame(event, payload)
+        finally:
+            await close_turn(turn)
+    except asyncio.CancelledError:
+        if not generation.cancelled:
+            raise
+        # Cancelled before the reply started streaming
+        await send_frame("cancelled", {"ai_response": ""})
+    except Exception as e:
+        logger.exception("WebSocket turn failed for conversation %s", generation.cid)
+        if chat_app.metrics is not None:
+            chat_app.metrics.errors.inc("500")
+        await send_frame("error", {"error": str(e), "status": 500})
+    finally:
+        chat_app.generations.finish(generation)
+        if timer is not None:
+            metrics.finish_request(timer, "chat_socket")
+
+
+async def chat_socket(scope, receive, send):
+    """Persistent chat channel: the conversation is bound once at connect.
+
+    Client frames are JSON objects: {"type": "chat", "message", "cache",
+    "model", "is_edit"}, {"type": "cancel"} and {"type": "ping"}. Replies
+    come back as {"type": "start" | "token" | "done" | "error" | "cancelled"
+    | "pong"} frames carrying the same fields as the /chat_stream events.
+    One reply runs at a time per connection.
+    """
+    global ws_connections
+    if (await receive())["type"] != "websocket.connect":
+        return
+    if ws_connections >= WS_MAX_CONNECTIONS:
+        return await send({"type": "websocket.close", "code": 1013})
+
+    # Counted before the first await, so concurrent connects can't all pass the check
+    ws_connections += 1
+
+    closed = False
+
+    async def send_frame(kind, payload):
+        if not closed:
+            await send({"type": "websocket.send", "text": json.dumps({"type": kind, **payload})})
+
+    loop = asyncio.get_running_loop()
+    task = generation = None
+    last_active = time.monotonic()
+    try:
+        session = Session(scope)
+        cid = session.conversation_id()
+        await send({"type": "websocket.accept", "headers": session.headers()})
+        while True:
+            try:
+                message = await asyncio.wait_for(receive(), WS_HEARTBEAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                return await send({"type": "websocket.close", "code": 1001})
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                data = json.loads(message.get("text") or message.get("bytes") or b"")
+            except ValueError:
+                data = None
+            kind = data.get("type") if isinstance(data, dict) else None
+
+            busy = task is not None and not task.done()
+            if kind == "ping":
+                await send_frame("pong", {})
+                if not busy and time.monotonic() - last_active > WS_IDLE_TIMEOUT:
+                    # Idle connections give their slot back; the client reconnects on its next message
+                    return await send({"type": "websocket.close", "code": 1000})
+            elif kind == "cancel":
+                if busy:
+                    generation.cancel("client")
+            elif kind == "chat":
+                last_active = time.monotonic()
+                if busy:
+                    await send_frame("error", {"error": "A reply is already in progress", "status": 409})
+                elif not isinstance(data.get("message"), str) or not data["message"].strip():
+                    await send_frame("error", {"error": "Empty message", "status": 400})
+                else:
+                    generation = chat_app.generations.start(cid, data.get("generation_id"))
+                    task = asyncio.create_task(socket_turn(send_frame, generation, data))
+                    generation.on_cancel(lambda task=task: loop.call_soon_threadsafe(task.cancel))
+            else:
+                await send_frame("error", {"error": "Unknown frame", "status": 400})
+    finally:
+        closed = True
+        ws_connections -= 1
+        if generation is not None:
+            generation.cancel("disconnect")
+
+
+ROUTES = {
+    "/chat_api": chat_api,
+    "/chat_stream": chat_stream,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # A long-running server can build the LLM clients before the first request
+            await asyncio.to_thread(chat_app.get_model, LARGE)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "websocket":
+        if scope["path"] == "/ws":
+            return await chat_socket(scope, receive, send)
+        await receive()
+        return await send({"type": "websocket.close", "code": 1000})
+    handler = ROUTES.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+    if handler is None:
+        return await wsgi(scope, receive, send)
+    metrics = chat_app.metrics
+    if metrics is None:
+        return await handler(scope, receive, send, Session(scope))
+    timer = metrics.start_request()
+    with timer.phase("session"):
+        session = Session(scope)
+    try:
+        await handler(scope, receive, send, session)
+    finally:
+        metrics.finish_request(timer, handler.__name__)
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json")
+MIN_COMPRESS_SIZE = 512
+
+
+def encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def negotiate(accept_encodings):
+    best = accept_encodings.best_match(encodings())
+    return best if best and accept_encodings[best] else None
+
+
+def encode(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def compress_response(response, accept_encodings):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or not (response.mimetype or "").startswith(COMPRESSIBLE)
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encodings)
+    data = response.get_data()
+    if encoding is None or len(data) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(encode(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+class Asset:
+    __slots__ = ("name", "url", "mimetype", "data", "encoded", "etag")
+
+    def __init__(self, name, data, prefix):
+        digest = hashlib.sha256(data).hexdigest()
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.url = f"{prefix}/{stem}.{digest[:12]}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.data = data
+        self.etag = digest[:32]
+        # Compressed once at startup, not per request
+        self.encoded = {enc: encode(data, enc) for enc in encodings()} if self.mimetype.startswith(COMPRESSIBLE) else {}
+
+
+class Assets:
+    """Content-hash fingerprinted static files served with immutable cache headers."""
+
+    def __init__(self, root, prefix="/assets"):
+        self.prefix = prefix
+        self._by_name = {}
+        self._by_url = {}
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    asset = Asset(name, f.read(), prefix)
+                self._by_name[name] = asset
+                self._by_url[asset.url] = asset
+
+    def url(self, name):
+        return self._by_name[name].url
+
+    def response(self, path, request):
+        asset = self._by_url.get(f"{self.prefix}/{path}")
+        if asset is None:
+            return None
+        encoding = negotiate(request.accept_encodings) if asset.encoded else None
+        response = Response(asset.encoded[encoding] if encoding else asset.data, mimetype=asset.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if asset.encoded:
+            response.vary.add("Accept-Encoding")
+        response.set_etag(f"{asset.etag}-{encoding}" if encoding else asset.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
@@ -0,0 +1,31 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+
+def fan_out(fn, items, concurrency=8):
+    """Runs ``fn`` over ``items`` on a thread pool and yields results as they complete.
+
+    Yields ``(index, item, result, error)``; an exception is reported for its
+    item rather than raised. At most ``concurrency`` items are in flight and
+    ``items`` is consumed lazily, so a generator of thousands of prompts is
+    never materialized. Closing the generator drops the items not yet started.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    items = enumerate(items)
+    pending = {}
+
+    def submit(count):
+        for index, item in islice(items, count):
+            pending[executor.submit(fn, item)] = (index, item)
+
+    try:
+        submit(concurrency)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item = pending.pop(future)
+                error = future.exception()
+                yield index, item, None if error else future.result(), error
+            submit(len(done))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,70 @@
+"""Concurrency scaling of the async (ASGI) chat path against a local fake LLM.
+
+Each request waits on a fake upstream call of --latency seconds. The sync
+baseline serves the Flask app from a fixed pool of --workers threads, like
+sync gunicorn workers; the ASGI app runs every request on one event loop.
+
+    python benchmarks/bench_async.py [--latency 0.2] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+import app as chat_app
+import asgi
+from admission import AdmissionController
+from fakellm import FakeChatModel
+
+
+def sync_round(concurrency, workers):
+    def one(_):
+        client = chat_app.app.test_client()
+        return client.post("/chat_api", json={"message": "hello"}).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        statuses = list(pool.map(one, range(concurrency)))
+    return time.perf_counter() - start, statuses
+
+
+async def async_round(concurrency):
+    transport = httpx.ASGITransport(app=asgi.application)
+
+    async def one():
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/chat_api", json={"message": "hello"})
+            return response.status_code
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(one() for _ in range(concurrency)))
+    return time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100, 500])
+    args = parser.parse_args()
+
+    chat_app.llm = chat_app.small_llm = FakeChatModel(latency=args.latency)
+    chat_app.admission = AdmissionController(rpm=10 ** 6, tpm=10 ** 9)
+
+    for concurrency in args.concurrency:
+        sync_s, sync_statuses = sync_round(concurrency, args.workers)
+        async_s, async_statuses = asyncio.run(async_round(concurrency))
+        assert set(sync_statuses) == {200} and set(async_statuses) == {200}
+        print(f"concurrency={concurrency:4}  sync[{args.workers} workers]: {sync_s:6.2f}s "
+              f"({concurrency / sync_s:7.1f} req/s)   async: {async_s:6.2f}s ({concurrency / async_s:7.1f} req/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Throughput of run_batch against a local fake LLM at several concurrency caps.
+
+Every prompt is distinct, so nothing is served from the cache or coalesced;
+the rate limits are lifted so only the fan-out is measured.
+
+    python benchmarks/bench_batch.py [--prompts 200] [--latency 0.2] [--concurrency 1 8 32]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+import app as chat_app
+from admission import AdmissionController
+from fakellm import FakeChatModel
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    chat_app.llm = chat_app.small_llm = FakeChatModel(latency=args.latency)
+    chat_app.admission = AdmissionController(rpm=10 ** 6, tpm=10 ** 9)
+    chat_app.BATCH_MAX_CONCURRENCY = max(args.concurrency)
+
+    for concurrency in args.concurrency:
+        prompts = (f"prompt {concurrency}-{i}" for i in range(args.prompts))
+        start = time.perf_counter()
+        first = None
+        errors = 0
+        for item in chat_app.run_batch(prompts, concurrency):
+            first = first or time.perf_counter() - start
+            errors += "error" in item
+        elapsed = time.perf_counter() - start
+        print(f"concurrency={concurrency:3}  {args.prompts / elapsed:7.1f} prompts/s  "
+              f"total {elapsed:6.2f}s  first result {first * 1000:6.1f}ms  errors={errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Per-turn prompt-building cost versus conversation length.
+
+"legacy" replays the old per-turn work on a list of dicts: copy the stored
+history, append the turn, sum the dropped prefix and build fresh langchain
+messages for the window. "conversation" is the live path: append to the
+Conversation log and reuse the records' cached token counts and langchain
+messages. The SQLite rows show the store with its in-process cache disabled
+(cache_size=0, a full reload each turn) and enabled. The edit rows compare
+re-submitting the last user message: the old slice-and-copy of the list
+against forking a sibling node in the conversation tree.
+
+    python benchmarks/bench_conversation.py [--sizes 10 100 1000 5000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from context import ContextWindow, count_tokens
+from conversation import Message
+from store import MemoryStore, SQLiteStore
+
+ROUNDS = 30
+window = ContextWindow()
+
+
+def seed(n):
+    return [{"role": "user" if i % 2 == 0 else "ai", "content": f"message {i} " + "lorem ipsum " * 8}
+            for i in range(n)]
+
+
+def legacy_turn(stored, text):
+    history = list(stored)
+    history.append({"role": "user", "content": text, "tokens": count_tokens(text)})
+    used, start = 0, len(history)
+    while start > 0:
+        tokens = history[start - 1]["tokens"]
+        if used + tokens > window.budget and start < len(history):
+            break
+        used += tokens
+        start -= 1
+    sum(m["tokens"] for m in history[:start])
+    return [HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+            for m in history[start:]]
+
+
+def legacy_edit(stored, text):
+    i = max(i for i, m in enumerate(stored) if m["role"] == "user")
+    return legacy_turn(stored[:i], text)
+
+
+def conversation_edit(store, cid, text):
+    edited = store.load(cid).last("user")
+    conversation = store.fork(cid, edited.parent.id, Message("user", text))
+    return [m.to_langchain() for m in window.select(conversation).messages]
+
+
+def conversation_turn(store, cid, text):
+    conversation = store.append(cid, Message("user", text))
+    return [m.to_langchain() for m in window.select(conversation).messages]
+
+
+def measure(turn):
+    turn(-1)  # warm: first use builds the cached langchain messages
+    samples = []
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        turn(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    # Allocation is measured on a separate turn; tracing would distort the timings
+    tracemalloc.start()
+    turn(ROUNDS)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(samples), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            history = seed(n)
+            for m in history:
+                m["tokens"] = count_tokens(m["content"])
+            memory = MemoryStore()
+            memory.replace("bench", history)
+            uncached = SQLiteStore(os.path.join(tmp, f"uncached-{n}.db"), cache_size=0)
+            uncached.replace("bench", history)
+            cached = SQLiteStore(os.path.join(tmp, f"cached-{n}.db"))
+            cached.replace("bench", history)
+
+            rows = {
+                "legacy": measure(lambda i: legacy_turn(history, f"turn {i}")),
+                "conversation": measure(lambda i: conversation_turn(memory, "bench", f"turn {i}")),
+                "sqlite uncached": measure(lambda i: conversation_turn(uncached, "bench", f"turn {i}")),
+                "sqlite cached": measure(lambda i: conversation_turn(cached, "bench", f"turn {i}")),
+                "legacy edit": measure(lambda i: legacy_edit(history, f"edit {i}")),
+                "conversation edit": measure(lambda i: conversation_edit(memory, "bench", f"edit {i}")),
+            }
+            print(f"history={n:5}  " + "  ".join(f"{name}: {us:8.1f}us {peak / 1024:7.1f}KiB"
+                                                   for name, (us, peak) in rows.items()))
+
+
+if __name__ == "__main__":
+    main()
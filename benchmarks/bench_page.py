@@ -0,0 +1,89 @@
+"""Page render time and bytes on the wire, before and after precompiling.
+
+"Before" re-creates the old behaviour: the template string (with CSS/JS
+inlined) compiled by render_template_string on every request and sent
+uncompressed. "After" is the live index() route.
+
+    python benchmarks/bench_page.py
+"""
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+from flask import render_template_string
+
+import app as chat_app
+from rendering import render_markdown
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "static")
+REPLY = "Sure! Here are a few ideas:\n\n1. **First** idea\n2. Second idea\n\n```python\nprint('hi')\n```\n"
+SIZES = [0, 20, 100]
+ROUNDS = 50
+
+
+def inline_template():
+    template = chat_app.HTML_TEMPLATE
+    with open(os.path.join(ROOT, "css", "app.css")) as f:
+        template = re.sub(r'<link rel="stylesheet" href="\{\{ asset_url\(\'css/app.css\'\) \}\}">',
+                          lambda _: f"<style>{f.read()}</style>", template)
+    with open(os.path.join(ROOT, "js", "app.js")) as f:
+        template = re.sub(r'<script src="\{\{ asset_url\(\'js/app.js\'\) \}\}"></script>',
+                          lambda _: f"<script>{f.read()}</script>", template)
+    return template
+
+
+def history(n):
+    messages = []
+    for i in range(n):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"question {i}"})
+        else:
+            messages.append({"role": "ai", "content": REPLY, "html": render_markdown(REPLY)})
+    return messages
+
+
+def median_ms(fn):
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    template = inline_template()
+    client = chat_app.app.test_client()
+    client.get("/")
+    with client.session_transaction() as sess:
+        cid = sess["cid"]
+    assets_bytes = sum(len(client.get(url, headers={"Accept-Encoding": "gzip, br"}).data)
+                       for url in (chat_app.assets.url("css/app.css"), chat_app.assets.url("js/app.js")))
+
+    for n in SIZES:
+        messages = history(n)
+        chat_app.store.replace(cid, messages)
+
+        def before():
+            with chat_app.app.test_request_context("/"):
+                return render_template_string(template, chat_history=messages, asset_url=chat_app.assets.url)
+
+        before_ms = median_ms(before)
+        before_bytes = len(before().encode())
+
+        after_ms = median_ms(lambda: client.get("/", headers={"Accept-Encoding": "gzip, br"}))
+        first = client.get("/", headers={"Accept-Encoding": "gzip, br"})
+        repeat = client.get("/", headers={"Accept-Encoding": "gzip, br", "If-None-Match": first.headers["ETag"]})
+
+        print(f"history={n:4}  before: {before_ms:6.2f}ms {before_bytes:7}B   "
+              f"after: {after_ms:6.2f}ms html={len(first.data):6}B "
+              f"(+{assets_bytes}B assets on first visit) repeat={repeat.status_code}/{len(repeat.data)}B")
+
+
+if __name__ == "__main__":
+    main()
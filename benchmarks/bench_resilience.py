@@ -0,0 +1,83 @@
+"""Resilience policies against a fake LLM that injects latency and failures.
+
+Reports error rate with and without retries, tail latency with and without
+hedged requests, and how the circuit breaker sheds load to the fallback
+model while the primary is down.
+
+    python benchmarks/bench_resilience.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fakellm import FakeChatModel
+from resilient import CircuitBreaker, ResilientLLM
+
+MESSAGES = []
+
+
+def error_rate(llm, calls):
+    errors = 0
+    for _ in range(calls):
+        try:
+            llm.invoke(MESSAGES)
+        except Exception:
+            errors += 1
+    return errors / calls
+
+
+def latencies(llm, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        llm.invoke(MESSAGES)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))] for p in (50, 95, 99)}
+
+
+def retries():
+    fake = dict(latency=0.001, failure_rate=0.2, seed=1)
+    bare = error_rate(FakeChatModel(**fake), 500)
+    wrapped = error_rate(ResilientLLM(FakeChatModel(**fake), retries=2, backoff_base=0.001), 500)
+    print(f"retries:  20% injected failures -> error rate bare={bare:.1%}  with 2 retries={wrapped:.1%}")
+
+
+def hedging():
+    fake = dict(latency=0.02, tail_rate=0.03, tail_latency=0.5, seed=2)
+    bare = latencies(FakeChatModel(**fake), 300)
+    hedged_llm = ResilientLLM(FakeChatModel(**fake), hedge=True, hedge_min_delay=0.0, hedge_min_samples=20)
+    hedged = latencies(hedged_llm, 300)
+    print("hedging:  3% of calls take 500ms -> "
+          + "  ".join(f"p{p} {bare[p]:.0f}ms/{hedged[p]:.0f}ms" for p in bare)
+          + f"  (bare/hedged, {hedged_llm.counts['hedges']} hedges)")
+
+
+def breaker():
+    primary = FakeChatModel(latency=0.001, failure_rate=1.0, seed=3)
+    fallback = FakeChatModel(latency=0.001, model_name="fallback")
+    llm = ResilientLLM(primary, fallback=fallback, retries=1, backoff_base=0.001,
+                       breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.05))
+    rate = error_rate(llm, 200)
+    print(f"breaker:  primary down -> error rate {rate:.1%}, primary calls {primary.calls}, "
+          f"fallback calls {fallback.calls}, breaker {llm.breaker.state}")
+
+
+async def async_paths():
+    fake = dict(latency=0.005, failure_rate=0.2, seed=4)
+    llm = ResilientLLM(FakeChatModel(**fake), retries=2, backoff_base=0.001)
+    results = await asyncio.gather(*(llm.ainvoke(MESSAGES) for _ in range(200)), return_exceptions=True)
+    errors = sum(isinstance(r, Exception) for r in results)
+    chunks = [c.content async for c in llm.astream(MESSAGES)]
+    print(f"async:    20% injected failures -> error rate {errors / len(results):.1%}, "
+          f"stream ok={''.join(chunks) == llm.primary.reply}, retries={llm.counts['retries']}")
+
+
+if __name__ == "__main__":
+    retries()
+    hedging()
+    breaker()
+    asyncio.run(async_paths())
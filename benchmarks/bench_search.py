@@ -0,0 +1,128 @@
+"""Search index build rate and query latency at a million stored messages.
+
+Messages are spread over conversations of --per-conversation turns and
+fed through SearchIndex.add() in chunks, the way the handlers queue them.
+"enqueue" is what a request pays to have a message indexed, "inline
+insert" what it would pay to index it itself (one INSERT and commit on
+the full index). Queries are timed for a user searching their own
+conversation and for an admin searching all of them, with common, rare,
+two-word and prefix terms, on the first page and a deeper one. Words are
+Zipf-distributed, so the first few are in nearly every message. The
+"stopword" rows search for one of those alone: what a query made only of
+stopwords costs, since ranking reads every message holding the term
+(other queries leave stopwords out).
+
+    python benchmarks/bench_search.py [--messages 1000000] [--per-conversation 50]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from conversation import Message
+from search import SearchIndex
+
+SYLLABLES = ["ba", "co", "de", "fi", "gu", "ha", "ke", "lo", "ma", "ne", "pi", "qua", "re",
+             "si", "to", "un", "ve", "wa", "xe", "yo", "za", "st", "th", "er", "ing"]
+CHUNK = 10000
+QUERIES = 200
+
+
+def vocabulary(n, seed=42):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(n)]
+
+
+def text(rng, words, n):
+    return " ".join(words[min(int(rng.paretovariate(0.8)) - 1, len(words) - 1)] for _ in range(n))
+
+
+def build(index, args, words):
+    rng = random.Random(0)
+    cids = [uuid.uuid4().hex for _ in range(args.messages // args.per_conversation + 1)]
+    enqueue = []
+    start = time.perf_counter()
+    for i in range(args.messages):
+        cid = cids[i // args.per_conversation]
+        message = Message("user" if i % 2 == 0 else "ai", text(rng, words, rng.randint(8, 60)), tokens=0)
+        message.id = i % args.per_conversation
+        t = time.perf_counter()
+        index.add(cid, message)
+        enqueue.append((time.perf_counter() - t) * 1e6)
+        if i % CHUNK == CHUNK - 1:
+            # Stay under the queue bound, as a steady request rate would
+            index.flush()
+    index.flush()
+    return cids, time.perf_counter() - start, enqueue
+
+
+def inline_insert(index, words):
+    rng = random.Random(1)
+    conn = index._conn()
+    samples = []
+    for i in range(500):
+        t = time.perf_counter()
+        with conn:
+            conn.execute("INSERT INTO search (content, cid, message, role, created) VALUES (?, ?, ?, ?, ?)",
+                         (text(rng, words, 30), "inline", i, "user", time.time()))
+        samples.append((time.perf_counter() - t) * 1e6)
+    conn.execute("DELETE FROM search WHERE rowid IN (SELECT rowid FROM search WHERE search MATCH 'cid : inline')")
+    return samples
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+
+def timed(index, queries):
+    samples = []
+    for q, cid, offset in queries:
+        t = time.perf_counter()
+        index.search(q, cid, 20, offset)
+        samples.append((time.perf_counter() - t) * 1000)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--per-conversation", type=int, default=50)
+    args = parser.parse_args()
+
+    words = vocabulary(20000)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        index = SearchIndex(path, queue_size=CHUNK * 2)
+        cids, seconds, enqueue = build(index, args, words)
+        size = os.path.getsize(path) + os.path.getsize(path + "-wal")
+        print(f"indexed {args.messages} messages in {seconds:.1f}s ({args.messages / seconds:,.0f}/s), "
+              f"{size / 2 ** 20:.0f}MiB")
+        print("enqueue        p50 %6.1fus  p95 %6.1fus" % percentiles(enqueue))
+        print("inline insert  p50 %6.1fus  p95 %6.1fus" % percentiles(inline_insert(index, words)))
+
+        rng = random.Random(2)
+        kinds = {
+            "stopword": lambda: rng.choice(words[:5]),
+            "common word": lambda: rng.choice(words[20:200]),
+            "rare word": lambda: rng.choice(words[5000:]),
+            "two words": lambda: f"{rng.choice(words[20:200])} {rng.choice(words[200:2000])}",
+            "prefix": lambda: rng.choice(words[200:2000])[:4],
+        }
+        for scope in ("own conversation", "all conversations"):
+            for kind, make in kinds.items():
+                for offset in (0, 100):
+                    queries = [(make(), rng.choice(cids) if scope == "own conversation" else None, offset)
+                               for _ in range(QUERIES if scope == "own conversation" else QUERIES // 10)]
+                    p50, p95 = timed(index, queries)
+                    print(f"{scope:18} {kind:12} offset {offset:3}  p50 {p50:8.2f}ms  p95 {p95:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Semantic cache lookup latency as the index grows.
+
+    python benchmarks/bench_semantic_cache.py [--sizes 10000 100000 1000000] [--batch 32]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from semantic_cache import VectorIndex, embed
+
+QUERIES = ["Any advice for me?", "some youtube video ideas", "life lessons from good books",
+           "how do I learn python", "write a haiku about flask"]
+
+
+def fill(index, n, dim):
+    rng = np.random.default_rng(n)
+    chunk = 50000
+    for start in range(0, n, chunk):
+        vectors = rng.standard_normal((min(chunk, n - start), dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        for i, vector in enumerate(vectors):
+            index.add(vector, start + i)
+
+
+def timed(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    single = embed(QUERIES[:1], args.dim)
+    batch = embed((QUERIES * args.batch)[:args.batch], args.dim)
+    print(f"embed: {timed(lambda: embed(QUERIES[:1], args.dim), 200):.3f}ms per prompt")
+
+    for n in args.sizes:
+        index = VectorIndex(args.dim, maxsize=n)
+        fill(index, n, args.dim)
+        one = timed(lambda: index.search(single), args.rounds)
+        many = timed(lambda: index.search(batch), args.rounds)
+        mb = index._vectors.nbytes / 2**20
+        print(f"entries={n:8}  index={mb:7.1f}MB  lookup={one:8.3f}ms  "
+              f"batch[{args.batch}]={many:8.3f}ms ({many / args.batch:.3f}ms/query)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Per-process caches versus the shared cache file as the worker count grows.
+
+Each worker process serves a Zipf-distributed stream of prompts through
+get-or-compute on its cache; every miss stands in for an upstream call.
+"process" gives each worker its own in-memory LRU, "shared" points all of
+them at one SharedCache file. The same workers are then restarted: process
+caches start cold again, the shared file does not.
+
+Memory is the growth in proportional set size (PSS, which splits shared
+pages between the processes mapping them) summed over workers; it needs
+Linux /proc. The shared file's size on disk is listed separately.
+
+    python benchmarks/bench_shared_cache.py [--workers 1 2 4 8] [--prompts 20000] [--maxsize 5000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cache import MemoryCacheBackend
+from sharedcache import SharedCache
+
+REPLY = "Sure! Here is a fairly typical answer with **markdown** and a list:\n\n1. one\n2. two\n\n" * 20
+
+
+def pss_kib():
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def zipf_weights(n, s):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def worker(args):
+    mode, path, seed, prompts, requests, maxsize, skew = args
+    rng = random.Random(seed)
+    weights = zipf_weights(prompts, skew)
+    keys = rng.choices(range(prompts), weights, k=requests)
+    before = pss_kib()
+
+    if mode == "shared":
+        cache = SharedCache(path, "bench", maxsize=maxsize, ttl=3600)
+    else:
+        cache = MemoryCacheBackend(maxsize, ttl=3600)
+    computed = 0
+    for key in keys:
+        key = f"prompt-{key}"
+        if mode == "shared":
+            cache.get_or_compute(key, lambda: f"{key}: {REPLY}")
+        elif cache.get(key) is None:
+            cache.set(key, f"{key}: {REPLY}")
+            computed += 1
+
+    after = pss_kib()
+    if mode == "shared":
+        computed = cache.computed
+    return computed, None if before is None or after is None else after - before
+
+
+def run(mode, workers, path, args, generation):
+    jobs = [(mode, path, generation * 1000 + i, args.prompts, args.requests, args.maxsize, args.skew)
+            for i in range(workers)]
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        results = pool.map(worker, jobs)
+    computed = sum(c for c, _ in results)
+    memory = None if any(m is None for _, m in results) else sum(m for _, m in results)
+    return computed, memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--prompts", type=int, default=20000, help="distinct prompts in the workload")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per worker")
+    parser.add_argument("--maxsize", type=int, default=5000, help="entries per cache")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            total = workers * args.requests
+            for mode in ("process", "shared"):
+                path = os.path.join(tmp, f"shared-{workers}.db")
+                first, memory = run(mode, workers, path, args, 0)
+                restarted, _ = run(mode, workers, path, args, 1)
+                size = os.path.getsize(path) if mode == "shared" else 0
+                print(f"workers={workers:2}  {mode:7}  hit rate {1 - first / total:6.1%}  "
+                      f"after restart {1 - restarted / total:6.1%}  upstream calls {first:6}  "
+                      f"pss {'n/a' if memory is None else f'{memory / 1024:6.1f}MiB'}  "
+                      f"file {size / 2 ** 20:5.1f}MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Cold-start cost of the serverless entry point.
+
+Each run is a fresh interpreter, as on a cold serverless instance. It reports
+the `python -X importtime` total for `api.index` with the slowest modules,
+the time to the first `/` response, and whether that response pulled in
+langchain. --budget-ms exits non-zero when the median cold start regresses
+past the given budget.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 10] [--budget-ms 500]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+FIRST_REQUEST = """
+import json, sys, time
+start = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+response = api.index.app.test_client().get("/")
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (served - start) * 1000,
+    "status": response.status_code,
+    "langchain_loaded": any(name.startswith("langchain") for name in sys.modules),
+}))
+"""
+
+
+def run(args, env):
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def importtime(env):
+    # Lines look like "import time:  self [us] | cumulative | <indent>module"
+    modules = []
+    for line in run(["-X", "importtime", "-c", "import api.index"], env).stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float)
+    args = parser.parse_args()
+
+    env = dict(os.environ, GROQ_API_KEY=os.getenv("GROQ_API_KEY", "bench"), PYTHONDONTWRITEBYTECODE="1")
+    run(["-c", "import api.index"], env)  # warm the bytecode and OS file caches
+
+    modules = importtime(env)
+    total_us = next(cumulative for name, _, cumulative in modules if name == "api.index")
+    print(f"importtime api.index: {total_us / 1000:.1f}ms cumulative; slowest by self time:")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: -m[1])[:args.top]:
+        print(f"  {self_us / 1000:7.1f}ms self {cumulative_us / 1000:8.1f}ms cumulative  {name}")
+
+    samples = [json.loads(run(["-c", FIRST_REQUEST], env).stdout) for _ in range(args.runs)]
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    first_ms = statistics.median(s["first_request_ms"] for s in samples)
+    langchain = any(s["langchain_loaded"] for s in samples)
+    print(f"cold start (median of {args.runs}): import {import_ms:.1f}ms, first GET / {first_ms:.1f}ms "
+          f"(status {samples[0]['status']}, langchain loaded: {langchain})")
+
+    if args.budget_ms is not None and first_ms > args.budget_ms:
+        print(f"REGRESSION: cold start {first_ms:.1f}ms exceeds budget {args.budget_ms:.1f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Bytes per conversation and read/write latency of the SQLite store's message storage.
+
+Bodies are content-addressed in every row. "raw" stores them
+uncompressed; the others compress them: zlib (what you get without
+zstandard), zstd, and zstd with a dictionary trained on the first half of
+the conversations. The workload mixes long
+markdown replies with repeats (popular answers, regenerated replies) and
+edited turns that fork the conversation.
+
+Writes are timed per appended turn (user message plus reply). Reads are a
+cold load (no in-process cache) followed by either the context window's
+last messages or the whole branch being read.
+
+    python benchmarks/bench_storage.py [--conversations 500] [--turns 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import codec
+from conversation import Message
+from rendering import render_markdown
+from store import SQLiteStore
+
+# Made-up words with an English-like length and frequency spread, so text compresses about as well as prose
+_syllables = random.Random(42)
+WORDS = ["".join(_syllables.choice(["ba", "co", "de", "fi", "gu", "ha", "ke", "lo", "ma", "ne", "pi", "qua", "re",
+                                     "si", "to", "un", "ve", "wa", "xe", "yo", "za", "st", "th", "er", "ing"])
+                 for _ in range(_syllables.randint(1, 4))) for _ in range(5000)]
+WINDOW = 20
+
+
+class RawCodec(codec.BodyCodec):
+    """Stores every body as it is."""
+
+    def compress(self, data):
+        return codec.RAW, None, data
+
+
+def sentence(rng, n):
+    # Zipf-ish: a few words are very common, most are rare
+    return " ".join(WORDS[min(int(rng.paretovariate(0.8)) - 1, len(WORDS) - 1)] for _ in range(n)).capitalize() + "."
+
+
+def reply(rng, i):
+    rng = random.Random(i)
+    parts = [f"## Answer {i}", " ".join(sentence(rng, rng.randint(8, 20)) for _ in range(4)),
+             "\n".join(f"{n}. {sentence(rng, 8)}" for n in range(1, 5)),
+             "```python\n" + "\n".join(f"def {rng.choice(WORDS)}_{n}(x):\n    return x.{rng.choice(WORDS)}()"
+                                       for n in range(3)) + "\n```",
+             sentence(rng, 25)]
+    return "\n\n".join(parts)
+
+
+def workload(conversations, turns, seed=0):
+    """Per conversation, the turns to append; an edit forks from the previous user message."""
+    rng = random.Random(seed)
+    pool = [reply(rng, i) for i in range(400)]
+    html = [render_markdown(text) for text in pool]
+    weights = [1.0 / (rank + 1) for rank in range(len(pool))]
+    plan = []
+    for c in range(conversations):
+        steps = []
+        for t in range(turns):
+            question = sentence(rng, rng.randint(5, 15))
+            # Most replies are fresh; some repeat a popular answer or a regeneration
+            if rng.random() < 0.3:
+                k = rng.choices(range(len(pool)), weights)[0]
+                answer, answer_html = pool[k], html[k]
+            else:
+                answer = reply(rng, 1000 + c * turns + t)
+                answer_html = render_markdown(answer)
+            steps.append(("edit" if t and rng.random() < 0.1 else "turn", question, answer, answer_html))
+        plan.append(steps)
+    return plan
+
+
+def fill(store, plan, first=0):
+    samples = []
+    for c, steps in enumerate(plan, first):
+        cid = f"c{c}"
+        for kind, question, answer, answer_html in steps:
+            start = time.perf_counter()
+            if kind == "edit":
+                edited = store.load(cid).last("user")
+                store.fork(cid, None if edited.parent is None else edited.parent.id, Message("user", question))
+                store.append(cid, Message("ai", answer, html=answer_html))
+            else:
+                store.append(cid, Message("user", question), Message("ai", answer, html=answer_html))
+            samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def size(path, store):
+    conn = store._conn()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    return os.path.getsize(path)
+
+
+def reads(path, cids, full):
+    store = SQLiteStore(path, cache_size=0, body_cache_size=256)
+    samples = []
+    for cid in cids * 3:
+        store._bodies.clear()
+        start = time.perf_counter()
+        conversation = store.load(cid)
+        messages = conversation.path() if full else conversation.path()[-WINDOW:]
+        sum(len(m.content) for m in messages)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def run(name, path, plan, use_zstd=True, dictionary=False):
+    saved = codec.zstandard
+    if not use_zstd:
+        codec.zstandard = None
+    try:
+        store = SQLiteStore(path, cache_size=0)
+        if name == "raw":
+            store._codec = RawCodec()
+        half = len(plan) // 2
+        writes = fill(store, plan[:half])
+        if dictionary and store.train_dictionary() is None:
+            return None
+        writes += fill(store, plan[half:], half)
+        cids = [f"c{c}" for c in range(len(plan))]
+        rng = random.Random(1)
+        sample = rng.sample(cids, min(200, len(cids)))
+        return (size(path, store) / len(plan), statistics.median(writes),
+                reads(path, sample, full=False), reads(path, sample, full=True))
+    finally:
+        codec.zstandard = saved
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    plan = workload(args.conversations, args.turns)
+    modes = [("raw", {}), ("zlib", {"use_zstd": False})]
+    if codec.zstandard is not None:
+        modes += [("zstd", {}), ("zstd+dict", {"dictionary": True})]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, options in modes:
+            result = run(name, os.path.join(tmp, f"{name}.db"), plan, **options)
+            if result is None:
+                print(f"{name:10}  skipped (too few bodies to train a dictionary)")
+                continue
+            per_conversation, write_us, window_us, full_us = result
+            print(f"{name:10}  {per_conversation / 1024:7.1f}KiB/conversation  write p50 {write_us:7.1f}us/turn  "
+                  f"read window p50 {window_us:7.1f}us  read all p50 {full_us:7.1f}us")
+
+
+if __name__ == "__main__":
+    main()
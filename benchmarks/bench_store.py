@@ -0,0 +1,82 @@
+"""Request size and latency of /chat_api as the conversation grows.
+
+Compares the cookie the legacy ``session["chat_history"]`` scheme would carry
+with the conversation-id cookie used now, for each store backend. The cookie
+stays constant; the remaining latency growth is the prompt itself, which grows
+until the context window caps it.
+
+    python benchmarks/bench_store.py
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+from langchain_core.messages import AIMessage
+
+import app as chat_app
+from admission import AdmissionController
+from store import MemoryStore, SQLiteStore
+
+REPLY = "Here is a reasonably sized answer with **markdown** and a list:\n\n- one\n- two\n- three\n" * 3
+SIZES = [0, 10, 50, 100, 200, 400]
+ROUNDS = 30
+
+
+class EchoLLM:
+    def invoke(self, messages):
+        return AIMessage(content=REPLY)
+
+
+WORDS = "the a model answer video book advice idea lesson code python flask chat token cache".split()
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(store, cid, n):
+    rng = random.Random(n)
+    store.delete(cid)
+    history = []
+    for i in range(n):
+        role = "user" if i % 2 == 0 else "ai"
+        history.append({"role": role, "content": text(rng, 12 if role == "user" else 80)})
+    if history:
+        store.replace(cid, history)
+    return history
+
+
+def run(store_name, store):
+    chat_app.store = store
+    chat_app.llm = chat_app.small_llm = EchoLLM()
+    chat_app.admission = AdmissionController(rpm=10 ** 6, tpm=10 ** 9)
+    client = chat_app.app.test_client()
+    client.get("/")
+    with client.session_transaction() as sess:
+        cid = sess["cid"]
+    serializer = chat_app.app.session_interface.get_signing_serializer(chat_app.app)
+
+    for n in SIZES:
+        history = seed(store, cid, n)
+        legacy_cookie = len(serializer.dumps({"chat_history": history}))
+        cookie = len(client.get_cookie("session").value)
+        timings = []
+        for _ in range(ROUNDS):
+            store.replace(cid, history) if history else store.delete(cid)
+            start = time.perf_counter()
+            client.post("/chat_api", json={"message": "hello there"})
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{store_name:7} history={n:4}  cookie={cookie:5}B  legacy_cookie={legacy_cookie:7}B  "
+              f"p50={statistics.median(timings):6.2f}ms  max={max(timings):6.2f}ms")
+
+
+if __name__ == "__main__":
+    run("memory", MemoryStore())
+    with tempfile.TemporaryDirectory() as tmp:
+        run("sqlite", SQLiteStore(os.path.join(tmp, "bench.db")))
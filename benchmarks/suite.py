@@ -0,0 +1,212 @@
+"""Benchmark suite against the local fake LLM, with machine-readable results.
+
+Covers index() render time and /history page fetches versus history
+length, /chat_api throughput and latency percentiles at several
+concurrency levels, session and store overhead, and markdown rendering
+cost. No Groq key is needed.
+
+Results are one flat JSON object of metrics. Names ending in _ms, _us or
+_bytes are lower-is-better and _rps is higher-is-better. --compare diffs two
+result files and exits non-zero when a metric regresses by more than
+--threshold.
+
+    python benchmarks/suite.py --output results.json [--quick]
+    python benchmarks/suite.py --compare baseline.json results.json [--threshold 0.1]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GROQ_API_KEY", "bench")
+
+import app as chat_app
+from admission import AdmissionController
+from fakellm import FakeChatModel
+from rendering import render_markdown
+from store import MemoryStore, SQLiteStore
+
+REPLY = ("Sure! Here are a few ideas:\n\n1. **First** idea with `inline code`\n2. Second idea\n\n"
+         "```python\ndef hello():\n    print('hi')\n```\n\n> A quote to finish.\n")
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+
+def timed_ms(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def history(n):
+    messages = []
+    for i in range(n):
+        if i % 2 == 0:
+            messages.append({"role": "user", "content": f"question {i}"})
+        else:
+            messages.append({"role": "ai", "content": REPLY, "html": render_markdown(REPLY)})
+    return messages
+
+
+def bench_index(results, sizes, rounds):
+    client = chat_app.app.test_client()
+    client.get("/")
+    with client.session_transaction() as sess:
+        cid = sess["cid"]
+    for n in sizes:
+        chat_app.store.replace(cid, history(n))
+        samples = timed_ms(lambda: client.get("/", headers={"Accept-Encoding": "gzip"}), rounds)
+        results[f"index.history_{n}.p50_ms"] = statistics.median(samples)
+        results[f"index.history_{n}.p95_ms"] = percentile(samples, 95)
+        results[f"index.history_{n}.gzip_bytes"] = len(client.get("/", headers={"Accept-Encoding": "gzip"}).data)
+        samples = timed_ms(lambda: client.get("/history", headers={"Accept-Encoding": "gzip"}), rounds)
+        results[f"history.history_{n}.page_p50_ms"] = statistics.median(samples)
+    chat_app.store.delete(cid)
+
+
+def bench_chat_api(results, levels, requests):
+    def one(i):
+        client = chat_app.app.test_client()
+        start = time.perf_counter()
+        # Distinct prompts so neither the cache nor single-flight short-circuits the call
+        status = client.post("/chat_api", json={"message": f"hello {uuid.uuid4().hex} {i}"}).status_code
+        return (time.perf_counter() - start) * 1000, status
+
+    for concurrency in levels:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - start
+        latencies = [ms for ms, _ in outcomes]
+        results[f"chat_api.c{concurrency}.throughput_rps"] = requests / elapsed
+        for p in (50, 95, 99):
+            results[f"chat_api.c{concurrency}.p{p}_ms"] = percentile(latencies, p)
+        results[f"chat_api.c{concurrency}.errors"] = sum(status != 200 for _, status in outcomes)
+
+
+def bench_store(results, sizes, rounds):
+    serializer = chat_app.app.session_interface.get_signing_serializer(chat_app.app)
+    cookie = serializer.dumps({"cid": uuid.uuid4().hex})
+    samples = timed_ms(lambda: serializer.loads(serializer.dumps(serializer.loads(cookie))), rounds * 10)
+    results["session.cookie_roundtrip_us"] = statistics.median(samples) * 1000
+    results["session.cookie_bytes"] = len(cookie)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, store in (("memory", MemoryStore()), ("sqlite", SQLiteStore(os.path.join(tmp, "bench.db")))):
+            for n in sizes:
+                cid = uuid.uuid4().hex
+                if n:
+                    store.replace(cid, history(n))
+                load = timed_ms(lambda: store.load(cid), rounds)
+                append = timed_ms(lambda: store.append(cid, {"role": "user", "content": "one more"}), rounds)
+                results[f"store.{name}.history_{n}.load_us"] = statistics.median(load) * 1000
+                results[f"store.{name}.history_{n}.append_us"] = statistics.median(append) * 1000
+
+
+def bench_markdown(results, rounds):
+    for name, text in (("short", "Hello **there**!"), ("reply", REPLY), ("long", REPLY * 20)):
+        # A fresh suffix each call defeats the render cache and measures the real cost
+        counter = iter(range(10 ** 9))
+        cold = timed_ms(lambda: render_markdown(f"{text}\n\n{next(counter)}"), rounds)
+        render_markdown(text)
+        warm = timed_ms(lambda: render_markdown(text), rounds)
+        results[f"markdown.{name}.render_us"] = statistics.median(cold) * 1000
+        results[f"markdown.{name}.cached_us"] = statistics.median(warm) * 1000
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lower_is_better(name):
+    return name.endswith(("_ms", "_us", "_bytes", ".errors"))
+
+
+def compare(baseline_path, current_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f"{baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+    regressions = 0
+    for name, new in sorted(current["results"].items()):
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = change > threshold if lower_is_better(name) else change < -threshold
+        regressions += worse
+        print(f"{'REGRESSION' if worse else '':10} {name:45} {old:12.3f} -> {new:12.3f}  {change:+7.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--quick", action="store_true", help="fewer rounds and sizes, for CI smoke runs")
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"))
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    rounds = 10 if args.quick else 50
+    sizes = [0, 50] if args.quick else [0, 10, 50, 100, 200]
+    levels = [1, 8] if args.quick else [1, 8, 32, 64]
+    requests = 16 if args.quick else 200
+
+    chat_app.llm = chat_app.small_llm = FakeChatModel(latency=args.ttft, tokens_per_second=args.tokens_per_second,
+                                                      reply=REPLY, seed=0)
+    chat_app.admission = AdmissionController(rpm=10 ** 6, tpm=10 ** 9)
+
+    results = {}
+    for name, run in (("index", lambda: bench_index(results, sizes, rounds)),
+                      ("chat_api", lambda: bench_chat_api(results, levels, requests)),
+                      ("store", lambda: bench_store(results, sizes, rounds)),
+                      ("markdown", lambda: bench_markdown(results, rounds))):
+        start = time.perf_counter()
+        run()
+        print(f"{name}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    report = json.dumps({
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ttft": args.ttft,
+            "tokens_per_second": args.tokens_per_second,
+            "quick": args.quick,
+        },
+        "results": {name: round(value, 4) for name, value in results.items()},
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+
+from lru import LRUCache
+from sharedcache import SharedCache
+
+
+def normalize(text):
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(messages, model, temperature):
+    payload = json.dumps(
+        [model, temperature, [(m.type, normalize(m.content)) for m in messages]],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryCacheBackend:
+    def __init__(self, maxsize=4096, ttl=3600):
+        self._entries = LRUCache(maxsize, ttl)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value):
+        self._entries.set(key, value)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SQLiteCacheBackend(SharedCache):
+    """Replies kept in the shared cache file, so every worker sees them."""
+
+    def __init__(self, path, maxsize=4096, ttl=3600):
+        super().__init__(path, "response", maxsize, ttl)
+
+
+class ResponseCache:
+    """Exact-match cache of LLM replies keyed on the normalized prompt."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, messages, llm):
+        return cache_key(messages, getattr(llm, "model_name", ""), getattr(llm, "temperature", None))
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def create_response_cache():
+    backend = os.getenv("CHAT_CACHE", "memory")
+    maxsize = int(os.getenv("CHAT_CACHE_SIZE", 4096))
+    ttl = int(os.getenv("CHAT_CACHE_TTL", 3600))
+    if backend == "sqlite":
+        path = os.getenv("CHAT_CACHE_PATH") or os.getenv("CHAT_SHARED_CACHE_PATH", "response_cache.db")
+        return ResponseCache(SQLiteCacheBackend(path, maxsize, ttl))
+    if backend == "memory":
+        return ResponseCache(MemoryCacheBackend(maxsize, ttl))
+    raise ValueError(f"Unknown CHAT_CACHE backend: {backend}")
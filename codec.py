@@ -0,0 +1,95 @@
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional; bodies are zlib-compressed instead
+    zstandard = None
+
+RAW, ZLIB, ZSTD = 0, 1, 2
+
+
+def pack_body(content, html=None):
+    """A message body as bytes: a flag, then the content, then the html after its length."""
+    content = content.encode()
+    if html is None:
+        return b"\x00" + content
+    return b"\x01" + len(content).to_bytes(4, "little") + content + html.encode()
+
+
+def unpack_body(data):
+    if data[0] == 0:
+        return data[1:].decode(), None
+    size = int.from_bytes(data[1:5], "little")
+    return data[5:5 + size].decode(), data[5 + size:].decode()
+
+
+class BodyCodec:
+    """Compresses stored message bodies: zstd when installed, zlib otherwise.
+
+    Short bodies are kept as they are. zstd can use a dictionary trained on
+    earlier bodies, which helps most with short, similar messages; every
+    body records the dictionary it was written with, so a new dictionary
+    only applies to new bodies.
+    """
+
+    MIN_SIZE = 64
+
+    def __init__(self, level=3):
+        self.level = level
+        self.dictionary = None
+        self._dictionaries = {}
+        self._local = threading.local()
+
+    def __contains__(self, dict_id):
+        return dict_id in self._dictionaries
+
+    def add_dictionary(self, dict_id, data, use=True):
+        if zstandard is None:
+            return
+        self._dictionaries[dict_id] = zstandard.ZstdCompressionDict(data)
+        if use:
+            self.dictionary = dict_id
+
+    def _zstd(self, kind, dict_id):
+        # zstd (de)compressors are not thread-safe, so each thread keeps its own
+        cache = self._local.__dict__.setdefault(kind, {})
+        codec = cache.get(dict_id)
+        if codec is None:
+            dictionary = self._dictionaries[dict_id] if dict_id is not None else None
+            if kind == "compress":
+                codec = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+            else:
+                codec = zstandard.ZstdDecompressor(dict_data=dictionary)
+            cache[dict_id] = codec
+        return codec
+
+    def compress(self, data):
+        """Returns (codec, dictionary id, payload)."""
+        if len(data) >= self.MIN_SIZE:
+            if zstandard is not None:
+                compressed = ZSTD, self.dictionary, self._zstd("compress", self.dictionary).compress(data)
+            else:
+                compressed = ZLIB, None, zlib.compress(data, 6)
+            if len(compressed[2]) < len(data):
+                return compressed
+        return RAW, None, data
+
+    def decompress(self, codec, dict_id, data):
+        if codec == RAW:
+            return bytes(data)
+        if codec == ZLIB:
+            return zlib.decompress(data)
+        if zstandard is None:
+            raise RuntimeError("This store has zstd-compressed messages; install zstandard to read them")
+        return self._zstd("decompress", dict_id).decompress(data)
+
+
+def train_dictionary(samples, size=64 * 1024):
+    """Trains a zstd dictionary on sample bodies; None without zstandard or enough samples."""
+    if zstandard is None or len(samples) < 64:
+        return None
+    try:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError:
+        return None
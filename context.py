@@ -0,0 +1,68 @@
+import os
+from dataclasses import dataclass
+
+# Fixed per-message cost of the chat format (role markers, separators)
+MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text):
+    # Cheap estimate (~4 characters per token for English text); errs on the
+    # side of overcounting so the prompt never overflows the model context.
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD
+
+
+@dataclass
+class Window:
+    messages: list
+    prompt_tokens: int
+    dropped_messages: int
+    dropped_tokens: int
+
+    def stats(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "dropped_messages": self.dropped_messages,
+            "dropped_tokens": self.dropped_tokens,
+        }
+
+
+class ContextWindow:
+    """Picks the newest messages that fit the prompt budget of the model."""
+
+    def __init__(self, max_tokens=8192, reply_tokens=1024):
+        self.max_tokens = max_tokens
+        self.reply_tokens = reply_tokens
+
+    @property
+    def budget(self):
+        return self.max_tokens - self.reply_tokens
+
+    def select(self, history, budget=None):
+        if budget is None:
+            budget = self.budget
+        used = 0
+        kept = []
+        # Walk back from the head of the active branch; only the kept window is visited
+        for message in reversed(history):
+            if used + message.tokens > budget and kept:
+                break
+            used += message.tokens
+            kept.append(message)
+        kept.reverse()
+
+        # Don't open the window on a dangling AI reply
+        if len(kept) > 1 and kept[0].role != "user":
+            used -= kept.pop(0).tokens
+
+        if not kept:
+            return Window([], 0, 0, 0)
+        # Nodes carry their depth and running token total, so the dropped prefix is never walked
+        first = kept[0]
+        return Window(kept, used, first.depth, first.prefix_tokens - first.tokens)
+
+
+def create_context_window():
+    return ContextWindow(
+        max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", 8192)),
+        reply_tokens=int(os.getenv("CONTEXT_REPLY_TOKENS", 1024)),
+    )
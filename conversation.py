@@ -0,0 +1,199 @@
+import threading
+
+from context import count_tokens
+
+
+class Message:
+    """One chat turn and its node in the conversation tree.
+
+    Token count is computed once and the langchain object on first use; both
+    are shared by every branch that passes through the node. Messages read
+    back from storage may defer their content and html until first use.
+    """
+
+    __slots__ = ("role", "_content", "tokens", "_html", "id", "parent", "depth", "prefix_tokens", "_langchain",
+                 "_load")
+
+    def __init__(self, role, content, tokens=None, html=None):
+        self.role = role
+        self._content = content
+        self.tokens = count_tokens(content) if tokens is None else tokens
+        self._html = html
+        self._load = None
+        self.id = None
+        self.parent = None
+        self.depth = 0
+        self.prefix_tokens = self.tokens
+        self._langchain = None
+
+    @classmethod
+    def coerce(cls, message):
+        if isinstance(message, cls):
+            return message
+        return cls(message["role"], message["content"], message.get("tokens"), message.get("html"))
+
+    @classmethod
+    def deferred(cls, role, tokens, load):
+        """A message whose content and html are fetched by load() when first read."""
+        message = cls(role, None, tokens)
+        message._load = load
+        return message
+
+    def _resolve(self):
+        load = self._load
+        if load is not None:
+            self._content, self._html = load()
+            self._load = None
+
+    @property
+    def content(self):
+        self._resolve()
+        return self._content
+
+    @property
+    def html(self):
+        self._resolve()
+        return self._html
+
+    def detached(self):
+        # A node belongs to one tree; reusing it elsewhere takes a copy of the record
+        if self.id is None:
+            return self
+        message = Message(self.role, self.content, self.tokens, self.html)
+        message._langchain = self._langchain
+        return message
+
+    def to_langchain(self):
+        if self._langchain is None:
+            from langchain_core.messages import AIMessage, HumanMessage
+            self._langchain = (HumanMessage if self.role == "user" else AIMessage)(content=self.content)
+        return self._langchain
+
+    def to_dict(self):
+        message = {"id": self.id, "role": self.role, "content": self.content, "tokens": self.tokens}
+        if self.html is not None:
+            message["html"] = self.html
+        return message
+
+
+class Conversation:
+    """Tree of chat turns with one active branch, shared by the store and the handlers.
+
+    Nodes are only ever added: a turn appends under the head, an edit adds a
+    sibling of the edited message, so every branch shares its prefix with the
+    others and no history is copied or thrown away. The active branch is read
+    back from the head through parent links, so a turn only touches its
+    context window; depth and prefix token totals are kept on the nodes.
+    """
+
+    __slots__ = ("nodes", "children", "head", "generation", "_lock")
+
+    def __init__(self, messages=(), generation=0):
+        self.nodes = []
+        self.children = {}
+        self.head = None
+        self.generation = generation
+        self._lock = threading.Lock()
+        self.append(*messages)
+
+    def __len__(self):
+        return 0 if self.head is None else self.head.depth + 1
+
+    def __reversed__(self):
+        node = self.head
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def path(self):
+        messages = list(reversed(self))
+        messages.reverse()
+        return messages
+
+    def __iter__(self):
+        return iter(self.path())
+
+    def __getitem__(self, index):
+        return self.path()[index]
+
+    @property
+    def total_tokens(self):
+        return 0 if self.head is None else self.head.prefix_tokens
+
+    def add(self, message, parent=None):
+        message = Message.coerce(message).detached()
+        with self._lock:
+            message.id = len(self.nodes)
+            message.parent = parent
+            if parent is not None:
+                message.depth = parent.depth + 1
+                message.prefix_tokens = parent.prefix_tokens + message.tokens
+            self.nodes.append(message)
+            self.children.setdefault(None if parent is None else parent.id, []).append(message.id)
+        return message
+
+    def append(self, *messages):
+        for message in messages:
+            self.head = self.add(message, self.head)
+        return self
+
+    def fork(self, parent_id, message):
+        self.head = self.add(message, None if parent_id is None else self.nodes[parent_id])
+        return self
+
+    def switch(self, node_id):
+        self.head = None if node_id is None else self.nodes[node_id]
+        return self
+
+    def page(self, before=None, limit=50):
+        """Up to limit messages of the branch ending just above node `before` (default: the head).
+
+        Returns them oldest first, and whether older messages remain.
+        """
+        if before is None:
+            node = self.head
+        elif 0 <= before < len(self.nodes):
+            node = self.nodes[before].parent
+        else:
+            return [], False
+        messages = []
+        while node is not None and len(messages) < limit:
+            messages.append(node)
+            node = node.parent
+        messages.reverse()
+        return messages, node is not None
+
+    def last(self, role):
+        for node in reversed(self):
+            if node.role == role:
+                return node
+        return None
+
+    def leaf(self, node_id):
+        """The newest branch tip under a node, following the latest child down."""
+        node = self.nodes[node_id]
+        while node.id in self.children:
+            node = self.nodes[self.children[node.id][-1]]
+        return node
+
+    def siblings(self, node):
+        return self.children[None if node.parent is None else node.parent.id]
+
+    def on_branch(self, node_id):
+        """Whether the node is on the active branch, i.e. the head or one of its ancestors."""
+        if not 0 <= node_id < len(self.nodes):
+            return False
+        target = self.nodes[node_id]
+        node = self.head
+        while node is not None and node.depth > target.depth:
+            node = node.parent
+        return node is target
+
+    def forks(self):
+        """Where the active branch has alternatives: node id, sibling ids and position."""
+        forks = []
+        for node in self.path():
+            siblings = self.siblings(node)
+            if len(siblings) > 1:
+                forks.append({"id": node.id, "siblings": siblings, "index": siblings.index(node.id)})
+        return forks
@@ -0,0 +1,9 @@
+import sqlite3
+
+
+def open_sqlite(path):
+    """Autocommit connection in WAL mode, so several worker processes can share the file."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from cache import normalize
+from context import count_tokens
+
+
+class FakeUpstreamError(Exception):
+    """Injected upstream failure, shaped like the Groq client's status errors."""
+
+    def __init__(self, status_code=503, retry_after=None):
+        super().__init__(f"fake upstream error {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={} if retry_after is None else {"retry-after": str(retry_after)})
+
+
+def prompt_key(messages):
+    # Model-independent, so a recording made against one model replays for any
+    payload = json.dumps([(m.type, normalize(m.content)) for m in messages], separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def split_tokens(text):
+    return re.findall(r"\s*\S+", text) or [text]
+
+
+class FakeChatModel:
+    """Local stand-in for ChatGroq with the same invoke/stream surface.
+
+    The first token arrives after ``latency`` seconds (``tail_latency`` for a
+    ``tail_rate`` fraction of calls) and the rest at ``tokens_per_second``,
+    or all at once when that is None. A ``failure_rate`` fraction of calls
+    raise FakeUpstreamError with ``failure_status`` (and a Retry-After of
+    ``retry_after`` seconds when set). Replies come from ``replies`` (prompt
+    key -> text, see ``load_recording``) when the prompt was recorded, else
+    ``reply``.
+    """
+
+    def __init__(self, reply="This is a canned reply from the local fake model.", latency=0.2,
+                 tokens_per_second=None, model_name="fake-llm", temperature=0.5, failure_rate=0.0,
+                 failure_status=503, retry_after=None, tail_rate=0.0, tail_latency=2.0, seed=None, replies=None):
+        self.reply = reply
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.model_name = model_name
+        self.temperature = temperature
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.replies = replies or {}
+        self.calls = 0
+        self.failures = 0
+        self.replayed = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, messages):
+        with self._lock:
+            self.calls += 1
+            ttft = self.tail_latency if self._rng.random() < self.tail_rate else self.latency
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            reply = self.replies.get(prompt_key(messages)) if self.replies else None
+            if reply is not None:
+                self.replayed += 1
+        return ttft, failed, self.reply if reply is None else reply
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _message(self, messages, reply):
+        prompt_tokens = sum(count_tokens(m.content) for m in messages)
+        completion_tokens = count_tokens(reply)
+        return AIMessage(content=reply, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+
+    def invoke(self, messages, **kwargs):
+        ttft, failed, reply = self._call(messages)
+        time.sleep(ttft)
+        if failed:
+            raise FakeUpstreamError(self.failure_status, self.retry_after)
+        time.sleep(self._token_delay() * (len(split_tokens(reply)) - 1))
+        return self._message(messages, reply)
+
+    def stream(self, messages, **kwargs):
+        ttft, failed, reply = self._call(messages)
+        time.sleep(ttft)
+        if failed:
+            raise FakeUpstreamError(self.failure_status, self.retry_after)
+        delay = self._token_delay()
+        for i, piece in enumerate(split_tokens(reply)):
+            if i and delay:
+                time.sleep(delay)
+            yield AIMessageChunk(content=piece)
+
+    async def ainvoke(self, messages, **kwargs):
+        ttft, failed, reply = self._call(messages)
+        await asyncio.sleep(ttft)
+        if failed:
+            raise FakeUpstreamError(self.failure_status, self.retry_after)
+        await asyncio.sleep(self._token_delay() * (len(split_tokens(reply)) - 1))
+        return self._message(messages, reply)
+
+    async def astream(self, messages, **kwargs):
+        ttft, failed, reply = self._call(messages)
+        await asyncio.sleep(ttft)
+        if failed:
+            raise FakeUpstreamError(self.failure_status, self.retry_after)
+        delay = self._token_delay()
+        for i, piece in enumerate(split_tokens(reply)):
+            if i and delay:
+                await asyncio.sleep(delay)
+            yield AIMessageChunk(content=piece)
+
+
+class RecordingChatModel:
+    """Passes calls through to a real model and appends each reply to a JSONL file.
+
+    Each line holds the prompt key, the prompt, the reply and the observed
+    time to first token and total duration, for replay by FakeChatModel.
+    """
+
+    def __init__(self, model, path):
+        self.model = model
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        return getattr(self.model, "model_name", "")
+
+    @property
+    def temperature(self):
+        return getattr(self.model, "temperature", None)
+
+    def _record(self, messages, reply, ttft, duration):
+        line = json.dumps({
+            "key": prompt_key(messages),
+            "model": self.model_name,
+            "messages": [{"type": m.type, "content": m.content} for m in messages],
+            "reply": reply,
+            "ttft": round(ttft, 4),
+            "duration": round(duration, 4),
+        })
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def invoke(self, messages, **kwargs):
+        start = time.monotonic()
+        response = self.model.invoke(messages, **kwargs)
+        elapsed = time.monotonic() - start
+        self._record(messages, response.content, elapsed, elapsed)
+        return response
+
+    def stream(self, messages, **kwargs):
+        start = time.monotonic()
+        ttft = None
+        parts = []
+        for chunk in self.model.stream(messages, **kwargs):
+            ttft = ttft if ttft is not None else time.monotonic() - start
+            parts.append(chunk.content)
+            yield chunk
+        self._record(messages, "".join(parts), ttft or 0.0, time.monotonic() - start)
+
+    async def ainvoke(self, messages, **kwargs):
+        start = time.monotonic()
+        response = await self.model.ainvoke(messages, **kwargs)
+        elapsed = time.monotonic() - start
+        self._record(messages, response.content, elapsed, elapsed)
+        return response
+
+    async def astream(self, messages, **kwargs):
+        start = time.monotonic()
+        ttft = None
+        parts = []
+        async for chunk in self.model.astream(messages, **kwargs):
+            ttft = ttft if ttft is not None else time.monotonic() - start
+            parts.append(chunk.content)
+            yield chunk
+        self._record(messages, "".join(parts), ttft or 0.0, time.monotonic() - start)
+
+
+def load_recording(path):
+    """Reads a RecordingChatModel file into the ``replies`` map FakeChatModel takes."""
+    replies = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                replies[entry["key"]] = entry["reply"]
+    return replies
+
+
+def create_fake_chat_model(model_name):
+    replay = os.getenv("FAKE_LLM_REPLAY")
+    tps = os.getenv("FAKE_LLM_TOKENS_PER_SECOND")
+    seed = os.getenv("FAKE_LLM_SEED")
+    return FakeChatModel(
+        latency=float(os.getenv("FAKE_LLM_TTFT", 0.2)),
+        tokens_per_second=float(tps) if tps else None,
+        model_name=f"fake-{model_name}",
+        failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", 0.0)),
+        seed=int(seed) if seed else None,
+        replies=load_recording(replay) if replay else None,
+    )
@@ -0,0 +1,86 @@
+import threading
+import uuid
+
+
+class Cancelled(Exception):
+    """The reply was cancelled before it finished."""
+
+    status = 499
+
+    def __init__(self, reason="client"):
+        super().__init__("Reply cancelled")
+        self.reason = reason
+
+
+class Generation:
+    """One in-flight reply; cancel() may be called from any thread."""
+
+    __slots__ = ("id", "cid", "reason", "_callbacks", "_lock")
+
+    def __init__(self, generation_id, cid):
+        self.id = generation_id
+        self.cid = cid
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self, reason="client"):
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return True
+
+
+class GenerationRegistry:
+    """Replies in flight in this process, by id, so another request can cancel them.
+
+    A cancel only reaches replies running in the worker that receives it;
+    client disconnects are noticed by whichever worker runs the reply.
+    """
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def start(self, cid, generation_id=None):
+        # Clients may pick the id, so a non-streaming request can be cancelled before it answers
+        if not isinstance(generation_id, str) or not 0 < len(generation_id) <= 64:
+            generation_id = uuid.uuid4().hex
+        generation = Generation(generation_id, cid)
+        with self._lock:
+            self._generations[generation_id] = generation
+        return generation
+
+    def finish(self, generation):
+        with self._lock:
+            if self._generations.get(generation.id) is generation:
+                del self._generations[generation.id]
+
+    def cancel(self, cid, generation_id=None, reason="client"):
+        """Cancels one of the conversation's replies, or all of them without an id."""
+        with self._lock:
+            if generation_id is not None:
+                generation = self._generations.get(generation_id)
+                targets = [generation] if generation is not None and generation.cid == cid else []
+            else:
+                targets = [g for g in self._generations.values() if g.cid == cid]
+        return sum(generation.cancel(reason) for generation in targets)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._generations)}
@@ -0,0 +1,187 @@
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+HISTORY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Timer of the request being served on this thread / task (None when metrics are off)
+current_timer = ContextVar("current_timer", default=None)
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (+Inf last), then sum and count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket
+                    le = format_labels(self.labelnames, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Phase:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+class RequestTimer:
+    """Per-request phase durations; repeated phases accumulate."""
+
+    __slots__ = ("start", "phases")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def phase(name):
+    """Times a block into the current request's timer; free when none is running."""
+    timer = current_timer.get()
+    return NULL_PHASE if timer is None else timer.phase(name)
+
+
+class ChatMetrics:
+    """Prometheus-style counters and histograms for the chat hot path."""
+
+    def __init__(self):
+        self.request_seconds = Histogram("chat_request_seconds", "Request duration", ("endpoint",))
+        self.phase_seconds = Histogram("chat_phase_seconds", "Time spent per request phase", ("phase",))
+        self.llm_seconds = Histogram("chat_llm_seconds", "Upstream LLM call duration", ("model",))
+        self.ttft_seconds = Histogram("chat_llm_ttft_seconds", "Upstream time to first token", ("model",))
+        self.tokens = Counter("chat_llm_tokens_total", "Tokens sent to and received from the LLM",
+                              ("model", "direction"))
+        self.completion_tokens = Histogram("chat_completion_tokens", "Tokens per reply", ("model",),
+                                           TOKEN_BUCKETS)
+        self.cache = Counter("chat_cache_requests_total", "Reply cache lookups", ("result",))
+        self.history = Histogram("chat_history_messages", "Conversation length per turn", (),
+                                 HISTORY_BUCKETS)
+        self.errors = Counter("chat_errors_total", "Failed chat requests", ("status",))
+        self.cancellations = Counter("chat_cancellations_total", "Replies cancelled before they finished",
+                                     ("reason",))
+        self.tokens_saved = Counter("chat_cancelled_tokens_saved_total",
+                                    "Reserved completion tokens not generated because the reply was cancelled",
+                                    ("model",))
+
+    def start_request(self):
+        timer = RequestTimer()
+        current_timer.set(timer)
+        return timer
+
+    def finish_request(self, timer, endpoint):
+        for name, seconds in timer.phases.items():
+            self.phase_seconds.observe(seconds, name)
+        self.request_seconds.observe(timer.elapsed(), endpoint or "unknown")
+
+    def observe_llm(self, model, seconds, prompt_tokens, completion_tokens, ttft=None):
+        self.llm_seconds.observe(seconds, model)
+        if ttft is not None:
+            self.ttft_seconds.observe(ttft, model)
+        self.tokens.inc(model, "in", amount=prompt_tokens)
+        self.tokens.inc(model, "out", amount=completion_tokens)
+        self.completion_tokens.observe(completion_tokens, model)
+
+    def observe_cancel(self, model, reason, saved_tokens):
+        self.cancellations.inc(reason)
+        if saved_tokens:
+            self.tokens_saved.inc(model, amount=saved_tokens)
+
+    def render(self):
+        lines = []
+        for metric in vars(self).values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def create_metrics():
+    if os.getenv("CHAT_METRICS", "0") != "1":
+        return None
+    return ChatMetrics()
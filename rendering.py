@@ -0,0 +1,34 @@
+import hashlib
+import threading
+
+import markdown
+
+from lru import LRUCache
+from sharedcache import create_shared_cache
+
+EXTENSIONS = ["fenced_code", "codehilite"]
+
+_local = threading.local()
+_rendered = LRUCache(maxsize=2048)
+# Optional second tier shared by all workers (CHAT_SHARED_CACHE_PATH)
+_shared = create_shared_cache("markdown")
+
+
+def _markdown():
+    # Markdown instances aren't thread-safe; build one per thread and reset it between uses
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = _local.md = markdown.Markdown(extensions=EXTENSIONS)
+    return md
+
+
+def render_markdown(text):
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    html = _rendered.get(key)
+    if html is None:
+        if _shared is None:
+            html = _markdown().reset().convert(text)
+        else:
+            html = _shared.get_or_compute(key.hex(), lambda: _markdown().reset().convert(text))
+        _rendered.set(key, html)
+    return html
@@ -0,0 +1,408 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from admission import Overloaded
+from context import count_tokens
+
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504}
+TRANSIENT_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+def is_transient(e):
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if getattr(e, "status_code", None) in TRANSIENT_STATUS:
+        return True
+    return type(e).__name__ in TRANSIENT_NAMES
+
+
+def is_rate_limited(e):
+    return getattr(e, "status_code", None) == 429
+
+
+def retry_after(e):
+    """Seconds the upstream asked for in a Retry-After header, or None."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies: the last ``size``, no older than ``max_age`` seconds."""
+
+    def __init__(self, size=200, max_age=None):
+        self.max_age = max_age
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        if self.max_age is not None:
+            while self._samples and now - self._samples[0][0] > self.max_age:
+                self._samples.popleft()
+
+    def record(self, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._samples.append((now, seconds))
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._samples)
+
+    def percentile(self, p):
+        with self._lock:
+            self._expire(time.monotonic())
+            samples = sorted(seconds for _, seconds in self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one probe through after ``reset_timeout``."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_ignored(self):
+        # A throttled probe says nothing about the upstream's health; the next call probes instead
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class ResilientLLM:
+    """Wraps a chat model with retries, hedged requests and a circuit breaker.
+
+    Exposes the same invoke/stream/ainvoke/astream surface as the wrapped
+    model. Transient failures are retried with capped, fully jittered
+    exponential backoff, or after the upstream's Retry-After when it sends
+    one; a 429 asking for longer than ``backoff_max`` is not retried. When
+    hedging is on, a duplicate request is sent once the first has been
+    outstanding longer than the recent p95 latency and the first reply wins.
+    With ``admission``, every retry and hedge takes its own ticket and is
+    skipped when the budget has no room for it right away. While the
+    breaker is open, calls go to ``fallback``; rate limiting doesn't count
+    towards opening it. Streams are only retried before their first chunk.
+    """
+
+    def __init__(self, primary, fallback=None, retries=2, backoff_base=0.25, backoff_max=4.0,
+                 hedge=False, hedge_percentile=95, hedge_min_delay=0.5, hedge_min_samples=20,
+                 breaker=None, admission=None, reply_tokens=512):
+        self.primary = primary
+        self.fallback = fallback
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.admission = admission
+        self.reply_tokens = reply_tokens
+        self.latency = LatencyTracker()
+        self.counts = {"retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "over_budget": 0}
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge") if hedge else None
+
+    @property
+    def model_name(self):
+        return getattr(self.primary, "model_name", "")
+
+    @property
+    def temperature(self):
+        return getattr(self.primary, "temperature", None)
+
+    def _count(self, name):
+        self.counts[name] += 1
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _admit_extra(self, messages):
+        # An extra attempt isn't followed to completion, so it is charged its whole reservation
+        if self.admission is None:
+            return True
+        prompt_tokens = sum(count_tokens(str(m.content)) for m in messages)
+        try:
+            ticket = self.admission.acquire(prompt_tokens, self.reply_tokens, deadline=time.monotonic())
+        except Overloaded:
+            self._count("over_budget")
+            return False
+        ticket.settle(ticket.tokens)
+        self.admission.release(ticket)
+        return True
+
+    def _retry_delay(self, attempt, e, messages):
+        """Seconds to wait before retrying after ``e``, or None when it isn't retried."""
+        if attempt == self.retries or not is_transient(e):
+            return None
+        delay = retry_after(e)
+        if delay is None:
+            delay = self._backoff(attempt)
+        elif delay > self.backoff_max:
+            return None
+        if not self._admit_extra(messages):
+            return None
+        self._count("retries")
+        return delay
+
+    def _hedge_delay(self):
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    def _timed(self, fn, *args, **kwargs):
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    def _with_fallback(self, attempt_primary, attempt_fallback):
+        if self.fallback is not None and not self.breaker.allow():
+            self._count("fallbacks")
+            return attempt_fallback()
+        try:
+            result = attempt_primary()
+        except Exception as e:
+            if is_rate_limited(e):
+                self.breaker.record_ignored()
+            elif not is_transient(e):
+                # The upstream answered; the request itself was bad
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_failure()
+            if self.fallback is None:
+                raise
+            self._count("fallbacks")
+            return attempt_fallback()
+        self.breaker.record_success()
+        return result
+
+    # Blocking
+
+    def _hedged_invoke(self, messages, **kwargs):
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._timed(self.primary.invoke, messages, **kwargs)
+        first = self._executor.submit(self._timed, self.primary.invoke, messages, **kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done or not self._admit_extra(messages):
+            return first.result()
+        self._count("hedges")
+        second = self._executor.submit(self._timed, self.primary.invoke, messages, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _retrying(self, call, messages):
+        for attempt in range(self.retries + 1):
+            try:
+                return call()
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, messages)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def invoke(self, messages, **kwargs):
+        return self._with_fallback(
+            lambda: self._retrying(lambda: self._hedged_invoke(messages, **kwargs), messages),
+            lambda: self.fallback.invoke(messages, **kwargs),
+        )
+
+    def _open_stream(self, model, messages, kwargs):
+        # Retry until the first chunk arrives; after that the stream is committed
+        for attempt in range(self.retries + 1):
+            iterator = iter(model.stream(messages, **kwargs))
+            try:
+                first = next(iterator, None)
+                return first, iterator
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, messages)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def stream(self, messages, **kwargs):
+        first, iterator = self._with_fallback(
+            lambda: self._open_stream(self.primary, messages, kwargs),
+            lambda: self._open_stream(self.fallback, messages, kwargs),
+        )
+        if first is None:
+            return
+        yield first
+        yield from iterator
+
+    # Asyncio
+
+    async def _atimed(self, messages, **kwargs):
+        start = time.monotonic()
+        result = await self.primary.ainvoke(messages, **kwargs)
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    async def _ahedged_invoke(self, messages, **kwargs):
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._atimed(messages, **kwargs)
+        first = asyncio.ensure_future(self._atimed(messages, **kwargs))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self._admit_extra(messages):
+            return await first
+        self._count("hedges")
+        second = asyncio.ensure_future(self._atimed(messages, **kwargs))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _aretrying(self, call, messages):
+        for attempt in range(self.retries + 1):
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, messages)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _awith_fallback(self, attempt_primary, attempt_fallback):
+        if self.fallback is not None and not self.breaker.allow():
+            self._count("fallbacks")
+            return await attempt_fallback()
+        try:
+            result = await attempt_primary()
+        except Exception as e:
+            if is_rate_limited(e):
+                self.breaker.record_ignored()
+            elif not is_transient(e):
+                # The upstream answered; the request itself was bad
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_failure()
+            if self.fallback is None:
+                raise
+            self._count("fallbacks")
+            return await attempt_fallback()
+        self.breaker.record_success()
+        return result
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self._awith_fallback(
+            lambda: self._aretrying(lambda: self._ahedged_invoke(messages, **kwargs), messages),
+            lambda: self.fallback.ainvoke(messages, **kwargs),
+        )
+
+    async def _aopen_stream(self, model, messages, kwargs):
+        for attempt in range(self.retries + 1):
+            iterator = model.astream(messages, **kwargs).__aiter__()
+            try:
+                first = await iterator.__anext__()
+                return first, iterator
+            except StopAsyncIteration:
+                return None, iterator
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, messages)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def astream(self, messages, **kwargs):
+        first, iterator = await self._awith_fallback(
+            lambda: self._aopen_stream(self.primary, messages, kwargs),
+            lambda: self._aopen_stream(self.fallback, messages, kwargs),
+        )
+        if first is None:
+            return
+        yield first
+        async for chunk in iterator:
+            yield chunk
+
+    def stats(self):
+        return {
+            **self.counts,
+            "breaker": self.breaker.state,
+            "p95_seconds": self.latency.percentile(95),
+        }
+
+
+def create_resilient_llm(primary, make_model, fallback_model=None, admission=None, reply_tokens=512):
+    fallback_model = fallback_model or os.getenv("GROQ_FALLBACK_MODEL", "llama3-8b-8192")
+    return ResilientLLM(
+        primary,
+        fallback=make_model(fallback_model) if fallback_model else None,
+        retries=int(os.getenv("LLM_RETRIES", 2)),
+        hedge=os.getenv("LLM_HEDGE", "0") == "1",
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", 30)),
+        ),
+        admission=admission,
+        reply_tokens=reply_tokens,
+    )
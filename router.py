@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import Counter
+
+from resilient import LatencyTracker
+
+LARGE = "large"
+SMALL = "small"
+
+
+class Route:
+    __slots__ = ("name", "model", "reason")
+
+    def __init__(self, name, model, reason):
+        self.name = name
+        self.model = model
+        self.reason = reason
+
+    def stats(self):
+        return {"model": self.name, "model_name": getattr(self.model, "model_name", ""), "reason": self.reason}
+
+
+class ModelRouter:
+    """Chooses between the large and the small model from cheap request features.
+
+    Code, long prompts and deep conversations go to the large model; short
+    shallow exchanges go to the small one. A client may override the choice.
+    When the large model's recent p95 latency breaches ``latency_slo``, the
+    requests that would only have gone large for their length or depth are
+    moved to the small model until it recovers. Latency samples age out
+    after ``latency_window`` seconds, so the p95 recovers once the large
+    model's slow calls are that old, even if little traffic is left on it.
+    """
+
+    def __init__(self, get_model, small_available=True, small_max_tokens=300, small_max_depth=6,
+                 latency_slo=None, latency_window=60.0):
+        self.get_model = get_model
+        self.small_available = small_available
+        self.small_max_tokens = small_max_tokens
+        self.small_max_depth = small_max_depth
+        self.latency_slo = latency_slo
+        self.latency = {LARGE: LatencyTracker(max_age=latency_window), SMALL: LatencyTracker(max_age=latency_window)}
+        self.decisions = Counter()
+        self._lock = threading.Lock()
+
+    def over_slo(self):
+        if self.latency_slo is None or len(self.latency[LARGE]) < 20:
+            return False
+        return self.latency[LARGE].percentile(95) > self.latency_slo
+
+    def choose(self, messages, window, override=None):
+        if not self.small_available:
+            return LARGE, "single_model"
+        if override in (LARGE, SMALL):
+            return override, "override"
+        if any("```" in m.content for m in messages):
+            return LARGE, "code"
+        depth = window.dropped_messages + len(window.messages)
+        if window.prompt_tokens <= self.small_max_tokens and depth <= self.small_max_depth:
+            return SMALL, "short"
+        if self.over_slo():
+            return SMALL, "latency_slo"
+        return LARGE, "long_prompt" if window.prompt_tokens > self.small_max_tokens else "deep_history"
+
+    def route(self, messages, window, override=None):
+        name, reason = self.choose(messages, window, override)
+        with self._lock:
+            self.decisions[f"{name}:{reason}"] += 1
+        return Route(name, self.get_model(name), reason)
+
+    def record(self, name, seconds):
+        self.latency[name].record(seconds)
+
+    def stats(self):
+        return {
+            "decisions": dict(self.decisions),
+            "over_slo": self.over_slo(),
+            "latency": {
+                name: {"p50": tracker.percentile(50), "p95": tracker.percentile(95), "samples": len(tracker)}
+                for name, tracker in self.latency.items()
+            },
+        }
+
+
+def create_router(get_model, small_available):
+    slo = os.getenv("ROUTER_LATENCY_SLO")
+    return ModelRouter(
+        get_model,
+        small_available=small_available,
+        small_max_tokens=int(os.getenv("ROUTER_SMALL_MAX_TOKENS", 300)),
+        small_max_depth=int(os.getenv("ROUTER_SMALL_MAX_DEPTH", 6)),
+        latency_slo=float(slo) if slo else None,
+        latency_window=float(os.getenv("ROUTER_LATENCY_WINDOW", 60)),
+    )
@@ -0,0 +1,174 @@
+import html
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from db import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+# Private-use characters mark matches in snippets, so the text can be escaped before they become <mark> tags
+_OPEN, _CLOSE = "\ue000", "\ue001"
+_WORD = re.compile(r"\w+")
+# bm25 counts every row holding each query term, so words found in most messages make a query slow without
+# making it more selective; they are left out unless the query has nothing else
+STOPWORDS = frozenset("""
+    a about an and are as at be but by can do does for from has have how i if in into is it its me my no not
+    of on or our so that the their them then there these they this to was we what when where which who why
+    will with you your
+""".split())
+
+
+def match_query(text):
+    """An FTS5 query matching every word of the user's text, the last one also as a prefix.
+
+    Returns None when the text has no words.
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    kept = [word for word in words if word not in STOPWORDS] or words
+    terms = [f'"{word}"' for word in kept]
+    # The last word may still be being typed; shorter prefixes match too much of the vocabulary to help
+    if kept[-1] == words[-1] and len(words[-1]) >= 3:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def cid_query(cid):
+    return 'cid : "%s"' % cid.replace('"', '""')
+
+
+def highlight(snippet):
+    return html.escape(snippet).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+class SearchIndex:
+    """Full-text index of past conversations in a SQLite FTS5 file.
+
+    Handlers only queue messages; a background thread writes them in
+    batches, one transaction each, so indexing stays off the request path.
+    The queue is bounded: when the writer falls that far behind, new
+    messages are dropped from the index (and counted) rather than slowing
+    replies down. Documents older than the TTL are purged periodically.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, batch_size=512, queue_size=10000):
+        self.path = path
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.indexed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._local = threading.local()
+        # The conversation id is an indexed column so a user's search only reads their own postings
+        self._conn().executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+                content, cid, message UNINDEXED, role UNINDEXED, created UNINDEXED,
+                tokenize = 'porter unicode61'
+            );
+        """)
+        self._purged = 0.0
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+        return conn
+
+    def _put(self, item):
+        # Started on first use, so each forked worker gets its own writer
+        if self._writer is None or not self._writer.is_alive():
+            with self._lock:
+                if self._writer is None or not self._writer.is_alive():
+                    self._writer = threading.Thread(target=self._run, name="search-indexer", daemon=True)
+                    self._writer.start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def add(self, cid, message):
+        self._put(("add", cid, message.id, message.role, message.content, time.time()))
+
+    def delete(self, cid):
+        self._put(("delete", cid))
+
+    def flush(self):
+        """Waits until everything queued so far is written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=60)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Search indexing failed for %d queued changes", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for kind, cid, *fields in batch:
+                if kind == "add":
+                    message, role, content, created = fields
+                    conn.execute("INSERT INTO search (content, cid, message, role, created) VALUES (?, ?, ?, ?, ?)",
+                                 (content, cid, message, role, created))
+                else:
+                    conn.execute("DELETE FROM search WHERE rowid IN (SELECT rowid FROM search WHERE search MATCH ?)",
+                                 (cid_query(cid),))
+            if now - self._purged > 3600:
+                self._purged = now
+                conn.execute("DELETE FROM search WHERE created < ?", (now - self.ttl,))
+        self.indexed += sum(item[0] == "add" for item in batch)
+
+    def search(self, text, cid=None, limit=20, offset=0):
+        """Best matches first, with highlighted snippets; cid limits the search to one conversation.
+
+        Returns the page of results and whether more follow.
+        """
+        query = match_query(text)
+        if query is None:
+            return [], False
+        if cid is not None:
+            query = f"{cid_query(cid)} AND ({query})"
+        rows = self._conn().execute(
+            f"SELECT cid, message, role, created, bm25(search, 1.0, 0.0), "
+            f"snippet(search, 0, '{_OPEN}', '{_CLOSE}', '…', 16) "
+            "FROM search WHERE search MATCH ? ORDER BY bm25(search, 1.0, 0.0) LIMIT ? OFFSET ?",
+            (query, limit + 1, offset),
+        ).fetchall()
+        results = [{"cid": row[0], "message_id": row[1], "role": row[2], "created": row[3],
+                    "score": -row[4], "snippet": highlight(row[5])} for row in rows[:limit]]
+        return results, len(rows) > limit
+
+    def stats(self):
+        return {"indexed": self.indexed, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+
+def create_search_index():
+    if os.getenv("CHAT_SEARCH", "0") != "1":
+        return None
+    return SearchIndex(
+        os.getenv("CHAT_SEARCH_PATH", "search_index.db"),
+        ttl=int(os.getenv("CHAT_STORE_TTL", 7 * 24 * 3600)),
+        queue_size=int(os.getenv("CHAT_SEARCH_QUEUE_SIZE", 10000)),
+    )
@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from cache import normalize
+
+_WORD = re.compile(r"\w+")
+# Words that frame a request rather than say what it is about ("can you", "any ... for me")
+FILLER = frozenset("""
+    a an the is are am be do does i you me my your it to of for in on at and or can could would will please
+    some any what whats how tell give
+""".split())
+NEGATIONS = frozenset("""
+    not no never nor without dont doesnt didnt isnt arent wasnt werent cant cannot couldnt shouldnt wont wouldnt
+""".split())
+
+
+def tokenize(text):
+    """Normalized words, with a plural "s" dropped so "idea" and "ideas" are one word."""
+    words = _WORD.findall(normalize(text).replace("'", "").replace("\u2019", ""))
+    return [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") and w not in FILLER else w
+            for w in words]
+
+
+def content_words(text):
+    """The words a prompt is about: everything but filler."""
+    return frozenset(w for w in tokenize(text) if w not in FILLER)
+
+
+def features(text):
+    """Weighted hashed features: words, word bigrams, character trigrams and negation.
+
+    Filler words count for little, so "Any advice?" still matches "any
+    advice for me". Bigrams make word order count ("Python better than
+    Java" vs "Java better than Python") and a negation weighs as much as
+    several words, so "quit" vs "not quit" never looks alike.
+    """
+    words = tokenize(text)
+    weight = {word: 0.2 if word in FILLER else 1.0 for word in words}
+    for word in words:
+        yield word, weight[word]
+        if word not in FILLER:
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.2
+        if word in NEGATIONS:
+            yield "\0not", 3.0
+    for a, b in zip(words, words[1:]):
+        yield f"{a} {b}", max(weight[a], weight[b])
+
+
+def embed(texts, dim=256):
+    """Hashed feature vectors (see features()), L2-normalized.
+
+    Cheap, deterministic across processes and dependency-free beyond NumPy;
+    good enough to catch prompts that differ by case, punctuation or filler.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, weight in features(text):
+            h = zlib.crc32(feature.encode())
+            vectors[row, h % dim] += weight if h & 0x80000000 else -weight
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """Fixed-capacity matrix of unit vectors with FIFO replacement once full."""
+
+    def __init__(self, dim=256, maxsize=100000):
+        self.dim = dim
+        self.maxsize = maxsize
+        self._vectors = np.zeros((min(maxsize, 1024), dim), dtype=np.float32)
+        self._values = []
+        self._next = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, vector, value):
+        if len(self._values) < self.maxsize:
+            if len(self._values) == len(self._vectors):
+                grown = np.zeros((min(len(self._vectors) * 2, self.maxsize), self.dim), dtype=np.float32)
+                grown[:len(self._vectors)] = self._vectors
+                self._vectors = grown
+            slot = len(self._values)
+            self._values.append(value)
+        else:
+            slot = self._next
+            self._next = (self._next + 1) % self.maxsize
+            self._values[slot] = value
+        self._vectors[slot] = vector
+
+    def search(self, queries):
+        """Best (score, value) per query row."""
+        if not self._values:
+            return [(0.0, None)] * len(queries)
+        scores = queries @ self._vectors[:len(self._values)].T
+        best = scores.argmax(axis=1)
+        return [(float(scores[i, j]), self._values[j]) for i, j in enumerate(best)]
+
+
+class SemanticCache:
+    """Near-duplicate reply cache for first-turn prompts, keyed by cosine similarity.
+
+    A hit also needs the same content words as the cached prompt: swapping
+    the one word a short prompt is about ("a poem about dogs" vs "cats")
+    changes the answer but barely moves the similarity.
+    """
+
+    def __init__(self, threshold=0.75, dim=256, maxsize=100000):
+        self.threshold = threshold
+        self.dim = dim
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, prompt):
+        return self.get_many(namespace, [prompt])[0]
+
+    def get_many(self, namespace, prompts):
+        queries = embed(prompts, self.dim)
+        about = [content_words(prompt) for prompt in prompts]
+        with self._lock:
+            index = self._indexes.get(namespace)
+            results = index.search(queries) if index is not None else [(0.0, None)] * len(prompts)
+            values = [entry[1] if score >= self.threshold and entry[0] == words else None
+                      for words, (score, entry) in zip(about, results)]
+            hits = sum(value is not None for value in values)
+            self.hits += hits
+            self.misses += len(values) - hits
+        return values
+
+    def set(self, namespace, prompt, value):
+        vector = embed([prompt], self.dim)[0]
+        words = content_words(prompt)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = self._indexes[namespace] = VectorIndex(self.dim, self.maxsize)
+            index.add(vector, (words, value))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": sum(len(index) for index in self._indexes.values()),
+        }
+
+
+def create_semantic_cache():
+    if os.getenv("CHAT_SEMANTIC_CACHE", "0") != "1":
+        return None
+    return SemanticCache(
+        threshold=float(os.getenv("CHAT_SEMANTIC_THRESHOLD", 0.75)),
+        maxsize=int(os.getenv("CHAT_SEMANTIC_CACHE_SIZE", 100000)),
+    )
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+
+from db import open_sqlite
+
+
+class SharedCache:
+    """Size-bounded cache in a SQLite (WAL) file shared by every worker process.
+
+    Entries are grouped by namespace, each with its own size bound and TTL.
+    Reads go through a memory map, so workers share the file's pages instead
+    of each holding a copy, and entries survive worker restarts. Least
+    recently used entries are evicted in batches, and access times are only
+    refreshed once they are a minute stale, so hits rarely take the write lock.
+    get_or_compute() lets one worker compute a missing value while the others
+    wait for it, coordinated through a lease row.
+    """
+
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path, namespace, maxsize=4096, ttl=3600, lease=30.0, mmap_size=256 * 1024 * 1024):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lease = lease
+        self.mmap_size = mmap_size
+        # Trimming walks the LRU index, so it runs once per batch of writes
+        self.trim_every = max(1, maxsize // 16)
+        self.hits = 0
+        self.misses = 0
+        self.computed = 0
+        self.waited = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS shared_cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE INDEX IF NOT EXISTS shared_cache_accessed ON shared_cache (namespace, accessed);
+            CREATE TABLE IF NOT EXISTS shared_cache_leases (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                expires REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID;
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+            # Pages are read through the shared mapping; a small private page cache is enough
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute("PRAGMA cache_size=-512")
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _lookup(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, accessed FROM shared_cache WHERE namespace = ? AND key = ? AND expires > ?",
+            (self.namespace, key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE shared_cache SET accessed = ? WHERE namespace = ? AND key = ?",
+                         (now, self.namespace, key))
+        return row[0]
+
+    def get(self, key):
+        value = self._lookup(key)
+        self._count("misses" if value is None else "hits")
+        return value
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_cache (namespace, key, value, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, value, now + self.ttl, now),
+            )
+        with self._lock:
+            self._writes += 1
+            trim = self._writes % self.trim_every == 0
+        if trim:
+            self.trim()
+
+    def trim(self):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM shared_cache WHERE namespace = ? AND expires <= ?", (self.namespace, now))
+            conn.execute(
+                "DELETE FROM shared_cache WHERE namespace = ?1 AND key IN ("
+                "SELECT key FROM shared_cache WHERE namespace = ?1 ORDER BY accessed DESC LIMIT -1 OFFSET ?2)",
+                (self.namespace, self.maxsize),
+            )
+
+    def _claim(self, key):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # A lease left behind by a crashed worker lapses instead of blocking the key forever
+            conn.execute("DELETE FROM shared_cache_leases WHERE namespace = ? AND key = ? AND expires <= ?",
+                         (self.namespace, key, now))
+            claimed = conn.execute(
+                "INSERT OR IGNORE INTO shared_cache_leases (namespace, key, expires) VALUES (?, ?, ?)",
+                (self.namespace, key, now + self.lease),
+            ).rowcount == 1
+        return claimed
+
+    def _unclaim(self, key):
+        self._conn().execute("DELETE FROM shared_cache_leases WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def get_or_compute(self, key, compute, poll=0.02):
+        """Returns the cached value, computing it in exactly one worker when it is missing."""
+        value = self.get(key)
+        while value is None:
+            if self._claim(key):
+                try:
+                    # Another worker may have finished between our miss and the claim
+                    value = self._lookup(key)
+                    if value is None:
+                        value = compute()
+                        self._count("computed")
+                        self.set(key, value)
+                finally:
+                    self._unclaim(key)
+                return value
+            self._count("waited")
+            time.sleep(poll)
+            value = self._lookup(key)
+        return value
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM shared_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM shared_cache WHERE namespace = ?", (self.namespace,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "computed": self.computed,
+            "waited": self.waited,
+        }
+
+
+def create_shared_cache(namespace, maxsize=None, ttl=None):
+    """The namespace's view of the CHAT_SHARED_CACHE_PATH file, or None when no file is configured."""
+    path = os.getenv("CHAT_SHARED_CACHE_PATH")
+    if not path:
+        return None
+    return SharedCache(
+        path,
+        namespace,
+        maxsize=maxsize or int(os.getenv("CHAT_SHARED_CACHE_SIZE", 16384)),
+        ttl=ttl or int(os.getenv("CHAT_SHARED_CACHE_TTL", 24 * 3600)),
+        mmap_size=int(os.getenv("CHAT_SHARED_CACHE_MMAP", 256 * 1024 * 1024)),
+    )
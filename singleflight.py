@@ -0,0 +1,230 @@
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Chunks of one upstream stream, replayed to every subscriber."""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+
+class _Subscription:
+    """Iterates one subscriber over a broadcast; cancel() wakes it from another thread."""
+
+    def __init__(self, flight, broadcast):
+        self.flight = flight
+        self.broadcast = broadcast
+        self.position = 0
+        self.cancelled = False
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        broadcast = self.broadcast
+        with broadcast.cond:
+            while self.position == len(broadcast.chunks) and not broadcast.finished and not self.cancelled:
+                broadcast.cond.wait()
+            if self.position < len(broadcast.chunks) and not self.cancelled:
+                self.position += 1
+                return broadcast.chunks[self.position - 1]
+        self.close()
+        if broadcast.error is not None and not self.cancelled:
+            raise broadcast.error
+        raise StopIteration
+
+    def cancel(self):
+        with self.broadcast.cond:
+            self.cancelled = True
+            self.broadcast.cond.notify_all()
+
+    def close(self):
+        with self.flight._lock, self.broadcast.cond:
+            if not self.closed:
+                self.closed = True
+                self.broadcast.subscribers -= 1
+
+
+class _AsyncBroadcast:
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.cond = asyncio.Condition()
+        self.task = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical upstream calls into one.
+
+    Callers that arrive while a call for the same key is in flight share its
+    result, or its exception. Streams are fanned out chunk by chunk and late
+    joiners first replay what was already produced. An upstream call is
+    abandoned only once every caller waiting on it has gone away.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._async_calls = {}
+        self._async_streams = {}
+        self.shared = 0
+
+    # Blocking, thread-based callers
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key, fn):
+        with self._lock:
+            broadcast = self._streams.get(key)
+            if broadcast is None:
+                broadcast = self._streams[key] = _Broadcast()
+                threading.Thread(target=self._produce, args=(key, broadcast, fn), daemon=True).start()
+            else:
+                self.shared += 1
+            broadcast.subscribers += 1
+        return _Subscription(self, broadcast)
+
+    def _produce(self, key, broadcast, fn):
+        iterator = fn()
+        try:
+            for chunk in iterator:
+                with self._lock:
+                    # Nobody is listening any more: stop paying for the upstream stream
+                    abandoned = broadcast.subscribers == 0
+                    if abandoned and self._streams.get(key) is broadcast:
+                        del self._streams[key]
+                if abandoned:
+                    break
+                with broadcast.cond:
+                    broadcast.chunks.append(chunk)
+                    broadcast.cond.notify_all()
+        except BaseException as e:
+            broadcast.error = e
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            with broadcast.cond:
+                broadcast.finished = True
+                broadcast.cond.notify_all()
+
+    # Asyncio callers
+
+    async def ado(self, key, fn):
+        entry = self._async_calls.get(key)
+        if entry is None:
+            entry = self._async_calls[key] = [asyncio.ensure_future(fn()), 0]
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+        else:
+            self.shared += 1
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] == 1:
+                # Last interested caller left: stop paying for the upstream call
+                self._forget(key, entry)
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _forget(self, key, entry):
+        if self._async_calls.get(key) is entry:
+            del self._async_calls[key]
+
+    async def astream(self, key, fn):
+        broadcast = self._async_streams.get(key)
+        if broadcast is None:
+            broadcast = self._async_streams[key] = _AsyncBroadcast()
+            broadcast.task = asyncio.ensure_future(self._aproduce(key, broadcast, fn))
+        else:
+            self.shared += 1
+        broadcast.subscribers += 1
+
+        position = 0
+        try:
+            while True:
+                async with broadcast.cond:
+                    await broadcast.cond.wait_for(lambda: position < len(broadcast.chunks) or broadcast.finished)
+                    pending = broadcast.chunks[position:]
+                    finished = broadcast.finished
+                position += len(pending)
+                for chunk in pending:
+                    yield chunk
+                if finished and position == len(broadcast.chunks):
+                    break
+            if broadcast.error is not None:
+                raise broadcast.error
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.finished:
+                if self._async_streams.get(key) is broadcast:
+                    del self._async_streams[key]
+                broadcast.task.cancel()
+
+    async def _aproduce(self, key, broadcast, fn):
+        iterator = fn()
+        try:
+            async for chunk in iterator:
+                async with broadcast.cond:
+                    broadcast.chunks.append(chunk)
+                    broadcast.cond.notify_all()
+        except asyncio.CancelledError:
+            broadcast.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            # Runs the upstream generator's cleanup now rather than whenever it is collected
+            await iterator.aclose()
+            if self._async_streams.get(key) is broadcast:
+                del self._async_streams[key]
+            broadcast.finished = True
+            async with broadcast.cond:
+                broadcast.cond.notify_all()
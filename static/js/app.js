@@ -0,0 +1,437 @@
+// Theme Management
+const themeToggle = document.getElementById('themeToggle');
+const themeIcon = document.getElementById('themeIcon');
+
+// Initialize theme from localStorage or default to dark
+const savedTheme = localStorage.getItem('theme') || 'dark';
+document.documentElement.setAttribute('data-theme', savedTheme);
+updateThemeIcon(savedTheme);
+
+themeToggle.addEventListener('click', () => {
+    const currentTheme = document.documentElement.getAttribute('data-theme');
+    const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
+
+    document.documentElement.setAttribute('data-theme', newTheme);
+    localStorage.setItem('theme', newTheme);
+    updateThemeIcon(newTheme);
+});
+
+function updateThemeIcon(theme) {
+    themeIcon.className = theme === 'dark' ? 'fas fa-moon' : 'fas fa-sun';
+}
+
+// DOM Elements
+const messageInput = document.getElementById('messageInput');
+const sendBtn = document.getElementById('sendBtn');
+const chatHistory = document.getElementById('chatHistory');
+const welcomeSection = document.getElementById('welcomeSection');
+const chatContainer = document.getElementById('chatContainer');
+const suggestionChips = document.querySelectorAll('.suggestion-chip');
+const attachBtn = document.getElementById('attachBtn');
+const upgradeBtn = document.getElementById('upgradeBtn');
+const clearBtn = document.getElementById('clearBtn');
+
+// Chat state
+let isLoading = false;
+let loadingOlder = false;
+let cancelReply = null;
+
+// Persistent channel when the ASGI app serves /ws; HTTP streaming otherwise
+let socket = null;
+let socketFailed = !('WebSocket' in window);
+let socketHandler = null;
+let heartbeat = null;
+let chatStarted = document.body.dataset.chatStarted === 'true';
+
+// Initialize
+document.addEventListener('DOMContentLoaded', function() {
+    messageInput.focus();
+    if (chatStarted) {
+        scrollToBottom();
+    }
+});
+
+// Event Listeners
+messageInput.addEventListener('keypress', function(e) {
+    if (e.key === 'Enter' && !e.shiftKey) {
+        e.preventDefault();
+        sendMessage();
+    }
+});
+
+messageInput.addEventListener('input', function() {
+    const hasContent = this.value.trim().length > 0;
+    sendBtn.classList.toggle('text-blue-400', hasContent);
+    sendBtn.classList.toggle('text-gray-500', !hasContent);
+});
+
+sendBtn.addEventListener('click', () => sendMessage());
+
+// The page only carries the latest messages; older pages load near the top
+chatHistory.addEventListener('scroll', () => {
+    if (chatHistory.scrollTop < 200) {
+        loadOlder();
+    }
+});
+
+suggestionChips.forEach(chip => {
+    chip.addEventListener('click', function() {
+        const suggestion = this.dataset.suggestion;
+        messageInput.value = suggestion;
+        // Suggestion prompts are shared by many users; allow a cached reply
+        sendMessage({ cache: true });
+    });
+});
+
+clearBtn.addEventListener('click', clearChat);
+
+attachBtn.addEventListener('click', function() {
+    showToast('File attachment feature coming soon!', 'info');
+});
+
+upgradeBtn.addEventListener('click', function() {
+    showToast('Upgrade feature coming soon!', 'info');
+});
+
+// Functions
+async function sendMessage(options = {}) {
+    const message = messageInput.value.trim();
+    if (!message || isLoading) return;
+
+    if (!chatStarted) {
+        startChat();
+    }
+
+    // Add user message
+    addMessage(message, 'user');
+    messageInput.value = '';
+
+    // Show loading
+    showLoading();
+    const aiMessage = addMessage('', 'ai');
+    const aiText = aiMessage.querySelector('.message-text');
+    aiText.innerHTML = typingIndicator();
+    let aiResponse = '';
+    let cancelled = false;
+    let generationId = null;
+
+    // Render tokens as they arrive
+    const onEvent = (event, data) => {
+        if (event === 'start') {
+            generationId = data.generation_id;
+        } else if (event === 'token') {
+            aiResponse += data.content;
+            aiText.textContent = aiResponse;
+            scrollToBottom();
+        } else if (event === 'done') {
+            aiResponse = data.ai_response;
+            showRendered(aiText, data.ai_html);
+        } else if (event === 'cancelled') {
+            cancelled = true;
+        } else if (event === 'error') {
+            throw new Error(data.error);
+        }
+    };
+    const payload = { message: message, cache: !!options.cache };
+
+    try {
+        const ws = await getSocket();
+        if (ws) {
+            cancelReply = () => ws.send(JSON.stringify({ type: 'cancel' }));
+            await socketTurn(ws, payload, onEvent);
+        } else {
+            const controller = new AbortController();
+            cancelReply = () => {
+                // Tell the server explicitly too; a proxy may not pass the disconnect on
+                if (generationId) {
+                    fetch('/cancel', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ generation_id: generationId })
+                    });
+                }
+                controller.abort();
+            };
+            const response = await fetch('/chat_stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(payload),
+                signal: controller.signal
+            });
+
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            await readEvents(response, onEvent);
+        }
+        if (cancelled) {
+            aiText.textContent = aiResponse || 'Cancelled.';
+        }
+
+    } catch (error) {
+        if (error.name === 'AbortError') {
+            aiText.textContent = aiResponse || 'Cancelled.';
+            return;
+        }
+        console.error('Error:', error);
+        aiText.classList.add('text-red-300');
+        aiText.textContent = aiResponse || 'Sorry, I encountered an error. Please try again.';
+        showToast('Failed to send message. Please try again.', 'error');
+    } finally {
+        cancelReply = null;
+        hideLoading();
+    }
+}
+
+function openSocket() {
+    return new Promise((resolve, reject) => {
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const ws = new WebSocket(`${protocol}//${location.host}/ws`);
+        ws.onopen = () => resolve(ws);
+        ws.onerror = () => reject(new Error('WebSocket unavailable'));
+        ws.onmessage = event => {
+            if (socketHandler) socketHandler(JSON.parse(event.data));
+        };
+        ws.onclose = () => {
+            if (socket === ws) socket = null;
+            clearInterval(heartbeat);
+            if (socketHandler) socketHandler({ type: 'error', error: 'Connection closed' });
+        };
+    });
+}
+
+async function getSocket() {
+    if (socketFailed) return null;
+    if (socket && socket.readyState === WebSocket.OPEN) return socket;
+    try {
+        socket = await openSocket();
+        clearInterval(heartbeat);
+        heartbeat = setInterval(() => socket && socket.send(JSON.stringify({ type: 'ping' })), 25000);
+        return socket;
+    } catch (error) {
+        // Not served by the ASGI app (or refused); stay on HTTP for this page
+        socketFailed = true;
+        return null;
+    }
+}
+
+function socketTurn(ws, payload, onEvent) {
+    return new Promise((resolve, reject) => {
+        socketHandler = frame => {
+            if (frame.type === 'pong') return;
+            try {
+                onEvent(frame.type, frame);
+            } catch (error) {
+                socketHandler = null;
+                reject(error);
+                return;
+            }
+            if (frame.type === 'done' || frame.type === 'cancelled') {
+                socketHandler = null;
+                resolve();
+            }
+        };
+        ws.send(JSON.stringify({ type: 'chat', ...payload }));
+    });
+}
+
+async function readEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+function showRendered(element, html) {
+    // Server-rendered markdown replaces the plain streamed text
+    element.style.whiteSpace = '';
+    element.classList.add('ai-message');
+    element.innerHTML = html;
+}
+
+function typingIndicator() {
+    return '<div class="typing-indicator"><div class="typing-dot"></div><div class="typing-dot"></div><div class="typing-dot"></div></div>';
+}
+
+async function loadOlder() {
+    const before = chatHistory.dataset.before;
+    if (!before || loadingOlder) return;
+    loadingOlder = true;
+
+    try {
+        const response = await fetch(`/history?before=${encodeURIComponent(before)}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+
+        const height = chatHistory.scrollHeight;
+        const anchor = chatHistory.firstChild;
+        data.messages.forEach(message => {
+            const messageDiv = createMessage(message.content, message.role);
+            if (message.role === 'ai') {
+                showRendered(messageDiv.querySelector('.message-text'), message.html);
+            }
+            chatHistory.insertBefore(messageDiv, anchor);
+        });
+        // Keep the message the user was reading in place
+        chatHistory.scrollBy({ top: chatHistory.scrollHeight - height, behavior: 'instant' });
+
+        if (data.before === null) {
+            delete chatHistory.dataset.before;
+        } else {
+            chatHistory.dataset.before = data.before;
+        }
+    } catch (error) {
+        console.error('Error loading history:', error);
+    } finally {
+        loadingOlder = false;
+    }
+}
+
+function startChat() {
+    chatStarted = true;
+    welcomeSection.classList.add('hidden');
+    chatContainer.classList.remove('hidden');
+}
+
+function addMessage(content, role, isError = false) {
+    const messageDiv = createMessage(content, role, isError);
+    chatHistory.appendChild(messageDiv);
+    scrollToBottom();
+    return messageDiv;
+}
+
+function createMessage(content, role, isError = false) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `fade-in ${role === 'user' ? 'ml-12' : 'mr-12'}`;
+
+    const bubbleClass = role === 'user' ? 'chat-bubble-user ml-auto' : 'chat-bubble-ai';
+    const textColor = isError ? 'text-red-300' : 'text-white';
+
+    let messageContent = content;
+    if (role === 'ai' && !isError) {
+        // For AI messages, we'll handle markdown on the server side
+        messageContent = escapeHtml(content);
+    } else {
+        messageContent = escapeHtml(content);
+    }
+
+    messageDiv.innerHTML = `
+        <div class="${bubbleClass} max-w-2xl rounded-2xl p-4">
+            <div class="flex items-start space-x-3">
+                ${role === 'ai' ? `
+                        <div class="w-8 h-8 rounded-lg bg-white bg-opacity-10 flex items-center justify-center flex-shrink-0 mt-1">
+                            <img src="https://cdn-ai.onspace.ai/onspace/project/image/dJhJe8NZY5jRCbtAbBVTbf/bot.png" alt="Smart Chat AI" class="w-5 h-5 object-contain">
+                        </div>
+                ` : ''}
+                <div class="flex-1">
+                    <div class="message-text ${textColor} text-base leading-relaxed" style="white-space: pre-wrap;">${messageContent}</div>
+                </div>
+            </div>
+        </div>
+    `;
+
+    return messageDiv;
+}
+
+function showLoading() {
+    isLoading = true;
+    sendBtn.disabled = true;
+}
+
+function hideLoading() {
+    isLoading = false;
+    sendBtn.disabled = false;
+    messageInput.focus();
+}
+
+function scrollToBottom() {
+    setTimeout(() => {
+        chatHistory.scrollTop = chatHistory.scrollHeight;
+    }, 100);
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+function showToast(message, type = 'info') {
+    const toast = document.createElement('div');
+    const bgColor = type === 'error' ? 'bg-red-500' : type === 'success' ? 'bg-green-500' : 'bg-blue-500';
+
+    toast.className = `fixed top-24 right-6 ${bgColor} text-white px-6 py-3 rounded-lg shadow-lg z-50 transform translate-x-full transition-transform duration-300`;
+    toast.textContent = message;
+
+    document.body.appendChild(toast);
+
+    setTimeout(() => {
+        toast.classList.remove('translate-x-full');
+    }, 100);
+
+    setTimeout(() => {
+        toast.classList.add('translate-x-full');
+        setTimeout(() => {
+            if (document.body.contains(toast)) {
+                document.body.removeChild(toast);
+            }
+        }, 300);
+    }, 3000);
+}
+
+async function clearChat() {
+    if (!confirm('Are you sure you want to clear the chat history?')) {
+        return;
+    }
+
+    try {
+        const response = await fetch('/clear');
+        if (response.ok) {
+            // Reload the page to show welcome section
+            window.location.reload();
+        } else {
+            throw new Error('Failed to clear chat');
+        }
+    } catch (error) {
+        console.error('Error clearing chat:', error);
+        showToast('Failed to clear chat history', 'error');
+    }
+}
+
+// Keyboard shortcuts
+document.addEventListener('keydown', function(e) {
+    if ((e.ctrlKey || e.metaKey) && e.key === 'k') {
+        e.preventDefault();
+        messageInput.focus();
+    }
+
+    if (e.key === 'Escape') {
+        if (cancelReply) cancelReply();
+        messageInput.value = '';
+        messageInput.focus();
+    }
+});
@@ -0,0 +1,456 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from codec import BodyCodec, pack_body, train_dictionary, unpack_body
+from conversation import Conversation, Message
+from db import open_sqlite
+from lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """In-process conversation store: LRU over conversations with TTL eviction.
+
+    load() hands out the live Conversation, so a turn never copies the history.
+    """
+
+    def __init__(self, max_conversations=10000, ttl=7 * 24 * 3600):
+        self._conversations = LRUCache(max_conversations, ttl)
+        self._summaries = LRUCache(max_conversations, ttl)
+        self._lock = threading.Lock()
+
+    def load(self, cid):
+        conversation = self._conversations.get(cid)
+        return Conversation() if conversation is None else conversation
+
+    def _update(self, cid, change):
+        with self._lock:
+            conversation = self._conversations.get(cid)
+            if conversation is None:
+                conversation = Conversation()
+            change(conversation)
+            self._conversations.set(cid, conversation)
+        return conversation
+
+    def append(self, cid, *messages):
+        return self._update(cid, lambda conversation: conversation.append(*messages))
+
+    def fork(self, cid, parent_id, message):
+        return self._update(cid, lambda conversation: conversation.fork(parent_id, message))
+
+    def switch(self, cid, node_id):
+        return self._update(cid, lambda conversation: conversation.switch(node_id))
+
+    def replace(self, cid, history):
+        conversation = Conversation(history)
+        self._conversations.set(cid, conversation)
+        return conversation
+
+    def page(self, cid, before=None, limit=50):
+        return self.load(cid).page(before, limit)
+
+    def delete(self, cid):
+        self._conversations.pop(cid)
+        self._summaries.pop(cid)
+
+    def get_summary(self, cid):
+        return self._summaries.get(cid)
+
+    def set_summary(self, cid, summary):
+        self._summaries.set(cid, summary)
+
+
+class SQLiteStore:
+    """SQLite (WAL) conversation store, one row per message, shareable across workers.
+
+    Rows form the conversation tree through their parent seq and are only
+    ever inserted; the active branch is the conversation's head. Recently
+    used conversations are also kept in process as live Conversation
+    objects: a load only reads the rows other workers added since, and a
+    replace or delete anywhere changes the conversation's generation and
+    forces a full reload.
+
+    Message bodies (content and html) are stored compressed, once per
+    distinct body, under their hash; messages only reference them, so edits,
+    branches and repeated replies share storage across conversations.
+    Loaded messages fetch their body on first read, through a small cache.
+    Conversations untouched for the TTL are purged, at most once per
+    PURGE_INTERVAL per worker, after a write.
+    """
+
+    # Bodies read with a load: enough for a typical context window
+    PREFETCH = 32
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, path, ttl=7 * 24 * 3600, cache_size=1000, body_cache_size=1024):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._cache = LRUCache(cache_size, ttl)
+        self._bodies = LRUCache(body_cache_size)
+        self._codec = BodyCodec()
+        self._lock = threading.Lock()
+        self._purged = 0.0
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                cid TEXT PRIMARY KEY,
+                updated REAL NOT NULL,
+                generation INTEGER NOT NULL,
+                head INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                cid TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                parent INTEGER,
+                role TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                PRIMARY KEY (cid, seq)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS bodies (
+                hash BLOB PRIMARY KEY,
+                codec INTEGER NOT NULL,
+                dictionary INTEGER,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dictionaries (
+                id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS summaries (
+                cid TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                upto INTEGER NOT NULL,
+                node INTEGER NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated);
+            CREATE INDEX IF NOT EXISTS messages_body ON messages (body);
+        """)
+        for dict_id, data in conn.execute("SELECT id, data FROM dictionaries ORDER BY id"):
+            self._codec.add_dictionary(dict_id, data)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+        return conn
+
+    def _pack(self, messages):
+        """Row fields for the messages, and their bodies keyed by hash.
+
+        Bodies the file doesn't have yet are compressed here, before the
+        write lock is taken.
+        """
+        rows, bodies = [], {}
+        conn = self._conn()
+        for message in messages:
+            body = pack_body(message.content, message.html)
+            digest = hashlib.blake2b(body, digest_size=16).digest()
+            rows.append((message.role, message.tokens, digest))
+            if digest not in bodies:
+                known = conn.execute("SELECT 1 FROM bodies WHERE hash = ?", (digest,)).fetchone()
+                bodies[digest] = body, None if known else self._codec.compress(body)
+        return rows, bodies
+
+    def _insert(self, conn, rows, bodies):
+        for digest, (body, compressed) in bodies.items():
+            if compressed is None:
+                # Present before the transaction, but a delete may have collected it since
+                if conn.execute("SELECT 1 FROM bodies WHERE hash = ?", (digest,)).fetchone():
+                    continue
+                compressed = self._codec.compress(body)
+            conn.execute("INSERT OR IGNORE INTO bodies (hash, codec, dictionary, data) VALUES (?, ?, ?, ?)",
+                         (digest, *compressed))
+        conn.executemany(
+            "INSERT INTO messages (cid, seq, parent, role, tokens, body) VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    @staticmethod
+    def _collect(conn, cid):
+        # Drops the conversation's messages, then the bodies no other message references
+        digests = conn.execute("SELECT DISTINCT body FROM messages WHERE cid = ?", (cid,)).fetchall()
+        conn.execute("DELETE FROM messages WHERE cid = ?", (cid,))
+        conn.executemany("DELETE FROM bodies WHERE hash = ?1 AND NOT EXISTS "
+                         "(SELECT 1 FROM messages WHERE body = ?1)", digests)
+
+    def _decompress(self, conn, codec, dict_id, data):
+        if dict_id is not None and dict_id not in self._codec:
+            # Trained by another worker since this one started
+            (dictionary,) = conn.execute("SELECT data FROM dictionaries WHERE id = ?", (dict_id,)).fetchone()
+            self._codec.add_dictionary(dict_id, dictionary, use=False)
+        return self._codec.decompress(codec, dict_id, data)
+
+    def _read_body(self, digest):
+        conn = self._conn()
+        row = conn.execute("SELECT codec, dictionary, data FROM bodies WHERE hash = ?", (digest,)).fetchone()
+        return None if row is None else self._decompress(conn, *row)
+
+    def _prefetch(self, conn, digests):
+        # Messages about to be read: fetch their bodies in one query instead of one at a time
+        digests = [d for d in dict.fromkeys(digests) if d not in self._bodies]
+        if not digests:
+            return
+        rows = conn.execute(
+            f"SELECT hash, codec, dictionary, data FROM bodies WHERE hash IN ({', '.join('?' * len(digests))})", digests
+        ).fetchall()
+        for digest, *row in rows:
+            self._bodies.set(digest, unpack_body(self._decompress(conn, *row)))
+
+    def _body(self, digest):
+        body = self._bodies.get(digest)
+        if body is None:
+            data = self._read_body(digest)
+            if data is None:
+                # Collected after the message was loaded: its conversation has been deleted
+                return "", None
+            body = unpack_body(data)
+            self._bodies.set(digest, body)
+        return body
+
+    def _message(self, role, tokens, body):
+        return Message.deferred(role, tokens, lambda: self._body(body))
+
+    def train_dictionary(self, samples=2000, size=64 * 1024, if_missing=False):
+        """Trains a zstd dictionary on the newest bodies and compresses new bodies with it.
+
+        Returns the dictionary id, or None when zstandard is missing or there
+        are too few bodies yet. With ``if_missing``, a dictionary another
+        worker already stored is used instead of adding a second one. Other
+        workers pick a new dictionary up when they restart; until then they
+        can still read bodies written with it.
+        """
+        conn = self._conn()
+        digests = conn.execute("SELECT hash FROM bodies ORDER BY rowid DESC LIMIT ?", (samples,)).fetchall()
+        # Bodies collected since the hashes were read are skipped
+        bodies = [body for body in (self._read_body(digest) for (digest,) in digests) if body is not None]
+        dictionary = train_dictionary(bodies, size)
+        if dictionary is None:
+            return None
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id, data FROM dictionaries ORDER BY id DESC LIMIT 1").fetchone()
+            if if_missing and row is not None:
+                dict_id, dictionary = row
+            else:
+                dict_id = conn.execute("INSERT INTO dictionaries (data) VALUES (?)", (dictionary,)).lastrowid
+        self._codec.add_dictionary(dict_id, dictionary)
+        return dict_id
+
+    def load(self, cid):
+        cached = self._cache.get(cid)
+        start = len(cached.nodes) if cached is not None else 0
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            row = conn.execute("SELECT generation, head FROM conversations WHERE cid = ?", (cid,)).fetchone()
+            if row is None:
+                self._cache.pop(cid)
+                return Conversation()
+            generation, head = row
+            if cached is None or cached.generation != generation:
+                cached, start = None, 0
+            rows = conn.execute(
+                "SELECT seq, parent, role, tokens, body FROM messages WHERE cid = ? AND seq >= ? ORDER BY seq",
+                (cid, start),
+            ).fetchall()
+            self._prefetch(conn, self._tail(rows, head))
+
+        with self._lock:
+            if cached is None:
+                cached = Conversation(generation=generation)
+            if len(cached.nodes) == start:
+                for seq, parent, *fields in rows:
+                    cached.add(self._message(*fields), None if parent is None else cached.nodes[parent])
+                cached.switch(head)
+                self._cache.set(cid, cached)
+                return cached
+        # Raced with another thread syncing or adding: rebuild from the rows
+        return self._reload(cid)
+
+    def _tail(self, rows, head):
+        """Body hashes of the newest messages on the branch ending at head, among the rows read."""
+        branch = {seq: (parent, body) for seq, parent, *_, body in rows}
+        digests = []
+        while head in branch and len(digests) < self.PREFETCH:
+            head, body = branch[head]
+            digests.append(body)
+        return digests
+
+    def page(self, cid, before=None, limit=50):
+        if self._cache.get(cid) is not None:
+            # Already in memory: syncing the tail is cheaper than walking rows
+            return self.load(cid).page(before, limit)
+        # Otherwise walk the branch up the (cid, seq) key, reading only the page
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            if before is None:
+                row = conn.execute("SELECT head FROM conversations WHERE cid = ?", (cid,)).fetchone()
+            else:
+                row = conn.execute("SELECT parent FROM messages WHERE cid = ? AND seq = ?", (cid, before)).fetchone()
+            if row is None or row[0] is None:
+                return [], False
+            rows = conn.execute("""
+                WITH RECURSIVE branch (seq, parent, role, tokens, body, n) AS (
+                    SELECT seq, parent, role, tokens, body, 1 FROM messages WHERE cid = ?1 AND seq = ?2
+                    UNION ALL
+                    SELECT m.seq, m.parent, m.role, m.tokens, m.body, b.n + 1 FROM branch b
+                    JOIN messages m ON m.cid = ?1 AND m.seq = b.parent
+                    WHERE b.n < ?3
+                )
+                SELECT seq, parent, role, tokens, body FROM branch ORDER BY n DESC
+            """, (cid, row[0], limit)).fetchall()
+            self._prefetch(conn, [r[-1] for r in rows])
+        messages = []
+        for seq, parent, *fields in rows:
+            message = self._message(*fields)
+            message.id = seq
+            messages.append(message)
+        return messages, bool(rows) and rows[0][1] is not None
+
+    def _reload(self, cid):
+        self._cache.pop(cid)
+        return self.load(cid)
+
+    def _add(self, cid, messages, parent=None, at_head=True):
+        messages = [Message.coerce(m) for m in messages]
+        fields, bodies = self._pack(messages)
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            (seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE cid = ?", (cid,)
+            ).fetchone()
+            if at_head:
+                row = conn.execute("SELECT head FROM conversations WHERE cid = ?", (cid,)).fetchone()
+                parent = row[0] if row else None
+            rows, head = [], parent
+            for i, row in enumerate(fields):
+                rows.append((cid, seq + i, head, *row))
+                head = seq + i
+            self._insert(conn, rows, bodies)
+            generation = self._touch(conn, cid, head, new_generation=seq == 0)
+        self._purge_due()
+
+        with self._lock:
+            cached = self._cache.get(cid)
+            if cached is not None and cached.generation == generation and len(cached.nodes) == seq:
+                cached.fork(parent, messages[0])
+                return cached.append(*messages[1:])
+        return self._reload(cid)
+
+    def append(self, cid, *messages):
+        return self._add(cid, messages)
+
+    def fork(self, cid, parent_id, message):
+        return self._add(cid, [message], parent_id, at_head=False)
+
+    def switch(self, cid, node_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            generation = self._touch(conn, cid, node_id)
+        with self._lock:
+            cached = self._cache.get(cid)
+            if cached is not None and cached.generation == generation and (node_id or 0) < len(cached.nodes):
+                return cached.switch(node_id)
+        return self._reload(cid)
+
+    def replace(self, cid, history):
+        conversation = Conversation(history)
+        fields, bodies = self._pack(conversation)
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._collect(conn, cid)
+            self._insert(conn, [(cid, i, i - 1 if i else None, *row) for i, row in enumerate(fields)], bodies)
+            head = len(conversation) - 1 if len(conversation) else None
+            conversation.generation = self._touch(conn, cid, head, new_generation=True)
+        self._cache.set(cid, conversation)
+        return conversation
+
+    def delete(self, cid):
+        self._cache.pop(cid)
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._collect(conn, cid)
+            conn.execute("DELETE FROM summaries WHERE cid = ?", (cid,))
+            conn.execute("DELETE FROM conversations WHERE cid = ?", (cid,))
+
+    def get_summary(self, cid):
+        row = self._conn().execute(
+            "SELECT text, upto, node, tokens FROM summaries WHERE cid = ?", (cid,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"text": row[0], "upto": row[1], "node": row[2], "tokens": row[3]}
+
+    def set_summary(self, cid, summary):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO summaries (cid, text, upto, node, tokens) VALUES (?, ?, ?, ?, ?)",
+            (cid, summary["text"], summary["upto"], summary["node"], summary["tokens"]),
+        )
+
+    def _purge_due(self):
+        now = time.time()
+        if now - self._purged < self.PURGE_INTERVAL:
+            return
+        self._purged = now
+        try:
+            self.purge_expired()
+        except sqlite3.Error:
+            # The message is already stored; the next interval tries again
+            logger.exception("Purging expired conversations failed")
+
+    def purge_expired(self, batch_size=100):
+        """Deletes conversations untouched for the TTL, a batch per transaction so writers aren't held up."""
+        cutoff = time.time() - self.ttl
+        conn = self._conn()
+        while True:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                cids = conn.execute("SELECT cid FROM conversations WHERE updated < ? LIMIT ?",
+                                    (cutoff, batch_size)).fetchall()
+                for (cid,) in cids:
+                    self._collect(conn, cid)
+                conn.executemany("DELETE FROM summaries WHERE cid = ?", cids)
+                conn.executemany("DELETE FROM conversations WHERE cid = ?", cids)
+            if len(cids) < batch_size:
+                return
+
+    def _touch(self, conn, cid, head, new_generation=False):
+        # Generations are unique stamps rather than counters, so a conversation
+        # deleted and recreated elsewhere can't match a stale cached copy
+        generation = time.time_ns() if new_generation else None
+        (generation,) = conn.execute(
+            "INSERT INTO conversations (cid, updated, generation, head) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(cid) DO UPDATE SET updated = excluded.updated, head = excluded.head, "
+            "generation = COALESCE(?, generation) RETURNING generation",
+            (cid, time.time(), generation or time.time_ns(), head, generation),
+        ).fetchone()
+        return generation
+
+
+def create_store():
+    backend = os.getenv("CHAT_STORE", "memory")
+    ttl = int(os.getenv("CHAT_STORE_TTL", 7 * 24 * 3600))
+    if backend == "sqlite":
+        store = SQLiteStore(os.getenv("CHAT_STORE_PATH", "chat_history.db"), ttl=ttl,
+                            cache_size=int(os.getenv("CHAT_STORE_CACHE_SIZE", 1000)),
+                            body_cache_size=int(os.getenv("CHAT_STORE_BODY_CACHE_SIZE", 1024)))
+        # Train a compression dictionary on existing traffic the first time it's asked for;
+        # workers starting together end up sharing whichever one is stored first
+        if os.getenv("CHAT_STORE_DICTIONARY") == "1" and store._codec.dictionary is None:
+            store.train_dictionary(if_missing=True)
+        return store
+    if backend == "memory":
+        return MemoryStore(int(os.getenv("CHAT_STORE_SIZE", 10000)), ttl=ttl)
+    raise ValueError(f"Unknown CHAT_STORE backend: {backend}")
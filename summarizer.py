@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import Overloaded
+from context import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a user and an AI assistant.
+Extend the current summary with the new lines and return only the new summary.
+Keep names, facts, decisions and open questions; stay under {max_words} words.
+
+Current summary:
+{summary}
+
+New lines:
+{lines}
+
+New summary:"""
+
+
+class Summarizer:
+    """Folds turns that fell out of the context window into a running summary.
+
+    Summaries are refreshed incrementally (previous summary + newly dropped
+    turns) on a background pool, so a request never waits on them. Each
+    refresh takes an admission ticket like a reply does, but queues for at
+    most a second: when the budget is spent it is skipped, and the next turn
+    that drops messages tries again.
+    """
+
+    def __init__(self, store, admission=None, recent_tokens=2048, max_words=200, workers=2):
+        self.store = store
+        self.admission = admission
+        self.recent_tokens = recent_tokens
+        self.max_words = max_words
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarizer")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def current(self, cid, history):
+        summary = self.store.get_summary(cid)
+        # A summary covers one branch up to its node; after an edit or a branch
+        # switch it only applies while that node is on the active branch again
+        if summary is None or not history.on_branch(summary["node"]):
+            return None
+        return summary
+
+    def budget(self, window_budget, summary):
+        summary_tokens = summary["tokens"] if summary else 0
+        return min(window_budget - summary_tokens, self.recent_tokens)
+
+    def refresh(self, cid, upto, llm):
+        with self._lock:
+            if cid in self._pending:
+                return
+            self._pending.add(cid)
+        self._executor.submit(self._refresh, cid, upto, llm)
+
+    def _refresh(self, cid, upto, llm):
+        try:
+            history = self.store.load(cid)
+            summary = self.current(cid, history)
+            start = summary["upto"] if summary else 0
+            upto = min(upto, len(history))
+            if upto <= start:
+                return
+
+            covered = history[start:upto]
+            lines = "\n".join(f"{m.role.upper()}: {m.content}" for m in covered)
+            prompt = SUMMARY_PROMPT.format(
+                max_words=self.max_words,
+                summary=summary["text"] if summary else "(none)",
+                lines=lines,
+            )
+            from langchain_core.messages import HumanMessage
+            ticket = None
+            if self.admission is not None:
+                # Roughly two tokens per word leaves room for the summary
+                ticket = self.admission.acquire(count_tokens(prompt), self.max_words * 2,
+                                                deadline=time.monotonic() + 1.0)
+            try:
+                response = llm.invoke([HumanMessage(content=prompt)])
+                text = response.content.strip()
+                if ticket is not None:
+                    usage = getattr(response, "usage_metadata", None)
+                    ticket.settle(usage["total_tokens"] if usage else ticket.prompt_tokens + count_tokens(text))
+            finally:
+                if ticket is not None:
+                    self.admission.release(ticket)
+            # The conversation may have been edited or switched to another branch meanwhile
+            node = covered[-1].id
+            if self.store.load(cid).on_branch(node):
+                self.store.set_summary(cid, {"text": text, "upto": upto, "node": node, "tokens": count_tokens(text)})
+        except Overloaded:
+            logger.debug("Summary refresh for conversation %s skipped: over the upstream budget", cid)
+        except Exception:
+            # The turns stay out of the prompt until the next refresh succeeds
+            logger.exception("Summary refresh failed for conversation %s", cid)
+        finally:
+            with self._lock:
+                self._pending.discard(cid)
+
+    @staticmethod
+    def message(summary):
+        from langchain_core.messages import SystemMessage
+        return SystemMessage(content=f"Summary of the earlier conversation:\n{summary['text']}")
+
+
+def create_summarizer(store, admission=None):
+    if os.getenv("CHAT_SUMMARIZE", "0") != "1":
+        return None
+    return Summarizer(
+        store,
+        admission,
+        recent_tokens=int(os.getenv("CHAT_SUMMARY_RECENT_TOKENS", 2048)),
+        max_words=int(os.getenv("CHAT_SUMMARY_MAX_WORDS", 200)),
+    )
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ["CHAT_FAKE_LLM"] = "1"
+os.environ["FAKE_LLM_TTFT"] = "0.3"
+
+import app as chat_app
+import asgi
+from admission import AdmissionController
+
+
+def burst(path, n=20):
+    barrier = threading.Barrier(n)
+    statuses = []
+
+    def post():
+        client = chat_app.app.test_client()
+        barrier.wait()
+        response = client.post(path, json={"message": "Any advice for me?"})
+        response.get_data()
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+async def asgi_post(path, body):
+    sent = []
+    requests = [{"type": "http.request", "body": json.dumps(body).encode()}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application({"type": "http", "method": "POST", "path": path, "headers": []}, receive, send)
+    return sent[0]["status"]
+
+
+async def asgi_burst(path, n=20):
+    return list(await asyncio.gather(*[asgi_post(path, {"message": "Any advice for me?"}) for _ in range(n)]))
+
+
+@pytest.mark.parametrize("path", ["/chat_api", "/chat_stream"])
+@pytest.mark.parametrize("mode", ["wsgi", "asgi"])
+def test_identical_burst_takes_one_ticket(monkeypatch, mode, path):
+    admission = AdmissionController(rpm=5, tpm=100000, max_wait=0.5)
+    monkeypatch.setattr(chat_app, "admission", admission)
+    shared = chat_app.singleflight.shared
+    statuses = burst(path) if mode == "wsgi" else asyncio.run(asgi_burst(path))
+    assert statuses == [200] * 20
+    assert admission.admitted == 1
+    assert admission.rejected == 0
+    assert chat_app.singleflight.shared - shared == 19
@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from conversation import Conversation, Message
+
+
+def contents(conversation):
+    return [m.content for m in conversation]
+
+
+def chat():
+    return Conversation([Message("user", "hi"), Message("ai", "hello"), Message("user", "cats?"), Message("ai", "meow")])
+
+
+def test_edit_forks_a_sibling_and_keeps_the_old_branch():
+    conversation = chat()
+    edited = conversation.last("user")
+    conversation.fork(edited.parent.id, Message("user", "dogs?"))
+    assert contents(conversation) == ["hi", "hello", "dogs?"]
+    assert len(conversation.nodes) == 5
+    assert conversation.forks() == [{"id": 4, "siblings": [2, 4], "index": 1}]
+    assert not conversation.on_branch(3)
+    assert conversation.on_branch(1)
+
+
+def test_switch_resumes_the_newest_leaf_of_a_branch():
+    conversation = chat()
+    conversation.fork(1, Message("user", "dogs?")).append(Message("ai", "woof"))
+    conversation.switch(conversation.leaf(2).id)
+    assert contents(conversation) == ["hi", "hello", "cats?", "meow"]
+    assert conversation.forks()[0]["index"] == 0
+    conversation.switch(conversation.leaf(4).id)
+    assert contents(conversation) == ["hi", "hello", "dogs?", "woof"]
+
+
+def test_edit_after_switch_forks_the_active_branch():
+    conversation = chat()
+    conversation.fork(1, Message("user", "dogs?")).append(Message("ai", "woof"))
+    conversation.switch(conversation.leaf(2).id)
+    conversation.append(Message("user", "more cats"))
+    edited = conversation.last("user")
+    conversation.fork(edited.parent.id, Message("user", "fewer cats"))
+    assert contents(conversation) == ["hi", "hello", "cats?", "meow", "fewer cats"]
+    assert conversation.siblings(conversation.head) == [6, 7]
+    assert [f["id"] for f in conversation.forks()] == [2, 7]
+    # The branches edited earlier are all still there
+    assert contents(conversation.switch(5)) == ["hi", "hello", "dogs?", "woof"]
+    assert contents(conversation.switch(6)) == ["hi", "hello", "cats?", "meow", "more cats"]
+
+
+def test_page_walks_the_active_branch():
+    conversation = chat()
+    conversation.fork(1, Message("user", "dogs?")).append(Message("ai", "woof"))
+    messages, more = conversation.page(limit=2)
+    assert [m.content for m in messages] == ["dogs?", "woof"] and more
+    messages, more = conversation.page(before=messages[0].id, limit=2)
+    assert [m.content for m in messages] == ["hi", "hello"] and not more
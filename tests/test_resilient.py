@@ -0,0 +1,199 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from admission import AdmissionController
+from fakellm import FakeChatModel, FakeUpstreamError
+from resilient import CircuitBreaker, ResilientLLM
+
+MESSAGES = []
+
+
+class Flaky(FakeChatModel):
+    """Fails its first ``failures`` calls, then answers."""
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(latency=0, **kwargs)
+        self.remaining = failures
+
+    def _call(self, messages):
+        ttft, _, reply = super()._call(messages)
+        failed = self.remaining > 0
+        self.remaining -= failed
+        return ttft, failed, reply
+
+
+class SlowOnce(FakeChatModel):
+    """Call number ``slow`` waits ``tail_latency`` for its first token; the others ``latency``."""
+
+    def __init__(self, slow, **kwargs):
+        super().__init__(**kwargs)
+        self.slow = slow
+
+    def _call(self, messages):
+        ttft, failed, reply = super()._call(messages)
+        return self.tail_latency if self.calls == self.slow else ttft, failed, reply
+
+
+def test_retries_until_success():
+    primary = Flaky(2)
+    llm = ResilientLLM(primary, retries=2, backoff_base=0.001)
+    assert llm.invoke(MESSAGES).content == primary.reply
+    assert primary.calls == 3
+    assert llm.counts["retries"] == 2
+
+
+def test_gives_up_after_retries():
+    primary = Flaky(5)
+    llm = ResilientLLM(primary, retries=2, backoff_base=0.001)
+    with pytest.raises(FakeUpstreamError):
+        llm.invoke(MESSAGES)
+    assert primary.calls == 3
+    assert llm.counts["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    primary = Flaky(1, failure_status=400)
+    llm = ResilientLLM(primary, retries=2, backoff_base=0.001)
+    with pytest.raises(FakeUpstreamError):
+        llm.invoke(MESSAGES)
+    assert primary.calls == 1
+    assert llm.breaker.failures == 0
+
+
+def test_retry_after_is_honoured():
+    primary = Flaky(1, failure_status=429, retry_after=0.2)
+    llm = ResilientLLM(primary, retries=1, backoff_base=0.001)
+    start = time.monotonic()
+    llm.invoke(MESSAGES)
+    assert time.monotonic() - start >= 0.2
+    assert primary.calls == 2
+
+
+def test_long_retry_after_is_not_retried():
+    primary = Flaky(1, failure_status=429, retry_after=60)
+    llm = ResilientLLM(primary, retries=2, backoff_base=0.001, backoff_max=1.0)
+    with pytest.raises(FakeUpstreamError):
+        llm.invoke(MESSAGES)
+    assert primary.calls == 1
+
+
+def test_rate_limits_do_not_open_the_breaker():
+    primary = Flaky(10, failure_status=429)
+    llm = ResilientLLM(primary, retries=0, breaker=CircuitBreaker(failure_threshold=2))
+    for _ in range(5):
+        with pytest.raises(FakeUpstreamError):
+            llm.invoke(MESSAGES)
+    assert llm.breaker.state == "closed"
+    assert primary.calls == 5
+
+
+def test_breaker_opens_and_falls_back():
+    primary = FakeChatModel(latency=0, failure_rate=1.0)
+    fallback = FakeChatModel(latency=0, reply="fallback reply")
+    llm = ResilientLLM(primary, fallback=fallback, retries=0,
+                       breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    replies = [llm.invoke(MESSAGES).content for _ in range(10)]
+    assert replies == ["fallback reply"] * 10
+    assert llm.breaker.state == "open"
+    # Once open, calls skip the primary entirely
+    assert primary.calls == 3
+    assert fallback.calls == 10
+    assert llm.counts["fallbacks"] == 10
+
+
+def test_half_open_probe_closes_the_breaker():
+    primary = Flaky(3)
+    fallback = FakeChatModel(latency=0, reply="fallback reply")
+    llm = ResilientLLM(primary, fallback=fallback, retries=0,
+                       breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.05))
+    for _ in range(3):
+        llm.invoke(MESSAGES)
+    assert llm.breaker.state == "open"
+    time.sleep(0.06)
+    assert llm.breaker.state == "half_open"
+    assert llm.invoke(MESSAGES).content == primary.reply
+    assert llm.breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_breaker():
+    primary = Flaky(4)
+    fallback = FakeChatModel(latency=0, reply="fallback reply")
+    llm = ResilientLLM(primary, fallback=fallback, retries=0,
+                       breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.05))
+    for _ in range(3):
+        llm.invoke(MESSAGES)
+    time.sleep(0.06)
+    assert llm.invoke(MESSAGES).content == "fallback reply"
+    assert primary.calls == 4
+    assert llm.breaker.state == "open"
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_ignored()
+    assert breaker.allow()
+
+
+def test_hedge_wins_over_a_slow_call():
+    primary = SlowOnce(6, latency=0.01, tail_latency=1.0)
+    llm = ResilientLLM(primary, hedge=True, hedge_min_delay=0.05, hedge_min_samples=5)
+    for _ in range(5):
+        llm.invoke(MESSAGES)
+    assert llm.counts["hedges"] == 0
+    start = time.monotonic()
+    assert llm.invoke(MESSAGES).content == primary.reply
+    assert time.monotonic() - start < 0.5
+    assert primary.calls == 7
+    assert llm.counts["hedges"] == 1
+    assert llm.counts["hedge_wins"] == 1
+
+
+def test_no_hedge_without_budget():
+    admission = AdmissionController(rpm=1, tpm=100000)
+    admission.acquire(0, 0)
+    primary = SlowOnce(6, latency=0.01, tail_latency=0.2)
+    llm = ResilientLLM(primary, hedge=True, hedge_min_delay=0.05, hedge_min_samples=5, admission=admission)
+    for _ in range(6):
+        llm.invoke(MESSAGES)
+    assert primary.calls == 6
+    assert llm.counts["hedges"] == 0
+    assert llm.counts["over_budget"] == 1
+
+
+def test_retries_take_admission_tickets():
+    admission = AdmissionController(rpm=2, tpm=100000)
+    admission.acquire(0, 0)
+    primary = Flaky(5)
+    llm = ResilientLLM(primary, retries=3, backoff_base=0.001, admission=admission, reply_tokens=10)
+    with pytest.raises(FakeUpstreamError):
+        llm.invoke(MESSAGES)
+    # One retry fits in the budget; the next one is refused instead of queued
+    assert primary.calls == 2
+    assert llm.counts["retries"] == 1
+    assert llm.counts["over_budget"] == 1
+
+
+def test_async_retries_and_fallback():
+    primary = Flaky(1)
+    llm = ResilientLLM(primary, retries=1, backoff_base=0.001)
+    assert asyncio.run(llm.ainvoke(MESSAGES)).content == primary.reply
+    assert llm.counts["retries"] == 1
+
+    down = FakeChatModel(latency=0, failure_rate=1.0)
+    fallback = FakeChatModel(latency=0, reply="fallback reply")
+    llm = ResilientLLM(down, fallback=fallback, retries=0, breaker=CircuitBreaker(failure_threshold=1))
+
+    async def stream():
+        return "".join([chunk.content async for chunk in llm.astream(MESSAGES)])
+    assert asyncio.run(stream()) == "fallback reply"
+    assert llm.breaker.state == "open"
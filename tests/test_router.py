@@ -0,0 +1,21 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from router import LARGE, SMALL, ModelRouter
+
+LONG = SimpleNamespace(messages=[SimpleNamespace(content="long question")], dropped_messages=0, prompt_tokens=1000)
+
+
+def test_slow_large_model_sheds_long_prompts_until_samples_age_out():
+    router = ModelRouter(lambda name: name, latency_slo=1.0, latency_window=0.1)
+    assert router.choose(LONG.messages, LONG) == (LARGE, "long_prompt")
+    for _ in range(20):
+        router.record(LARGE, 5.0)
+    assert router.choose(LONG.messages, LONG) == (SMALL, "latency_slo")
+    time.sleep(0.15)
+    assert not router.over_slo()
+    assert router.choose(LONG.messages, LONG) == (LARGE, "long_prompt")
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from semantic_cache import SemanticCache
+
+SAME = [
+    ("any advice for me", "Any advice?"),
+    ("Can you tell me a joke?", "tell me a joke"),
+    ("What is the capital of France?", "what's the capital of france"),
+    ("Write a haiku about Flask", "write a haiku about flask please"),
+    ("Some youtube video idea", "some youtube video ideas"),
+]
+DIFFERENT = [
+    ("Is Python better than Java?", "Is Java better than Python?"),
+    ("convert celsius to fahrenheit", "convert fahrenheit to celsius"),
+    ("Should I quit my job?", "Should I not quit my job?"),
+    ("I love my job", "I don't love my job"),
+    ("How do I learn Python?", "How do I learn Java?"),
+    ("Write a poem about dogs", "Write a poem about cats"),
+    ("Explain quantum computing to a child", "Explain quantum computing to an expert"),
+    ("Who won the 2018 world cup?", "Who won the 2022 world cup?"),
+    ("Who won the world cup in 2018?", "Who won the world cup in 2022?"),
+]
+
+
+@pytest.mark.parametrize("cached, asked", SAME)
+def test_rephrased_prompt_hits(cached, asked):
+    cache = SemanticCache()
+    cache.set("model", cached, "reply")
+    assert cache.get("model", asked) == "reply"
+
+
+@pytest.mark.parametrize("cached, asked", DIFFERENT)
+def test_different_prompt_misses(cached, asked):
+    cache = SemanticCache()
+    cache.set("model", cached, "reply")
+    assert cache.get("model", asked) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_namespaces_are_separate():
+    cache = SemanticCache()
+    cache.set("large", "tell me a joke", "reply")
+    assert cache.get("small", "tell me a joke") is None
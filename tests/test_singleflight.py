@@ -0,0 +1,230 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from singleflight import SingleFlight
+
+
+class Upstream:
+    """Counts calls and remembers whether its stream was closed before the end."""
+
+    def __init__(self, chunks=("a", "b", "c"), delay=0.05, error=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.produced = 0
+        self.closed = threading.Event()
+
+    def call(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return "".join(self.chunks)
+
+    def stream(self):
+        self.calls += 1
+        try:
+            for chunk in self.chunks:
+                time.sleep(self.delay)
+                self.produced += 1
+                yield chunk
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed.set()
+
+    async def acall(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return "".join(self.chunks)
+
+    async def astream(self):
+        self.calls += 1
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                self.produced += 1
+                yield chunk
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed.set()
+
+
+def together(n, fn):
+    """Runs fn in n threads at once; returns each result or the exception it raised."""
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_calls_share_one_result():
+    flight, upstream = SingleFlight(), Upstream()
+    assert together(5, lambda: flight.do("key", upstream.call)) == ["abc"] * 5
+    assert upstream.calls == 1
+    assert flight.shared == 4
+    # Finished calls are forgotten, so the next one goes upstream again
+    flight.do("key", upstream.call)
+    assert upstream.calls == 2
+
+
+def test_call_errors_reach_every_caller():
+    flight, upstream = SingleFlight(), Upstream(error=ValueError("down"))
+    results = together(5, lambda: flight.do("key", upstream.call))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert upstream.calls == 1
+
+
+def test_concurrent_streams_share_every_chunk():
+    flight, upstream = SingleFlight(), Upstream()
+    assert together(3, lambda: list(flight.stream("key", upstream.stream))) == [["a", "b", "c"]] * 3
+    assert upstream.calls == 1
+
+
+def test_late_joiner_replays_earlier_chunks():
+    flight, upstream = SingleFlight(), Upstream()
+    first = flight.stream("key", upstream.stream)
+    assert next(first) == "a"
+    late = flight.stream("key", upstream.stream)
+    assert list(late) == ["a", "b", "c"]
+    assert list(first) == ["b", "c"]
+    assert upstream.calls == 1
+
+
+def test_stream_errors_reach_every_subscriber():
+    flight, upstream = SingleFlight(), Upstream(error=ValueError("down"))
+
+    def read():
+        chunks = []
+        with pytest.raises(ValueError):
+            for chunk in flight.stream("key", upstream.stream):
+                chunks.append(chunk)
+        return chunks
+    assert together(3, read) == [["a", "b", "c"]] * 3
+
+
+def test_stream_stops_once_every_subscriber_closes():
+    flight, upstream = SingleFlight(), Upstream(chunks=tuple("abcdefghij"))
+    first = flight.stream("key", upstream.stream)
+    second = flight.stream("key", upstream.stream)
+    assert next(first) == next(second) == "a"
+    first.close()
+    assert next(second) == "b"
+    second.close()
+    assert upstream.closed.wait(1)
+    assert upstream.produced < 10
+    # The abandoned stream isn't joined by the next caller
+    assert list(flight.stream("key", upstream.stream)) == list("abcdefghij")
+    assert upstream.calls == 2
+
+
+def test_cancel_wakes_a_waiting_subscriber():
+    flight, upstream = SingleFlight(), Upstream(delay=1.0)
+    subscription = flight.stream("key", upstream.stream)
+    threading.Timer(0.05, subscription.cancel).start()
+    start = time.monotonic()
+    assert list(subscription) == []
+    assert time.monotonic() - start < 0.5
+    assert upstream.closed.wait(2)
+
+
+def test_async_calls_share_one_result_and_errors():
+    async def run():
+        flight, upstream = SingleFlight(), Upstream()
+        assert await asyncio.gather(*[flight.ado("key", upstream.acall) for _ in range(5)]) == ["abc"] * 5
+        assert upstream.calls == 1
+
+        failing = Upstream(error=ValueError("down"))
+        results = await asyncio.gather(*[flight.ado("key", failing.acall) for _ in range(5)],
+                                       return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert failing.calls == 1
+        assert flight.shared == 8
+    asyncio.run(run())
+
+
+def test_async_call_is_cancelled_with_its_last_caller():
+    async def run():
+        flight = SingleFlight()
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def call():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.ado("key", call)) for _ in range(2)]
+        await started.wait()
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+        callers[1].cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+    asyncio.run(run())
+
+
+def test_async_streams_share_chunks_and_replay_to_late_joiners():
+    async def run():
+        flight, upstream = SingleFlight(), Upstream()
+
+        async def read(delay=0):
+            await asyncio.sleep(delay)
+            return [chunk async for chunk in flight.astream("key", upstream.astream)]
+        assert await asyncio.gather(read(), read(), read(0.07)) == [["a", "b", "c"]] * 3
+        assert upstream.calls == 1
+    asyncio.run(run())
+
+
+def test_async_stream_errors_reach_every_subscriber():
+    async def run():
+        flight, upstream = SingleFlight(), Upstream(error=ValueError("down"))
+
+        async def read():
+            chunks = []
+            with pytest.raises(ValueError):
+                async for chunk in flight.astream("key", upstream.astream):
+                    chunks.append(chunk)
+            return chunks
+        assert await asyncio.gather(read(), read()) == [["a", "b", "c"]] * 2
+    asyncio.run(run())
+
+
+def test_async_stream_stops_once_every_subscriber_closes():
+    async def run():
+        flight, upstream = SingleFlight(), Upstream(chunks=tuple("abcdefghij"))
+        first = flight.astream("key", upstream.astream)
+        second = flight.astream("key", upstream.astream)
+        assert await anext(first) == await anext(second) == "a"
+        await first.aclose()
+        assert await anext(second) == "b"
+        await second.aclose()
+        await asyncio.sleep(0.01)
+        assert upstream.closed.is_set()
+        assert upstream.produced < 10
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from conversation import Message
+from store import MemoryStore, SQLiteStore
+
+
+def contents(conversation):
+    return [m.content for m in conversation]
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two stores on one file, as two worker processes would have."""
+    path = str(tmp_path / "chat.db")
+    return SQLiteStore(path), SQLiteStore(path)
+
+
+def test_workers_see_each_others_appends(workers):
+    a, b = workers
+    a.append("c", Message("user", "hi"), Message("ai", "hello"))
+    assert contents(b.load("c")) == ["hi", "hello"]
+    b.append("c", Message("user", "cats?"))
+    a.append("c", Message("ai", "meow"))
+    assert contents(a.load("c")) == contents(b.load("c")) == ["hi", "hello", "cats?", "meow"]
+
+
+def test_workers_see_each_others_forks_and_switches(workers):
+    a, b = workers
+    a.append("c", Message("user", "hi"), Message("ai", "hello"), Message("user", "cats?"))
+    a.load("c")
+    b.fork("c", 1, Message("user", "dogs?"))
+    conversation = a.load("c")
+    assert contents(conversation) == ["hi", "hello", "dogs?"]
+    assert conversation.forks() == [{"id": 3, "siblings": [2, 3], "index": 1}]
+    a.switch("c", 2)
+    assert contents(b.load("c")) == ["hi", "hello", "cats?"]
+    # A turn after the switch continues the branch switched to
+    b.append("c", Message("ai", "meow"))
+    assert contents(a.load("c")) == ["hi", "hello", "cats?", "meow"]
+
+
+def test_delete_and_recreate_elsewhere_drops_the_cached_copy(workers):
+    a, b = workers
+    a.append("c", Message("user", "old"), Message("ai", "reply"))
+    a.load("c")
+    b.delete("c")
+    assert len(a.load("c")) == 0
+    a.load("c")
+    b.append("c", Message("user", "new"))
+    assert contents(a.load("c")) == ["new"]
+    # Same length as the stale copy, but a different conversation
+    b.delete("c")
+    b.append("c", Message("user", "newer"), Message("ai", "reply"))
+    a.append("c", Message("user", "again"))
+    assert contents(a.load("c")) == contents(b.load("c")) == ["newer", "reply", "again"]
+
+
+def test_page_reads_the_branch_without_the_cache(workers):
+    a, b = workers
+    a.append("c", *[Message("user" if i % 2 == 0 else "ai", f"m{i}") for i in range(6)])
+    a.fork("c", 3, Message("user", "edited"))
+    messages, more = b.page("c", limit=3)
+    assert [(m.id, m.content) for m in messages] == [(2, "m2"), (3, "m3"), (6, "edited")] and more
+    messages, more = b.page("c", before=2, limit=3)
+    assert [m.content for m in messages] == ["m0", "m1"] and not more
+
+
+@pytest.mark.parametrize("make", [MemoryStore, lambda: SQLiteStore(":memory:")])
+def test_summaries_round_trip(make):
+    store = make()
+    summary = {"text": "they talked", "upto": 2, "node": 1, "tokens": 3}
+    store.append("c", Message("user", "hi"))
+    store.set_summary("c", summary)
+    assert store.get_summary("c") == summary
+    store.delete("c")
+    assert store.get_summary("c") is None
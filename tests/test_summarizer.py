@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from conversation import Message
+from fakellm import FakeChatModel
+from store import MemoryStore
+from summarizer import Summarizer
+
+
+def chat(store, n):
+    for i in range(n):
+        store.append("c", Message("user" if i % 2 == 0 else "ai", f"line {i}"))
+
+
+def test_summary_is_dropped_after_an_edit_until_its_branch_returns():
+    store = MemoryStore()
+    chat(store, 6)
+    summarizer = Summarizer(store)
+    summarizer._refresh("c", 4, FakeChatModel(latency=0, reply="old branch"))
+    assert summarizer.current("c", store.load("c"))["node"] == 3
+
+    # Edit the second message, then grow the new branch past the summary
+    store.fork("c", 0, Message("ai", "edited"))
+    for i in range(4):
+        store.append("c", Message("user" if i % 2 else "ai", f"new {i}"))
+    assert summarizer.current("c", store.load("c")) is None
+
+    store.switch("c", 5)
+    assert summarizer.current("c", store.load("c"))["text"] == "old branch"
+
+
+def test_refresh_outrun_by_a_branch_switch_is_not_stored():
+    store = MemoryStore()
+    chat(store, 6)
+
+    class Editing(FakeChatModel):
+        def _call(self, messages):
+            # The user edits while the summary is being written
+            store.fork("c", 0, Message("ai", "edited"))
+            return super()._call(messages)
+
+    Summarizer(store)._refresh("c", 4, Editing(latency=0, reply="old branch"))
+    assert store.get_summary("c") is None